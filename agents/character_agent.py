@@ -1,18 +1,21 @@
 from dataclasses import dataclass
 from pydantic_ai import Agent, RunContext
 from utils.llm import chat_model
+from utils.workspace import Workspace
 
 @dataclass
 class CharacterAgentOutput:
     name: str
     character_setting: str
 
-character_agent = Agent(model=chat_model, output_type=list[CharacterAgentOutput])
+character_agent = Agent(
+    model=chat_model, deps_type=Workspace, output_type=list[CharacterAgentOutput]
+)
 
 @character_agent.instructions
-def generate_sd_prompt(ctx: RunContext) -> str:
+def generate_sd_prompt(ctx: RunContext[Workspace]) -> str:
     """为小说人物生成 Stable Diffusion 角色提示词（中文说明、英文提示词）。"""
-    with open("output/novel_content.txt", "r", encoding="utf-8") as f:
+    with open(ctx.deps.novel_content, "r", encoding="utf-8") as f:
         novel_content = f.read()
     return f"""
 你是一名专业插画师。请从下方小说内容中抽取所有主要人物，并为每位角色生成用于 Stable Diffusion 的角色提示词（SD prompt）。
@@ -41,6 +44,7 @@ if __name__ == "__main__":
         async with character_agent:
             res = await character_agent.run(
                 user_prompt="请按照要求生成角色设定。",
+                deps=Workspace(),
             )
         print(res.output)
 
@@ -1,9 +1,8 @@
+import asyncio
 import json
-import os
-from time import sleep
 from pydantic_ai import Agent, RunContext
-from utils.edge_tts import generate_audio_for_script
 from utils.llm import chat_model
+from utils.metrics import AGENT_RUN_SECONDS
 from utils.task_manager import task_manager
 from .character_agent import character_agent
 from .novel_agent import novel_agent, NovelAgentDeps
@@ -12,6 +11,7 @@ from ag_ui.core import EventType, StateSnapshotEvent
 from pydantic import BaseModel
 from pydantic_ai.ag_ui import StateDeps
 from utils.config import system_prompt
+from utils.workspace import Workspace, new_run_id
 
 
 class AgentState(BaseModel):
@@ -19,11 +19,31 @@ class AgentState(BaseModel):
 
     message: str = ""
     detail: str = ""
+    # 当前运行的ID，对应 output/runs/{run_id}/ 工作区
+    run_id: str = ""
 
 
 main_agent = Agent(model=chat_model, deps_type=StateDeps[AgentState])
 
 
+def _workspace(ctx: RunContext[StateDeps[AgentState]], new_run: bool = False) -> Workspace:
+    """取得当前会话的工作区；尚无运行ID或开始新的运行时分配新ID并写入状态"""
+    state = ctx.deps.state
+    if new_run or not state.run_id:
+        state.run_id = new_run_id()
+    workspace = Workspace(state.run_id)
+    workspace.ensure_dirs()
+    return workspace
+
+
+def _snapshot(ctx: RunContext[StateDeps[AgentState]], message: str, detail: str = "") -> StateSnapshotEvent:
+    """构造状态快照；快照会整体替换前端状态，因此需带上 run_id"""
+    return StateSnapshotEvent(
+        type=EventType.STATE_SNAPSHOT,
+        snapshot={"message": message, "detail": detail, "run_id": ctx.deps.state.run_id},
+    )
+
+
 @main_agent.instructions
 def main_instructions(ctx: RunContext[StateDeps[AgentState]]) -> str:
     return f"""
@@ -33,10 +53,11 @@ def main_instructions(ctx: RunContext[StateDeps[AgentState]]) -> str:
 1. 调用工具创建小说
 2. 调用工具创建人物设定
 3. 调用工具生成分镜场景
-4. 调用工具批量生成所有场景图片（异步执行）
-5. 调用工具查询图片生成状态，直到完成
-6. 调用工具生成音频和字幕
-7. 调用工具开始视频合成，执行成功后提醒用户关注后台生成进度。
+4. 调用工具启动视频生成流水线（图片、配音与分镜视频片段并行执行，异步）
+5. 调用工具查询流水线任务状态，直到完成
+
+如需单独重做某个环节，可分别调用批量生成场景图片、生成音频和字幕、开始视频合成的工具。
+若图片生成或流水线任务因部分场景失败而结束，使用 resume=True 重新提交，只会重新生成缺失或失败的场景。
 
 当视频合成完成后，系统将自动通知用户。你可以结束并给用户汇总执行结果。
 
@@ -44,34 +65,42 @@ def main_instructions(ctx: RunContext[StateDeps[AgentState]]) -> str:
 """
 
 
-@main_agent.tool_plain
-async def novel_creation(baseline: str, word_limit: int = 1000) -> StateSnapshotEvent:
-    result = await novel_agent.run(
-        user_prompt="请根据要求编写小说。",
-        deps=NovelAgentDeps(baseline=baseline, word_limit=word_limit),
-    )
+@main_agent.tool
+async def novel_creation(
+    ctx: RunContext[StateDeps[AgentState]], baseline: str, word_limit: int = 1000
+) -> StateSnapshotEvent:
+    # 创建小说是一次视频制作的起点，使用新的工作区
+    workspace = _workspace(ctx, new_run=True)
+    with AGENT_RUN_SECONDS.time(agent="novel_agent"):
+        result = await novel_agent.run(
+            user_prompt="请根据要求编写小说。",
+            deps=NovelAgentDeps(baseline=baseline, word_limit=word_limit),
+        )
     # save novel
     novel_content = result.output
-    with open("output/novel_content.txt", "w", encoding="utf-8") as f:
+    with open(workspace.novel_content, "w", encoding="utf-8") as f:
         f.write(novel_content)
-    return StateSnapshotEvent(
-        type=EventType.STATE_SNAPSHOT,
-        snapshot={"message": "小说内容已创建。", "detail": novel_content},
-    )
-
-
-@main_agent.tool_plain
-async def send_current_plan(message: str, detail: str) -> StateSnapshotEvent:
-    return StateSnapshotEvent(
-        type=EventType.STATE_SNAPSHOT, snapshot={"message": message, "detail": detail}
-    )
-
-
-@main_agent.tool_plain
-async def generate_character_settings() -> StateSnapshotEvent:
-    result = await character_agent.run(
-        user_prompt="请根据要求生成角色设定。",
-    )
+    await asyncio.to_thread(task_manager.notify_file, workspace.novel_content)
+    return _snapshot(ctx, "小说内容已创建。", novel_content)
+
+
+@main_agent.tool
+async def send_current_plan(
+    ctx: RunContext[StateDeps[AgentState]], message: str, detail: str
+) -> StateSnapshotEvent:
+    return _snapshot(ctx, message, detail)
+
+
+@main_agent.tool
+async def generate_character_settings(
+    ctx: RunContext[StateDeps[AgentState]],
+) -> StateSnapshotEvent:
+    workspace = _workspace(ctx)
+    with AGENT_RUN_SECONDS.time(agent="character_agent"):
+        result = await character_agent.run(
+            user_prompt="请根据要求生成角色设定。",
+            deps=workspace,
+        )
     # save character settings
     character_settings = []
     # format to dict
@@ -82,90 +111,108 @@ async def generate_character_settings() -> StateSnapshotEvent:
                 "character_setting": item.character_setting,
             }
         )
-    with open("output/character_settings.json", "w", encoding="utf-8") as f:
+    with open(workspace.character_settings, "w", encoding="utf-8") as f:
         json.dump(character_settings, f, ensure_ascii=False, indent=4)
-    return StateSnapshotEvent(
-        type=EventType.STATE_SNAPSHOT,
-        snapshot={
-            "message": "角色设定已创建。",
-            "detail": json.dumps(character_settings, ensure_ascii=False, indent=4),
-        },
+    await asyncio.to_thread(task_manager.notify_file, workspace.character_settings)
+    return _snapshot(
+        ctx,
+        "角色设定已创建。",
+        json.dumps(character_settings, ensure_ascii=False, indent=4),
     )
 
 
-@main_agent.tool_plain
-async def generate_scenes() -> StateSnapshotEvent:
-    scenes = await scene_agent.run(
-        user_prompt="请根据要求生成场景。",
-    )
+@main_agent.tool
+async def generate_scenes(ctx: RunContext[StateDeps[AgentState]]) -> StateSnapshotEvent:
+    workspace = _workspace(ctx)
+    with AGENT_RUN_SECONDS.time(agent="scene_agent"):
+        scenes = await scene_agent.run(
+            user_prompt="请根据要求生成场景。",
+            deps=workspace,
+        )
+    await asyncio.to_thread(task_manager.notify_file, workspace.scenes)
 
-    return StateSnapshotEvent(
-        type=EventType.STATE_SNAPSHOT,
-        snapshot={
-            "message": f"场景已创建。总共 {len(scenes.output)} 个场景。",
-            "detail": json.dumps(scenes.output, ensure_ascii=False, indent=4),
-        },
+    return _snapshot(
+        ctx,
+        f"场景已创建。总共 {len(scenes.output)} 个场景。",
+        json.dumps(scenes.output, ensure_ascii=False, indent=4),
     )
 
 
-@main_agent.tool_plain
-async def generate_all_scene_images() -> StateSnapshotEvent:
-    """批量生成所有场景图片（异步执行）"""
-    with open("output/scenes.json", "r", encoding="utf-8") as f:
+@main_agent.tool
+async def generate_all_scene_images(
+    ctx: RunContext[StateDeps[AgentState]], resume: bool = False
+) -> StateSnapshotEvent:
+    """批量生成所有场景图片（异步执行）
+
+    Args:
+        resume: 图片任务失败后重试时设为 True，只重新生成缺失或失败的场景
+    """
+    workspace = _workspace(ctx)
+    with open(workspace.scenes, "r", encoding="utf-8") as f:
         scenes = json.load(f)
 
     # 提交异步图片生成任务
-    task_id = await task_manager.submit_image_generation_task(scenes)
+    task_id = await task_manager.submit_image_generation_task(
+        scenes, resume=resume, workspace=workspace
+    )
 
-    return StateSnapshotEvent(
-        type=EventType.STATE_SNAPSHOT,
-        snapshot={
-            "message": f"已开始批量生成 {len(scenes)} 个场景图片。",
-            "detail": f"任务ID: {task_id}\n请使用查询任务状态工具监控进度。",
-        },
+    return _snapshot(
+        ctx,
+        f"已开始批量生成 {len(scenes)} 个场景图片。",
+        f"任务ID: {task_id}\n请使用查询任务状态工具监控进度。",
     )
 
 
-@main_agent.tool_plain
-async def generate_audios() -> StateSnapshotEvent:
-    with open("output/scenes.json", "r", encoding="utf-8") as f:
-        scene = json.load(f)
-
-    for idx, item in enumerate(scene):
-        # 2) 保存脚本文本
-        script_path = f"output/scripts/scene_{idx}.txt"
-        os.makedirs("output/scripts", exist_ok=True)
-        with open(script_path, "w", encoding="utf-8") as sf:
-            sf.write(item["script"])
-        # 3) 生成音频与字幕
-        audio_path = f"output/audio/scene_{idx}.mp3"
-        srt_path = f"output/subtitles/scene_{idx}.srt"
-        generate_audio_for_script(
-            script_path=script_path, audio_path=audio_path, srt_path=srt_path
-        )
+@main_agent.tool
+async def start_video_pipeline(
+    ctx: RunContext[StateDeps[AgentState]], resume: bool = False
+) -> StateSnapshotEvent:
+    """启动视频生成流水线：图片、配音与分镜片段按依赖并行执行（异步执行）
 
-    return StateSnapshotEvent(
-        type=EventType.STATE_SNAPSHOT,
-        snapshot={
-            "message": "分镜配音已生成。",
-            "detail": "音频文件已保存至 output/audio/ 目录\n字幕文件已保存至 output/subtitles/ 目录",
-        },
+    Args:
+        resume: 重新执行时设为 True，复用提示词未变化的已有场景图片
+    """
+    workspace = _workspace(ctx)
+    with open(workspace.scenes, "r", encoding="utf-8") as f:
+        scenes = json.load(f)
+
+    task_id = await task_manager.submit_pipeline_task(
+        scenes, resume=resume, workspace=workspace
+    )
+
+    return _snapshot(
+        ctx,
+        f"已启动视频生成流水线，共 {len(scenes)} 个场景。",
+        f"任务ID: {task_id}\n请使用查询任务状态工具监控进度。",
     )
 
 
-@main_agent.tool_plain
-async def check_task_status(task_id: str) -> StateSnapshotEvent:
-    """查询任务状态"""
-    task = task_manager.get_task(task_id)
+@main_agent.tool
+async def generate_audios(ctx: RunContext[StateDeps[AgentState]]) -> StateSnapshotEvent:
+    """为所有场景并发生成配音和字幕（异步执行）"""
+    workspace = _workspace(ctx)
+    with open(workspace.scenes, "r", encoding="utf-8") as f:
+        scenes = json.load(f)
+
+    task_id = await task_manager.submit_audio_generation_task(scenes, workspace=workspace)
+
+    return _snapshot(
+        ctx,
+        f"已开始为 {len(scenes)} 个场景生成配音和字幕。",
+        f"任务ID: {task_id}\n音频文件将保存至 {workspace.audio_dir}/ 目录，"
+        f"字幕文件将保存至 {workspace.subtitles_dir}/ 目录\n请使用查询任务状态工具监控进度。",
+    )
+
+
+@main_agent.tool
+async def check_task_status(
+    ctx: RunContext[StateDeps[AgentState]], task_id: str
+) -> StateSnapshotEvent:
+    """查询任务状态（最多等待 25 秒，任务结束或有明显进展时立即返回）"""
+    task = await task_manager.wait_for(task_id, timeout=25, min_progress_delta=10)
 
     if not task:
-        return StateSnapshotEvent(
-            type=EventType.STATE_SNAPSHOT,
-            snapshot={
-                "message": "任务不存在。",
-                "detail": f"未找到任务ID: {task_id}",
-            },
-        )
+        return _snapshot(ctx, "任务不存在。", f"未找到任务ID: {task_id}")
 
     status_info = {
         "task_id": task.task_id,
@@ -182,56 +229,61 @@ async def check_task_status(task_id: str) -> StateSnapshotEvent:
                 task.result.get("completed_images", 0) if task.result else 0
             )
             message = f"✅ 图片生成任务已完成！共生成 {completed_images} 张图片。"
-        elif task.task_type.value == "video_composition":
+        elif task.task_type.value == "audio_generation":
+            completed = len(task.result.get("completed_scenes", [])) if task.result else 0
+            message = f"✅ 配音任务已完成！共生成 {completed} 个场景的音频和字幕。"
+        elif task.task_type.value in ("video_composition", "video_pipeline"):
             output_path = task.result.get("output_path", "") if task.result else ""
             message = f"✅ 视频合成任务已完成！输出文件: {output_path}"
         else:
             message = "✅ 任务已完成！"
     elif task.status.value == "failed":
         message = f"❌ 任务执行失败: {task.error_message}"
+    elif task.status.value == "cancelled":
+        message = "⛔ 任务已取消。"
     elif task.status.value == "running":
         message = f"🔄 任务正在执行中，进度: {task.progress:.1f}%"
     else:
         message = "⏳ 任务等待中..."
 
-    sleep(25)
-
-    return StateSnapshotEvent(
-        type=EventType.STATE_SNAPSHOT,
-        snapshot={
-            "message": message,
-            "detail": json.dumps(status_info, ensure_ascii=False, indent=2),
-        },
-    )
+    return _snapshot(ctx, message, json.dumps(status_info, ensure_ascii=False, indent=2))
 
 
-@main_agent.tool_plain
-async def start_video_composition() -> StateSnapshotEvent:
+@main_agent.tool
+async def start_video_composition(
+    ctx: RunContext[StateDeps[AgentState]],
+) -> StateSnapshotEvent:
     """开始视频合成（异步执行）"""
-    await task_manager.submit_video_composition_task()
-
-    return StateSnapshotEvent(
-        type=EventType.STATE_SNAPSHOT,
-        snapshot={
-            "message": "已开始视频合成任务。",
-            "detail": "视频生成已开始，请您关注后台生成进度。",
-        },
+    await task_manager.submit_video_composition_task(workspace=_workspace(ctx))
+
+    return _snapshot(ctx, "已开始视频合成任务。", "视频生成已开始，请您关注后台生成进度。")
+
+
+@main_agent.tool
+async def cancel_task(
+    ctx: RunContext[StateDeps[AgentState]], task_id: str
+) -> StateSnapshotEvent:
+    """取消正在执行或等待中的任务，释放 ComfyUI 与视频渲染资源"""
+    # 任务存储的读写可能等待数据库锁，放到线程中执行，不阻塞事件循环
+    if not await asyncio.to_thread(task_manager.cancel_task, task_id):
+        task = await asyncio.to_thread(task_manager.get_task, task_id)
+        detail = f"未找到任务ID: {task_id}" if task is None else f"任务当前状态: {task.status.value}"
+        return _snapshot(ctx, "任务不存在或已结束，无法取消。", detail)
+
+    return _snapshot(
+        ctx,
+        "已发送取消请求。",
+        f"任务ID: {task_id}\n正在中止的步骤会在数秒内停止，可使用查询任务状态工具确认。",
     )
 
 
-@main_agent.tool_plain
-async def get_all_tasks_status() -> StateSnapshotEvent:
+@main_agent.tool
+async def get_all_tasks_status(ctx: RunContext[StateDeps[AgentState]]) -> StateSnapshotEvent:
     """获取所有任务状态"""
-    all_tasks = task_manager.get_all_tasks_status()
+    all_tasks = await asyncio.to_thread(task_manager.get_all_tasks_status)
 
     if not all_tasks:
-        return StateSnapshotEvent(
-            type=EventType.STATE_SNAPSHOT,
-            snapshot={
-                "message": "当前没有任何任务。",
-                "detail": "",
-            },
-        )
+        return _snapshot(ctx, "当前没有任何任务。")
 
     # 按状态分组统计
     status_summary = {}
@@ -245,14 +297,10 @@ async def get_all_tasks_status() -> StateSnapshotEvent:
     for status, count in status_summary.items():
         summary_text += f"- {status}: {count} 个任务\n"
 
-    return StateSnapshotEvent(
-        type=EventType.STATE_SNAPSHOT,
-        snapshot={
-            "message": f"当前共有 {len(all_tasks)} 个任务。",
-            "detail": summary_text
-            + "\n详细信息:\n"
-            + json.dumps(all_tasks, ensure_ascii=False, indent=2),
-        },
+    return _snapshot(
+        ctx,
+        f"当前共有 {len(all_tasks)} 个任务。",
+        summary_text + "\n详细信息:\n" + json.dumps(all_tasks, ensure_ascii=False, indent=2),
     )
 
 
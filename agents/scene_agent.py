@@ -2,16 +2,18 @@ import json
 from pydantic_ai import Agent, RunContext
 from agents.image_agent import ImageAgentDeps, image_agent
 from utils.llm import chat_model
+from utils.metrics import AGENT_RUN_SECONDS
+from utils.workspace import Workspace
 from ag_ui.core import EventType, StateSnapshotEvent
 
-scene_agent = Agent(model=chat_model, output_type=list[str])
+scene_agent = Agent(model=chat_model, deps_type=Workspace, output_type=list[str])
 
 
 @scene_agent.instructions
-def generate_scenes_and_images(ctx: RunContext) -> str:
+def generate_scenes_and_images(ctx: RunContext[Workspace]) -> str:
     """生成分镜脚本和对应的图片"""
 
-    with open("output/novel_content.txt", "r", encoding="utf-8") as f:
+    with open(ctx.deps.novel_content, "r", encoding="utf-8") as f:
         novel_content = f.read()
 
     return f"""
@@ -34,21 +36,24 @@ def generate_scenes_and_images(ctx: RunContext) -> str:
 """
 
 
-@scene_agent.tool_plain
-async def generate_scenes(scripts: list[str]) -> StateSnapshotEvent:
-    with open("output/character_settings.json", "r", encoding="utf-8") as f:
+@scene_agent.tool
+async def generate_scenes(
+    ctx: RunContext[Workspace], scripts: list[str]
+) -> StateSnapshotEvent:
+    with open(ctx.deps.character_settings, "r", encoding="utf-8") as f:
         character_settings = f.read()
 
     scene = []
     for item in scripts:
-        result = await image_agent.run(
-            "请生成分镜图像",
-            deps=ImageAgentDeps(script=item, character_settings=character_settings),
-        )
+        with AGENT_RUN_SECONDS.time(agent="image_agent"):
+            result = await image_agent.run(
+                "请生成分镜图像",
+                deps=ImageAgentDeps(script=item, character_settings=character_settings),
+            )
         sd_prompt = result.output
         scene.append({"script": item, "sd_prompt": sd_prompt})
 
-    with open("output/scenes.json", "w", encoding="utf-8") as f:
+    with open(ctx.deps.scenes, "w", encoding="utf-8") as f:
         json.dump(scene, f, ensure_ascii=False, indent=4)
 
     return StateSnapshotEvent(
@@ -64,6 +69,7 @@ if __name__ == "__main__":
         async with scene_agent:
             res = await scene_agent.run(
                 user_prompt="请帮我生成合适的分镜",
+                deps=Workspace(),
             )
         print(res.output)
 
@@ -1,16 +1,22 @@
 # 导入日志监控库logfire
+import asyncio
+import json
 import os
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 import uvicorn
 
 # 导入主控制器
 from agents.main_agent import AgentState, main_agent
 from pydantic_ai.ag_ui import StateDeps
+from utils import metrics
 from utils.output_tree import build_output_tree
+from utils.task_manager import task_manager
+from utils.workspace import Workspace
 
 app = FastAPI()
 
@@ -33,7 +39,7 @@ app.add_middleware(
 
 @app.get("/api/output-tree")
 def get_output_tree() -> Dict[str, Any]:
-    """返回 output 目录当前快照（树结构）。前端可每秒轮询一次。"""
+    """返回 output 目录当前快照（树结构）。前端在收到 /api/events 的文件事件后重新拉取。"""
     base = Path("output").resolve()
     return build_output_tree(base)
 
@@ -44,6 +50,79 @@ def get_file_tree() -> Dict[str, Any]:
     return get_output_tree()
 
 
+@app.get("/metrics")
+def get_metrics() -> PlainTextResponse:
+    """Prometheus 指标。耗时直方图汇总所有 worker，执行器指标为处理本次请求的 worker 的视图。"""
+    task_manager.collect_metrics()
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.post("/api/tasks/{task_id}/cancel")
+def cancel_task(task_id: str) -> Dict[str, Any]:
+    """取消任务。运行中的任务会在数秒内由执行它的 worker 中止。"""
+    cancelled = task_manager.cancel_task(task_id)
+    task = task_manager.get_task(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {task_id}")
+    return {"task_id": task_id, "cancelled": cancelled, "status": task.status.value}
+
+
+@app.get("/api/tasks/{task_id}/scenes/{scene_id}/preview")
+def get_scene_preview(task_id: str, scene_id: int) -> Response:
+    """场景图片渲染中的最新潜空间预览图，便于及早发现效果不佳的渲染并取消任务。
+
+    需要 ComfyUI 以 --preview-method auto 启动；场景未在渲染或尚无预览时返回 404。
+    """
+    task = task_manager.get_task(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {task_id}")
+    workspace = Workspace((task.params or {}).get("run_id", ""))
+    try:
+        with open(workspace.image_preview(scene_id), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"场景 {scene_id} 暂无预览图")
+    media_type = "image/png" if data.startswith(b"\x89PNG") else "image/jpeg"
+    return Response(data, media_type=media_type, headers={"Cache-Control": "no-store"})
+
+
+@app.get("/api/events")
+async def stream_events(request: Request, last_event_id: Optional[str] = Header(None)):
+    """SSE 事件流：推送任务进度变化（event: task）与输出文件创建（event: file）。
+
+    断线重连时浏览器会携带 Last-Event-ID 头，从该事件之后继续推送；
+    若所需事件已被清理，则先发送一条 reset 事件，前端应重新拉取完整文件树。
+    """
+
+    async def event_stream():
+        yield "retry: 3000\n\n"
+        first_id, latest_id = await asyncio.to_thread(task_manager.store.event_id_range)
+        if last_event_id and last_event_id.isdigit():
+            cursor = int(last_event_id)
+            if first_id and cursor < first_id - 1:
+                yield "event: reset\ndata: {}\n\n"
+        else:
+            # 新连接只推送此后的事件，当前状态由前端自行拉取
+            cursor = latest_id
+
+        while not await request.is_disconnected():
+            events = await task_manager.next_events(cursor, timeout=15)
+            if not events:
+                # 心跳，防止代理断开空闲连接
+                yield ": ping\n\n"
+                continue
+            for item in events:
+                cursor = item["id"]
+                data = json.dumps(item["data"], ensure_ascii=False)
+                yield f"id: {item['id']}\nevent: {item['event']}\ndata: {data}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 app.mount("/agent", main_agent.to_ag_ui(deps=StateDeps(AgentState())))
 
 if __name__ == "__main__":
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+ComfyUI 图片流水线压测：启动若干离线替身服务（或使用 --url 指定的真实后端），
+并发提交图片请求，统计吞吐量、延迟分位数与失败数。
+
+    python scripts/bench_comfyui.py --images 64 --concurrency 8 --backends 2 --latency 0.5
+    python scripts/bench_comfyui.py --url 10.0.0.2:8188,10.0.0.3:8188 --images 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ComfyUI 图片流水线压测")
+    parser.add_argument("--url", default="", help="逗号分隔的真实后端地址；不指定时启动替身服务")
+    parser.add_argument("--images", type=int, default=32, help="请求的图片数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时在途的请求数")
+    parser.add_argument("--backends", type=int, default=1, help="启动的替身服务数")
+    parser.add_argument("--latency", type=float, default=0.5, help="替身服务每张图片的渲染秒数")
+    parser.add_argument("--jitter", type=float, default=0.2, help="替身服务渲染耗时的随机浮动比例")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="替身服务 prompt 失败概率")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="替身服务静默丢弃 prompt 的概率")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="替身服务发送图片前断开 websocket 的概率")
+    parser.add_argument("--steps", type=int, default=None, help="采样步数，默认使用工作流模板中的值")
+    parser.add_argument("--pack-size", type=int, default=None, help="覆盖 COMFYUI_PACK_SIZE")
+    parser.add_argument("--cache", action="store_true", help="启用图片渲染缓存（默认关闭，避免命中缓存影响结果）")
+    parser.add_argument("--image-scale", type=float, default=0.1, help="替身服务输出图片的缩放比例")
+    return parser.parse_args()
+
+
+async def run(args, comfy):
+    semaphore = asyncio.Semaphore(max(1, args.concurrency))
+    latencies = []
+    failures = []
+
+    async def one(index: int):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await comfy.generate(f"bench scene {index}", seed=index, steps=args.steps)
+            except Exception as e:
+                failures.append(f"{type(e).__name__}: {e}")
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.images)))
+    return time.perf_counter() - start, latencies, failures
+
+
+def main():
+    args = parse_args()
+    os.chdir(ROOT)
+
+    servers = []
+    if args.url:
+        addresses = args.url
+    else:
+        from utils.fake_comfyui import FakeComfyUIServer
+        servers = [
+            FakeComfyUIServer(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                              drop_rate=args.drop_rate, disconnect_rate=args.disconnect_rate,
+                              image_scale=args.image_scale, seed=i).start_in_thread()
+            for i in range(max(1, args.backends))
+        ]
+        addresses = ",".join(server.address for server in servers)
+
+    # 需在导入 utils.comfyui 之前设置
+    os.environ["COMFYUI_BASE_URL"] = addresses
+    if not args.cache:
+        os.environ["COMFYUI_CACHE_MAX_MB"] = "0"
+    if args.pack_size is not None:
+        os.environ["COMFYUI_PACK_SIZE"] = str(args.pack_size)
+    os.environ.setdefault("TASK_DB_PATH", ":memory:")
+    from utils import comfyui as comfy
+
+    try:
+        elapsed, latencies, failures = asyncio.run(run(args, comfy))
+        report(args, comfy, servers, addresses, elapsed, latencies, failures)
+    finally:
+        comfy.shutdown()
+        for server in servers:
+            server.stop()
+
+
+def report(args, comfy, servers, addresses, elapsed, latencies, failures):
+    print(f"后端: {addresses}")
+    print(f"图片: {args.images}，并发: {args.concurrency}，打包上限: {comfy.PACK_SIZE}")
+    print(f"耗时: {elapsed:.2f}s，吞吐: {len(latencies) / elapsed:.2f} 张/s")
+    print(f"延迟: p50 {percentile(latencies, 0.5):.2f}s，p95 {percentile(latencies, 0.95):.2f}s，"
+          f"max {max(latencies, default=0):.2f}s")
+    print(f"失败: {len(failures)}")
+    for message in sorted(set(failures))[:5]:
+        print(f"  - {message}")
+    for server in servers:
+        stats = server.stats
+        print(f"替身 {server.address}: prompt {stats.prompts}，图片 {stats.images}，"
+              f"注入失败 {stats.failures}，丢弃 {stats.dropped}，断线 {stats.disconnects}，"
+              f"最大排队 {stats.max_queue_depth}")
+    for backend in comfy.backend_stats():
+        latency = "-" if backend["latency"] is None else f"{backend['latency']:.2f}s"
+        print(f"调度 {backend['address']}: 健康 {backend['healthy']}，每张渲染耗时均值 {latency}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,22 @@
 #!/usr/bin/env python3
 """
 测试新的异步任务管理功能
+
+    python test_task_manager.py          # 使用 COMFYUI_BASE_URL 指向的 ComfyUI
+    python test_task_manager.py --fake   # 使用内置的 ComfyUI 替身服务
 """
 import asyncio
 import json
+import os
+import sys
+
+if "--fake" in sys.argv:
+    # 使用内置的 ComfyUI 替身服务，无需 GPU；需在导入 task_manager 之前设置后端地址
+    from utils.fake_comfyui import FakeComfyUIServer
+    fake_server = FakeComfyUIServer(latency=0.5, image_scale=0.25).start_in_thread()
+    os.environ["COMFYUI_BASE_URL"] = fake_server.address
+    print(f"🧪 使用 ComfyUI 替身服务: {fake_server.address}")
+
 from utils.task_manager import task_manager
 
 async def test_task_manager():
@@ -0,0 +1,120 @@
+"""
+测试公共配置：模块在导入时读取环境变量，须在导入被测模块之前设置
+"""
+import asyncio
+import os
+import time
+
+import pytest
+
+# 任务与指标写入进程内的内存数据库，测试不触碰 .cache/ 下的共享数据
+os.environ["TASK_DB_PATH"] = ":memory:"
+# 关闭图片与配音缓存，避免命中上一次运行的结果
+os.environ["COMFYUI_CACHE_MAX_MB"] = "0"
+os.environ["TTS_CACHE_MAX_MB"] = "0"
+# main.py 导入时创建 LLM 客户端（不发请求），只需要配置存在
+os.environ.setdefault("CHAT_MODEL", "test-model")
+os.environ.setdefault("CHAT_MODEL_KEY", "test-key")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from utils import comfyui, edge_tts, workflow
+from utils.fake_comfyui import FakeComfyUIServer
+from utils.task_manager import TaskManager
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """在临时目录中运行：output/ 写到临时目录，工作流模板仍从仓库读取"""
+    monkeypatch.setattr(workflow, "DEFAULT_WORKFLOW_PATH", os.path.join(ROOT, workflow.DEFAULT_WORKFLOW_PATH))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def comfyui_backends(monkeypatch):
+    """comfyui_backends(count, **参数)：在后台线程启动 FakeComfyUIServer，并让 ComfyUI 后端池只指向它们"""
+    servers = []
+
+    def start(count: int = 1, **params):
+        params = {"latency": 0.05, "image_scale": 0.05, "seed": 0, **params}
+        started = [FakeComfyUIServer(**params).start_in_thread() for _ in range(count)]
+        servers.extend(started)
+        monkeypatch.setattr(comfyui, "server_addresses", [server.address for server in servers])
+        monkeypatch.setattr(comfyui, "_pool", None)
+        return started
+
+    yield start
+    comfyui.shutdown()
+    for server in servers:
+        server.stop()
+
+
+class FakeTTS:
+    """edge_tts.Communicate 的替身：不联网，每个字一个 WordBoundary，每个字 0.25 秒音频
+
+    记录每次调用的参数与同时进行的合成数；文本在 fail 中时以 ConnectionError 失败。
+    """
+
+    # 48 kbps 下 0.25 秒的字节数与 edge-tts 时间单位（100 纳秒）下的 0.25 秒
+    CHUNK = bytes(1500)
+    TICKS = 2500000
+
+    def __init__(self):
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self.delay = 0.05
+        self.fail = set()
+
+    def __call__(self, text, **params):
+        self.calls.append(dict(params, text=text))
+        return _FakeCommunicate(self, text)
+
+
+class _FakeCommunicate:
+    def __init__(self, tts: FakeTTS, text: str):
+        self.tts = tts
+        self.text = text
+
+    async def stream(self):
+        tts = self.tts
+        tts.active += 1
+        tts.max_active = max(tts.max_active, tts.active)
+        try:
+            await asyncio.sleep(tts.delay)
+            if self.text in tts.fail:
+                raise ConnectionError("edge-tts 连接失败")
+            offset = 0
+            for char in self.text:
+                if not char.isalnum():
+                    continue
+                yield {"type": "WordBoundary", "offset": offset, "duration": tts.TICKS, "text": char}
+                yield {"type": "audio", "data": tts.CHUNK}
+                offset += tts.TICKS
+        finally:
+            tts.active -= 1
+
+
+@pytest.fixture
+def fake_tts(monkeypatch) -> FakeTTS:
+    """用 FakeTTS 替换 edge-tts 的 Communicate"""
+    tts = FakeTTS()
+    monkeypatch.setattr(edge_tts.edge_tts, "Communicate", tts)
+    return tts
+
+
+@pytest.fixture
+def manager():
+    """使用独立内存数据库的任务管理器"""
+    return TaskManager()
+
+
+async def finish(manager: TaskManager, task_id: str, timeout: float = 30.0):
+    """等待任务进入终态并返回任务"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        task = await manager.wait_for(task_id, timeout=deadline - time.monotonic())
+        if task.status.is_finished:
+            return task
+    raise AssertionError(f"任务 {task_id} 未在 {timeout}s 内结束: {task.status}")
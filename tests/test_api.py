@@ -0,0 +1,166 @@
+"""
+HTTP 接口：SSE 事件流、任务取消与场景预览
+"""
+import asyncio
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from utils import task_store
+from utils.task_manager import task_manager
+from utils.task_models import TaskStatus, TaskType
+from utils.workspace import Workspace
+from conftest import finish
+
+
+class _Request:
+    """stream_events 只用到 is_disconnected"""
+
+    async def is_disconnected(self) -> bool:
+        return False
+
+
+def _read_events(last_event_id, count: int, emit=None):
+    """打开事件流，读取 count 个事件块（不含开头的 retry），返回 (事件ID, 事件名, 数据) 列表"""
+    async def main_():
+        response = await main.stream_events(_Request(), last_event_id=last_event_id)
+        stream = response.body_iterator
+        try:
+            assert await stream.__anext__() == "retry: 3000\n\n"
+            first = asyncio.ensure_future(stream.__anext__())
+            if emit is not None:
+                # 等事件流确定起始位置、开始等待新事件后再写入
+                await asyncio.sleep(0.3)
+                emit()
+            chunks = [await asyncio.wait_for(first, 5)]
+            chunks += [await asyncio.wait_for(stream.__anext__(), 5) for _ in range(count - 1)]
+        finally:
+            await stream.aclose()
+        return [_parse(chunk) for chunk in chunks]
+
+    return asyncio.run(main_())
+
+
+def _parse(chunk: str):
+    fields = dict(line.split(": ", 1) for line in chunk.strip().splitlines())
+    return fields.get("id"), fields.get("event"), fields.get("data")
+
+
+def test_events_resume_after_last_event_id():
+    ids = [task_manager.emit_event("file", {"path": f"images/{n}.png", "size": n}) for n in range(3)]
+    events = _read_events(str(ids[0]), 2)
+    assert [int(event_id) for event_id, _, _ in events] == ids[1:]
+    assert all(name == "file" for _, name, _ in events)
+    assert '"images/2.png"' in events[1][2]
+
+
+def test_new_connection_starts_after_latest_event():
+    task_manager.emit_event("file", {"path": "old.png", "size": 1})
+    events = _read_events(None, 1, emit=lambda: task_manager.emit_event("file", {"path": "new.png", "size": 2}))
+    assert '"new.png"' in events[0][2]
+
+
+def test_reset_when_resume_point_was_pruned(monkeypatch):
+    monkeypatch.setattr(task_store, "EVENT_RETENTION", 10)
+    first = task_manager.emit_event("file", {"path": "first.png", "size": 1})
+    # 写满一轮清理周期，first 之后的事件被清理
+    while task_manager.emit_event("file", {"path": "filler.png", "size": 1}) % 500:
+        pass
+    events = _read_events(str(first), 2)
+    assert events[0][1] == "reset"
+    # reset 之后从保留的最早事件继续推送
+    assert int(events[1][0]) == task_manager.store.event_id_range()[0]
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+def test_cancel_unknown_task_is_404(client):
+    assert client.post("/api/tasks/missing/cancel").status_code == 404
+
+
+def test_cancel_pending_task(client):
+    task_manager.create_task("pending_1", TaskType.IMAGE_GENERATION, {"run_id": ""})
+    response = client.post("/api/tasks/pending_1/cancel")
+    assert response.json() == {"task_id": "pending_1", "cancelled": True, "status": "cancelled"}
+    # 已结束的任务不能再次取消
+    assert client.post("/api/tasks/pending_1/cancel").json()["cancelled"] is False
+
+
+def test_cancel_running_image_task(client, workdir, comfyui_backends):
+    server, = comfyui_backends(latency=5.0)
+
+    async def scenario():
+        task_id = await task_manager.submit_image_generation_task([{"sd_prompt": "a cat", "seed": 1}])
+        while server.stats.prompts == 0:
+            await asyncio.sleep(0.05)
+        start = time.monotonic()
+        response = await asyncio.to_thread(client.post, f"/api/tasks/{task_id}/cancel")
+        assert response.json()["cancelled"] is True
+        task = await finish(task_manager, task_id)
+        # ComfyUI 上正在执行的 prompt 被中断
+        while not server.stats.interrupted and time.monotonic() - start < 5:
+            await asyncio.sleep(0.05)
+        return task, time.monotonic() - start
+
+    task, elapsed = asyncio.run(scenario())
+    assert task.status == TaskStatus.CANCELLED
+    assert server.stats.interrupted == 1
+    assert elapsed < 5
+
+
+def test_preview_is_404_without_preview(client, workdir):
+    assert client.get("/api/tasks/missing/scenes/0/preview").status_code == 404
+    task_manager.create_task("preview_1", TaskType.IMAGE_GENERATION, {"run_id": ""})
+    assert client.get("/api/tasks/preview_1/scenes/0/preview").status_code == 404
+
+
+@pytest.mark.parametrize("data, media_type", [(b"\x89PNG\r\n\x1a\nrest", "image/png"),
+                                              (b"\xff\xd8\xff\xe0rest", "image/jpeg")])
+def test_preview_media_type(client, workdir, data, media_type):
+    task_manager.create_task("preview_2", TaskType.IMAGE_GENERATION, {"run_id": "run_a"})
+    path = Workspace("run_a").image_preview(3)
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(data)
+    response = client.get("/api/tasks/preview_2/scenes/3/preview")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == media_type
+    assert response.content == data
+
+
+def test_preview_and_progress_while_rendering(client, workdir, comfyui_backends):
+    comfyui_backends(latency=2.0, previews=True)
+
+    async def scenario():
+        task_id = await task_manager.submit_image_generation_task([{"sd_prompt": "a cat", "seed": 1}])
+        preview, progress = None, 0.0
+        # 预览图先于进度写入，两者都出现前场景还在渲染
+        while preview is None or progress == 0:
+            task = await asyncio.to_thread(task_manager.get_task, task_id)
+            assert not task.status.is_finished
+            progress = task.progress
+            response = await asyncio.to_thread(client.get, f"/api/tasks/{task_id}/scenes/0/preview")
+            if response.status_code == 200:
+                preview = response
+            await asyncio.sleep(0.1)
+        task = await finish(task_manager, task_id)
+        after = await asyncio.to_thread(client.get, f"/api/tasks/{task_id}/scenes/0/preview")
+        # 派生图在后台生成，等它写完再离开临时目录
+        workspace = Workspace()
+        while not (os.path.exists(workspace.web_image(0)) and os.path.exists(workspace.thumbnail(0))):
+            await asyncio.sleep(0.05)
+        return preview, progress, task, after
+
+    preview, progress, task, after = asyncio.run(scenario())
+    assert preview.headers["content-type"] == "image/jpeg"
+    # 渲染途中按采样步数汇报进度
+    assert 0 < progress < 100
+    assert task.status == TaskStatus.COMPLETED
+    # 场景完成后删除预览图
+    assert after.status_code == 404
@@ -0,0 +1,39 @@
+"""
+配音任务：各场景并发合成，完成即落盘并记录
+"""
+import asyncio
+import os
+
+from utils import task_manager as task_manager_module
+from utils.task_models import TaskStatus
+from utils.workspace import Workspace
+from conftest import finish
+
+
+def _run_audio(manager, scenes):
+    async def main():
+        task_id = await manager.submit_audio_generation_task(scenes)
+        return await finish(manager, task_id)
+
+    return asyncio.run(main())
+
+
+def test_scenes_are_synthesized_concurrently(workdir, manager, fake_tts, monkeypatch):
+    monkeypatch.setattr(task_manager_module, "TTS_CONCURRENCY", 3)
+    task = _run_audio(manager, [{"script": f"第{idx}段旁白。"} for idx in range(5)])
+
+    assert task.status == TaskStatus.COMPLETED
+    assert task.result["completed_scenes"] == list(range(5))
+    assert fake_tts.max_active == 3
+    workspace = Workspace()
+    assert all(os.path.getsize(workspace.audio(idx)) > 0 for idx in range(5))
+    assert all(os.path.exists(workspace.audio_record(idx)) for idx in range(5))
+
+
+def test_failed_scene_does_not_stop_the_others(workdir, manager, fake_tts):
+    fake_tts.fail.add("第1段旁白。")
+    task = _run_audio(manager, [{"script": f"第{idx}段旁白。"} for idx in range(3)])
+
+    assert task.status == TaskStatus.FAILED
+    assert task.result["completed_scenes"] == [0, 2]
+    assert [item["scene"] for item in task.result["failed_scenes"]] == [1]
@@ -0,0 +1,90 @@
+import asyncio
+import os
+
+from utils import comfyui
+from utils.cache import DiskCache, cache_key
+from utils.comfyui import AsyncComfyUIClient
+from utils.fake_comfyui import FakeComfyUIServer
+
+
+def _touch(cache: DiskCache, key: str, mtime: float):
+    os.utime(cache.path(key), (mtime, mtime))
+
+
+def test_cache_key_is_stable_and_order_sensitive():
+    assert cache_key("a", {"x": 1, "y": 2}) == cache_key("a", {"y": 2, "x": 1})
+    assert cache_key("a", "b") != cache_key("b", "a")
+
+
+def test_get_put_roundtrip(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1024, suffix=".bin")
+    key = cache_key("roundtrip")
+    assert cache.get(key) is None
+    cache.put(key, b"data")
+    assert cache.get(key) == b"data"
+    assert cache.path(key).endswith(".bin")
+
+
+def test_disabled_cache_never_stores(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=0)
+    key = cache_key("off")
+    cache.put(key, b"data")
+    assert cache.get(key) is None
+    assert not os.listdir(tmp_path)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=350)
+    keys = [cache_key(n) for n in range(3)]
+    for n, key in enumerate(keys):
+        cache.put(key, bytes(100))
+        _touch(cache, key, 1000 + n)
+    # 读取刷新访问时间：keys[0] 变为最近使用
+    assert cache.get(keys[0]) is not None
+    _touch(cache, keys[0], 2000)
+
+    cache.put(cache_key("new"), bytes(100))
+    # 超过上限后按访问时间从旧到新淘汰，直到降到上限的 90% 以下：只需删除最久未访问的 keys[1]
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is not None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(cache_key("new")) is not None
+    total = sum(os.path.getsize(os.path.join(root, name))
+                for root, _, files in os.walk(tmp_path) for name in files)
+    assert total <= 350 * 0.9
+
+
+def test_size_is_shared_through_directory(tmp_path):
+    # 另一个进程（另一个实例）写入的条目在淘汰扫描时计入
+    other = DiskCache(str(tmp_path), max_bytes=250)
+    for n in range(2):
+        other.put(cache_key("other", n), bytes(100))
+    cache = DiskCache(str(tmp_path), max_bytes=250)
+    cache.put(cache_key("mine"), bytes(100))
+    remaining = [name for _, _, files in os.walk(tmp_path) for name in files]
+    assert len(remaining) == 2
+
+
+def test_repeated_render_is_served_from_cache(workdir, monkeypatch):
+    monkeypatch.setattr(comfyui, "image_cache", DiskCache(str(workdir / "cache"), 1024 * 1024, suffix=".png"))
+    small = dict(width=64, height=64, steps=2)
+
+    async def main():
+        server = FakeComfyUIServer(latency=0.05, image_scale=0.1, seed=0)
+        await server.start()
+        client = AsyncComfyUIClient(server.address)
+        try:
+            first = await client.generate("a cat", seed=1, **small)
+            again = await client.generate("a cat", seed=1, save_path="cat.png", **small)
+            other = await client.generate("a cat", seed=2, **small)
+            return first, again, other, server.stats
+        finally:
+            await client.close()
+            await server.close()
+
+    first, again, other, stats = asyncio.run(main())
+    assert again == first
+    assert other != first
+    # 相同参数命中缓存，不再提交给 ComfyUI；命中时照常写入 save_path
+    assert stats.prompts == 2
+    assert (workdir / "cat.png").read_bytes() == first[0]
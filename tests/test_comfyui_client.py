@@ -0,0 +1,132 @@
+"""
+异步 ComfyUI 客户端：对进程内的 FakeComfyUIServer 收发 prompt
+"""
+import asyncio
+
+import pytest
+
+from utils import comfyui
+from utils.comfyui import AsyncComfyUIClient
+from utils.fake_comfyui import FakeComfyUIServer
+from conftest import ROOT
+
+# 小尺寸、少步数，单张图片约 0.1 秒
+SMALL = dict(width=64, height=64, steps=2)
+
+
+@pytest.fixture(autouse=True)
+def templates(monkeypatch):
+    # 工作流模板按相对路径加载
+    monkeypatch.chdir(ROOT)
+
+
+def _run(server: FakeComfyUIServer, scenario):
+    """启动替身服务与客户端，执行 scenario(server, client)，结束后关闭两者"""
+    async def main():
+        await server.start()
+        client = AsyncComfyUIClient(server.address)
+        try:
+            return await scenario(server, client)
+        finally:
+            await client.close()
+            await server.close()
+
+    return asyncio.run(main())
+
+
+class _FailSeed(FakeComfyUIServer):
+    """含指定种子的 prompt 必定以 execution_error 失败。打包时失败落在随机一个输出上，
+    该种子的输出排在最后，失败前总是还没有拿到图片"""
+
+    def __init__(self, bad_seed: int, **params):
+        super().__init__(**params)
+        self.bad_seed = bad_seed
+
+    def _outputs(self, prompt):
+        return sorted(super()._outputs(prompt), key=lambda output: output.seed == self.bad_seed)
+
+    async def _execute(self, job):
+        seeds = {output.seed for output in self._outputs(job.prompt)}
+        self.failure_rate = 1.0 if self.bad_seed in seeds else 0.0
+        await super()._execute(job)
+
+
+def test_prompts_share_one_websocket(monkeypatch):
+    # 每个请求单独提交，验证的是多个 prompt 而不是同一个打包的 prompt
+    monkeypatch.setattr(comfyui, "PACK_SIZE", 1)
+
+    async def scenario(server, client):
+        results = await asyncio.gather(*(client.generate(f"scene {idx}", seed=idx, **SMALL) for idx in range(4)))
+        ws = client._ws
+        results.append(await client.generate("one more", seed=9, **SMALL))
+        assert client._ws is ws
+        return results, server.stats
+
+    results, stats = _run(FakeComfyUIServer(latency=0.05, image_scale=0.1, seed=0), scenario)
+    assert [len(images) for images in results] == [1] * 5
+    assert stats.prompts == 5
+    # 所有 prompt 的消息都经同一个 client_id 的连接送达
+    assert len(stats.client_ids) == 1
+
+
+def test_clients_use_distinct_client_ids():
+    # ComfyUI 按 client_id 只保留最新的连接，共用 client_id 会互相顶掉
+    async def scenario(server, _):
+        clients = [AsyncComfyUIClient(server.address) for _ in range(2)]
+        try:
+            await asyncio.gather(*(client.generate("a cat", seed=idx, **SMALL) for idx, client in enumerate(clients)))
+        finally:
+            for client in clients:
+                await client.close()
+        return server.stats
+
+    stats = _run(FakeComfyUIServer(latency=0.05, image_scale=0.1, workers=2, seed=0), scenario)
+    assert stats.images == 2
+    assert len(stats.client_ids) == 2
+
+
+def test_generate_returns_encoded_bytes(workdir):
+    async def scenario(server, client):
+        return await client.generate("a cat", seed=1, batch_size=2, save_path="out/cat.png", **SMALL)
+
+    images = _run(FakeComfyUIServer(latency=0.05, image_scale=0.1, seed=0), scenario)
+    assert len(images) == 2
+    assert all(type(image) is bytes and image.startswith(b"\x89PNG") for image in images)
+    # 原样写入文件，第二张加 _1 后缀
+    assert (workdir / "out" / "cat.png").read_bytes() == images[0]
+    assert (workdir / "out" / "cat_1.png").read_bytes() == images[1]
+
+
+def test_generate_image_returns_images(workdir, comfyui_backends):
+    comfyui_backends()
+    images = comfyui.generate_image(prompt_text="a cat", save_path="cat.png", seed=1, **SMALL)
+    assert [type(image) for image in images] == [bytes]
+    assert (workdir / "cat.png").read_bytes() == images[0]
+
+
+def test_concurrent_requests_are_packed(monkeypatch):
+    monkeypatch.setattr(comfyui, "PACK_SIZE", 4)
+
+    async def scenario(server, client):
+        results = await asyncio.gather(*(client.generate("a cat", seed=idx, **SMALL) for idx in range(4)))
+        return results, server.stats
+
+    results, stats = _run(FakeComfyUIServer(latency=0.05, image_scale=0.1, seed=0), scenario)
+    assert stats.prompts == 1
+    assert stats.images == 4
+    # 每个请求拿到自己种子的图片
+    assert len({images[0] for images in results}) == 4
+
+
+def test_pack_failure_lands_on_failing_request(monkeypatch):
+    monkeypatch.setattr(comfyui, "PACK_SIZE", 4)
+
+    async def scenario(server, client):
+        results = await client.generate_batch([dict(prompt_text="a cat", seed=idx, **SMALL) for idx in range(4)])
+        return results, server.stats
+
+    results, stats = _run(_FailSeed(2, latency=0.05, image_scale=0.1, seed=0), scenario)
+    assert isinstance(results[2], RuntimeError)
+    assert all(len(results[idx]) == 1 for idx in (0, 1, 3))
+    # 打包的 prompt 失败后，未拿到结果的请求各自单独重新提交
+    assert 2 <= stats.prompts <= 5
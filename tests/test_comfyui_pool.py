@@ -0,0 +1,75 @@
+"""
+ComfyUI 后端池：按预计完成时间分派，后端不可用时换后端重试
+"""
+import asyncio
+import time
+
+from utils import comfyui
+from utils.comfyui import ComfyUIBackendPool
+
+SMALL = dict(width=64, height=64, steps=2)
+
+
+def _pool(**states) -> ComfyUIBackendPool:
+    """不连接后端的池，按 states 的顺序设置各后端的状态字段（latency 写入客户端）"""
+    pool = ComfyUIBackendPool([f"127.0.0.1:{port}" for port in range(1, len(states) + 1)])
+    for backend, state in zip(pool.backends, states.values()):
+        state = dict(state)
+        backend.client.latency = state.pop("latency", None)
+        for name, value in state.items():
+            setattr(backend, name, value)
+    return pool
+
+
+def _chosen(pool: ComfyUIBackendPool, exclude=()) -> int:
+    return pool.backends.index(pool._choose(list(exclude)))
+
+
+def test_choose_least_expected_wait():
+    # 队列更长但渲染快得多的后端预计更早完成：(0 + 1) × 1.0 > (3 + 1) × 0.2
+    pool = _pool(a=dict(latency=1.0), b=dict(latency=0.2, queue_depth=3))
+    assert _chosen(pool) == 1
+    # 本进程刚分派的在途请求立即计入，不用等下一次轮询
+    pool.backends[1].inflight = 5
+    assert _chosen(pool) == 0
+
+
+def test_backend_without_samples_uses_average_latency():
+    pool = _pool(a=dict(latency=0.5, queue_depth=1), b=dict())
+    # b 按 a 的耗时估计：(0 + 1) × 0.5 < (1 + 1) × 0.5
+    assert _chosen(pool) == 1
+
+
+def test_unhealthy_backend_leaves_rotation():
+    now = time.monotonic()
+    pool = _pool(a=dict(latency=0.1, unhealthy_until=now + 60), b=dict(latency=1.0, queue_depth=10))
+    assert _chosen(pool) == 1
+    # 全部不可用时仍尝试冷却最早结束的一个
+    pool.backends[1].unhealthy_until = now + 30
+    assert _chosen(pool) == 1
+    assert _chosen(pool, exclude=[pool.backends[1]]) == 0
+
+
+def test_concurrent_requests_spread_across_backends(workdir, comfyui_backends, monkeypatch):
+    monkeypatch.setattr(comfyui, "PACK_SIZE", 1)
+    servers = comfyui_backends(2, latency=0.2)
+
+    async def main():
+        return await asyncio.gather(*(comfyui.generate("a cat", seed=idx, **SMALL) for idx in range(6)))
+
+    results = asyncio.run(main())
+    assert len(results) == 6
+    assert [server.stats.prompts for server in servers] == [3, 3]
+
+
+def test_failover_to_healthy_backend(workdir, comfyui_backends):
+    down, up = comfyui_backends(2)
+    down.stop()
+
+    images = comfyui.generate_image(prompt_text="a cat", save_path="cat.png", seed=1, **SMALL)
+    assert len(images) == 1
+    assert up.stats.prompts == 1
+    # 失败的后端在冷却期内移出轮转，后续请求不再先尝试它
+    assert [stats["healthy"] for stats in comfyui.backend_stats()] == [False, True]
+    comfyui.generate_image(prompt_text="a dog", save_path="dog.png", seed=2, **SMALL)
+    assert up.stats.prompts == 2
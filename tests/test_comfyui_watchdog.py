@@ -0,0 +1,147 @@
+"""
+prompt 看门狗与重连：对进程内的 FakeComfyUIServer 注入丢弃、断线与慢渲染
+"""
+import asyncio
+import time
+
+import pytest
+
+from utils import comfyui
+from utils.comfyui import AsyncComfyUIClient, PromptInterruptedError, PromptLostError, PromptTimeoutError
+from utils.fake_comfyui import FakeComfyUIServer
+from conftest import ROOT
+
+# 小尺寸、少步数，单张图片约 0.1 秒
+SMALL = dict(width=64, height=64, steps=2)
+
+
+@pytest.fixture(autouse=True)
+def fast_watchdog(monkeypatch):
+    # 工作流模板按相对路径加载
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(comfyui, "WATCHDOG_INTERVAL", 0.1)
+    monkeypatch.setattr(comfyui, "SILENCE_TIMEOUT", 0.3)
+    monkeypatch.setattr(comfyui, "PROMPT_RETRIES", 2)
+    monkeypatch.setattr(comfyui, "PACK_SIZE", 1)
+
+
+def _run(server: FakeComfyUIServer, scenario):
+    """启动替身服务与客户端，执行 scenario(server, client)，结束后关闭两者"""
+    async def main():
+        await server.start()
+        client = AsyncComfyUIClient(server.address)
+        try:
+            return await scenario(server, client)
+        finally:
+            await client.close()
+            await server.close()
+
+    return asyncio.run(main())
+
+
+class _DropFirst(FakeComfyUIServer):
+    """只静默丢弃第一个 prompt"""
+
+    async def _execute(self, job):
+        self.drop_rate = 1.0 if self.stats.dropped == 0 else 0.0
+        await super()._execute(job)
+
+
+def test_dropped_prompt_is_requeued():
+    async def scenario(server, client):
+        images = await client.generate("a cat", seed=1, **SMALL)
+        return images, server.stats
+
+    images, stats = _run(_DropFirst(latency=0.05, image_scale=0.1, seed=0), scenario)
+    assert len(images) == 1
+    assert stats.dropped == 1
+    assert stats.prompts == 2
+
+
+def test_prompt_lost_after_retries():
+    async def scenario(server, client):
+        with pytest.raises(PromptLostError):
+            await client.generate("a cat", seed=1, **SMALL)
+        return server.stats
+
+    stats = _run(FakeComfyUIServer(latency=0.05, drop_rate=1.0, seed=0), scenario)
+    # 首次提交加 PROMPT_RETRIES 次重新提交
+    assert stats.dropped == 3
+
+
+def test_disconnect_recovers_images_from_history():
+    async def scenario(server, client):
+        images = await client.generate("a cat", seed=1, **SMALL)
+        return images, server.stats
+
+    images, stats = _run(FakeComfyUIServer(latency=0.05, image_scale=0.1, disconnect_rate=1.0, seed=0),
+                         scenario)
+    assert len(images) == 1
+    assert images[0].startswith(b"\x89PNG")
+    assert stats.disconnects == 1
+    # 从 history 取回，而不是重新提交
+    assert stats.prompts == 1
+
+
+def test_execution_timeout_interrupts_prompt(monkeypatch):
+    monkeypatch.setattr(comfyui, "EXECUTION_TIMEOUT", 0.3)
+
+    async def scenario(server, client):
+        start = time.monotonic()
+        with pytest.raises(PromptTimeoutError, match="执行"):
+            # 步数多一些，替身服务每 0.1 秒检查一次中断
+            await client.generate("a cat", seed=1, width=64, height=64, steps=100)
+        elapsed = time.monotonic() - start
+        # 等替身服务处理中断
+        for _ in range(50):
+            if server.stats.interrupted:
+                break
+            await asyncio.sleep(0.05)
+        return elapsed, server.stats
+
+    elapsed, stats = _run(FakeComfyUIServer(latency=10.0, seed=0), scenario)
+    assert elapsed < 3
+    assert stats.interrupted == 1
+
+
+def test_queue_timeout_removes_queued_prompt(monkeypatch):
+    monkeypatch.setattr(comfyui, "QUEUE_TIMEOUT", 0.3)
+    monkeypatch.setattr(comfyui, "EXECUTION_TIMEOUT", 30)
+
+    async def scenario(server, client):
+        # 第一个 prompt 占住唯一的执行槽位，第二个只能排队直到超时
+        first = asyncio.ensure_future(client.generate("slow", seed=1, **SMALL))
+        await asyncio.sleep(0.1)
+        with pytest.raises(PromptTimeoutError, match="排队"):
+            await client.generate("queued", seed=2, **SMALL)
+        queued = await client.get_queued_ids()
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return queued
+
+    queued = _run(FakeComfyUIServer(latency=2.0, seed=0), scenario)
+    # 只剩正在执行的第一个 prompt
+    assert len(queued) == 1
+
+
+def test_external_interrupt_fails_prompt():
+    async def scenario(server, client):
+        running = asyncio.ensure_future(client.generate("a cat", seed=1, width=64, height=64, steps=100))
+        while client._executing is None:
+            await asyncio.sleep(0.05)
+        # 在 ComfyUI 界面上点了取消：/interrupt 不带 prompt_id
+        other = AsyncComfyUIClient(server.address)
+        try:
+            await other.interrupt()
+        finally:
+            await other.close()
+        # 不是本地取消：以普通异常失败，不能以 CancelledError 结束
+        with pytest.raises(PromptInterruptedError, match="中断"):
+            await running
+        return server.stats
+
+    stats = _run(FakeComfyUIServer(latency=10.0, seed=0), scenario)
+    assert stats.interrupted == 1
+    # 中断不是丢失，不重新提交
+    assert stats.prompts == 1
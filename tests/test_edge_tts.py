@@ -0,0 +1,287 @@
+"""
+edge-tts 配音：异步合成、并发批量合成与字幕对齐
+"""
+import asyncio
+import os
+import random
+import re
+
+import pytest
+
+from utils import edge_tts
+from utils.cache import DiskCache
+from utils.edge_tts import (
+    AudioMetadata, SubtitleCue, TTSJob, align_sentences, audio_metadata, clean_text_for_srt,
+    create_sentence_based_srt, format_srt_time, normalize_text, synthesize, synthesize_batch, _BOUNDARY_KWARGS,
+)
+
+_TICKS = 10000000
+_WORDS = ["我们", "今天", "去", "公园", "散步", "天气", "很好", "你", "好吗", "他", "说",
+          "hello", "world", "真的", "吗", "一", "二", "三"]
+_PUNCTUATION = ["。", "！", "，", ".", "？"]
+
+
+def test_synthesize_writes_audio_subtitles_and_metadata(tmp_path, fake_tts):
+    audio_path, srt_path, meta_path = (str(tmp_path / name) for name in ("a.mp3", "a.srt", "a.json"))
+    asyncio.run(synthesize("今天天气很好。我们去公园！", audio_path, srt_path, meta_path=meta_path))
+
+    # 字幕按句对齐需要逐词的时间
+    assert _BOUNDARY_KWARGS.items() <= fake_tts.calls[0].items()
+    assert os.path.getsize(audio_path) == 11 * len(fake_tts.CHUNK)
+    with open(srt_path, encoding="utf-8") as f:
+        assert f.read() == (
+            "1\n00:00:00,000 --> 00:00:01,500\n今天天气很好。\n\n"
+            "2\n00:00:01,500 --> 00:00:02,750\n我们去公园！\n\n"
+        )
+    metadata = AudioMetadata.load(meta_path, audio_path)
+    assert metadata.duration == 2.75
+    assert [cue.text for cue in metadata.cues] == ["今天天气很好。", "我们去公园！"]
+
+
+def test_batch_runs_concurrently_within_bound(tmp_path, fake_tts):
+    fake_tts.fail.add("第三段")
+    texts = ["第零段", "第一段", "第二段", "第三段", "第四段", "第五段"]
+    jobs = [TTSJob(text, str(tmp_path / f"{idx}.mp3"), str(tmp_path / f"{idx}.srt")) for idx, text in enumerate(texts)]
+    done = []
+
+    errors = asyncio.run(synthesize_batch(jobs, concurrency=2, on_done=lambda idx, error: done.append(idx)))
+    assert fake_tts.max_active == 2
+    assert sorted(done) == list(range(6))
+    # 单段失败不影响其他段
+    assert [type(error) for error in errors] == [type(None)] * 3 + [ConnectionError] + [type(None)] * 2
+    assert [os.path.exists(job.audio_path) for job in jobs] == [True, True, True, False, True, True]
+
+
+def test_cache_hit_skips_synthesis(tmp_path, fake_tts, monkeypatch):
+    monkeypatch.setattr(edge_tts, "tts_cache", DiskCache(str(tmp_path / "cache"), 1024 * 1024, suffix=".tts"))
+    outputs = []
+
+    def run(text, **params):
+        audio_path, srt_path = str(tmp_path / f"{len(outputs)}.mp3"), str(tmp_path / f"{len(outputs)}.srt")
+        asyncio.run(synthesize(text, audio_path, srt_path, **params))
+        with open(audio_path, "rb") as audio, open(srt_path, encoding="utf-8") as srt:
+            outputs.append((audio.read(), srt.read()))
+
+    run("今天天气很好。")
+    # 规范化后相同的文本命中缓存，字幕由缓存的词边界重新生成
+    run("  今天天气很好。\n")
+    assert len(fake_tts.calls) == 1
+    assert outputs[1] == outputs[0]
+    # 音色或语速不同则重新合成
+    run("今天天气很好。", voice="zh-CN-YunxiNeural")
+    run("今天天气很好。", rate="+20%")
+    assert len(fake_tts.calls) == 3
+
+
+def test_corrupt_cache_entry_is_resynthesized(tmp_path, fake_tts, monkeypatch):
+    cache = DiskCache(str(tmp_path / "cache"), 1024 * 1024, suffix=".tts")
+    monkeypatch.setattr(edge_tts, "tts_cache", cache)
+    audio_path = str(tmp_path / "a.mp3")
+    asyncio.run(synthesize("你好。", audio_path, None))
+    entry, = [os.path.join(root, name) for root, _, files in os.walk(cache.directory) for name in files]
+    with open(entry, "wb") as f:
+        f.write(b"truncated")
+
+    asyncio.run(synthesize("你好。", audio_path, None))
+    assert len(fake_tts.calls) == 2
+    assert os.path.getsize(audio_path) == 2 * len(fake_tts.CHUNK)
+
+
+def _legacy_sentence_srt(word_boundaries, text):
+    """改为线性时间对齐之前的 create_sentence_based_srt（每句从上一句之后扫描全部词边界），作为对齐结果的参照"""
+    if not word_boundaries:
+        return ""
+
+    cleaned_text = clean_text_for_srt(text)
+    # 智能句子分割
+    sentences = []
+    parts = re.split(r"([。！.!])", cleaned_text)
+    current_sentence = ""
+    for i, part in enumerate(parts):
+        current_sentence += part
+        if re.match(r"[。！.!]", part) or i == len(parts) - 1:
+            if current_sentence.strip():
+                clean_sentence = current_sentence.strip()
+                if "？" in clean_sentence:
+                    sub_parts = clean_sentence.split("？")
+                    for j, sub_part in enumerate(sub_parts):
+                        if sub_part.strip():
+                            if j < len(sub_parts) - 1:
+                                sentences.append(sub_part.strip() + "？")
+                            else:
+                                if sub_part.strip():
+                                    sentences.append(sub_part.strip())
+                else:
+                    if clean_sentence and len(clean_sentence) > 1:
+                        sentences.append(clean_sentence)
+            current_sentence = ""
+    # 进一步清理句子列表
+    cleaned_sentences = []
+    for sentence in sentences:
+        sentence = sentence.strip()
+        if sentence and len(sentence) > 1 and not re.match(r"^[，。！,.!]+$", sentence):
+            cleaned_sentences.append(sentence)
+    sentences = cleaned_sentences
+    if not sentences:
+        return ""
+
+    # 拼接所有词边界文本，便于查找句子在词边界中的起止位置
+    boundary_texts = [b.get("text", "").strip() for b in word_boundaries]
+    joined_text = "".join(boundary_texts)
+    char_offsets = [b.get("offset", 0) for b in word_boundaries]
+    char_durations = [b.get("duration", 1000000) for b in word_boundaries]
+
+    srt_content = ""
+    srt_index = 1
+    last_end_idx = 0
+    prev_end_time = 0.0  # 初始化，确保时间递增
+    for sentence in sentences:
+        # 去除标点和空格用于匹配
+        sentence_clean = re.sub(r"[，。！,.!\s]+", "", sentence)
+        # 在joined_text中查找该句的起止位置
+        start_idx = joined_text.find(sentence_clean, last_end_idx)
+        if start_idx == -1:
+            # 匹配不到时，尝试从头查找
+            start_idx = joined_text.find(sentence_clean)
+        if start_idx == -1:
+            # 仍找不到，回退为均分时间
+            total_duration = (
+                word_boundaries[-1].get("offset", 0)
+                + word_boundaries[-1].get("duration", 1000000)
+            ) / 10000000
+            time_per_sentence = total_duration / len(sentences)
+            start_time = (srt_index - 1) * time_per_sentence
+            end_time = srt_index * time_per_sentence
+        else:
+            # 找到起止词边界
+            end_idx = start_idx + len(sentence_clean) - 1
+            # 找到对应的词边界索引
+            start_word_idx = None
+            end_word_idx = None
+            char_count = 0
+            for i, t in enumerate(boundary_texts):
+                if char_count == start_idx:
+                    start_word_idx = i
+                if char_count + len(t) - 1 >= end_idx and end_word_idx is None:
+                    end_word_idx = i
+                char_count += len(t)
+            if start_word_idx is None:
+                start_word_idx = 0
+            if end_word_idx is None:
+                end_word_idx = len(word_boundaries) - 1
+            start_time = char_offsets[start_word_idx] / 10000000
+            end_time = (
+                char_offsets[end_word_idx] + char_durations[end_word_idx]
+            ) / 10000000
+            last_end_idx = end_idx + 1
+        # 确保时间递增
+        if srt_index > 1 and start_time < prev_end_time:
+            start_time = prev_end_time + 0.05
+        if end_time <= start_time:
+            end_time = start_time + max(len(sentence) * 0.08, 1.0)
+        prev_end_time = end_time
+        start_str = format_srt_time(start_time)
+        end_str = format_srt_time(end_time)
+        srt_content += f"{srt_index}\n{start_str} --> {end_str}\n{sentence}\n\n"
+        srt_index += 1
+    return srt_content
+
+
+def _boundaries(words, rng=None):
+    """按词生成 WordBoundary：每个词 0.2~1 秒，词间可有停顿"""
+    rng = rng or random.Random(0)
+    boundaries = []
+    offset = 0
+    for word in words:
+        duration = rng.randint(2, 10) * 1000000
+        boundaries.append({"type": "WordBoundary", "offset": offset, "duration": duration, "text": word})
+        offset += duration + rng.randint(0, 3) * 100000
+    return boundaries
+
+
+def _random_script(rng):
+    tokens = []
+    for _ in range(rng.randint(1, 60)):
+        tokens.append(rng.choice(_WORDS))
+        if rng.random() < 0.2:
+            tokens.append(rng.choice(_PUNCTUATION))
+    text = "".join(tokens)
+    words = [token for token in tokens if token not in _PUNCTUATION]
+    return text, words
+
+
+def test_matches_legacy_implementation_on_word_aligned_input():
+    """每句都能在上一句之后、从词的开头匹配到时，结果与旧实现逐字节一致"""
+    rng = random.Random(1)
+    for _ in range(2000):
+        text, words = _random_script(rng)
+        boundaries = _boundaries(words, rng)
+        assert create_sentence_based_srt(boundaries, text) == _legacy_sentence_srt(boundaries, text)
+
+
+def test_cues_follow_word_timing():
+    words = ["今天", "天气", "很好", "我们", "去", "公园", "散步"]
+    boundaries = [{"offset": i * _TICKS, "duration": _TICKS // 2, "text": w} for i, w in enumerate(words)]
+    cues = align_sentences(boundaries, "今天天气很好。我们去公园散步！")
+    assert cues == [
+        SubtitleCue(1, 0.0, 2.5, "今天天气很好。"),
+        SubtitleCue(2, 3.0, 6.5, "我们去公园散步！"),
+    ]
+    assert cues[0].to_srt() == "1\n00:00:00,000 --> 00:00:02,500\n今天天气很好。\n\n"
+
+
+def test_punctuation_in_boundaries_does_not_break_matching():
+    boundaries = [{"offset": i * _TICKS, "duration": _TICKS // 2, "text": w}
+                  for i, w in enumerate(["你好", "，", "世界", "。", "再见", "！"])]
+    cues = align_sentences(boundaries, "你好，世界。再见！")
+    assert [(cue.start, cue.end) for cue in cues] == [(0.0, 2.5), (4.0, 4.5)]
+
+
+def test_unmatched_sentence_falls_back_without_rewinding():
+    words = ["第一", "句话", "第二", "句话"]
+    boundaries = [{"offset": i * _TICKS, "duration": _TICKS // 2, "text": w} for i, w in enumerate(words)]
+    cues = align_sentences(boundaries, "第一句话。第一句话。第二句话。")
+    assert (cues[0].start, cues[0].end) == (0.0, 1.5)
+    # 第二句只出现在第一句的位置上：不回头重用已匹配的区间，而是按均分时间放在上一句之后
+    assert cues[1].start == pytest.approx(1.55)
+    assert cues[1].end > cues[1].start
+    # 第三句仍在第一句之后正常匹配到最后两个词（起点被推到上一句结束之后，保证时间递增）
+    assert cues[2].end == 3.5
+    assert cues[2].start == pytest.approx(cues[1].end + 0.05)
+
+
+def test_alignment_is_linear_in_text_length():
+    """大量匹配不到的句子不会让每句都从头扫描整段文本"""
+    words = [f"词{i}" for i in range(20000)]
+    boundaries = _boundaries(words)
+    text = "。".join(f"缺失{i}" for i in range(5000)) + "。"
+    cues = align_sentences(boundaries, text)
+    assert len(cues) == 5000
+    assert all(later.start >= earlier.end for earlier, later in zip(cues, cues[1:]))
+
+
+def test_empty_inputs():
+    assert align_sentences([], "你好。") == []
+    assert align_sentences([{"offset": 0, "duration": 1, "text": "a"}], "。！") == []
+
+
+def test_helpers():
+    assert format_srt_time(3723.456) == "01:02:03,456"
+    assert clean_text_for_srt("你好@#世界？ ok") == "你好世界 ok"
+    assert normalize_text("  a\u0301   b \n") == "\u00e1 b"
+
+
+def test_audio_metadata_roundtrip(tmp_path):
+    audio = bytes(6000)
+    cues = [SubtitleCue(1, 0.0, 1.0, "你好")]
+    metadata = audio_metadata(audio, cues)
+    # 48 kbps 恒定码率：6000 字节 = 1 秒
+    assert metadata.duration == 1.0
+    audio_path = tmp_path / "a.mp3"
+    audio_path.write_bytes(audio)
+    meta_path = str(tmp_path / "a.json")
+    metadata.save(meta_path)
+    assert AudioMetadata.load(meta_path, str(audio_path)) == metadata
+    # 音频被替换后元数据视为过期
+    audio_path.write_bytes(bytes(100))
+    assert AudioMetadata.load(meta_path, str(audio_path)) is None
@@ -0,0 +1,131 @@
+"""
+图片生成任务：对 FakeComfyUIServer 并发渲染场景
+"""
+import asyncio
+import os
+from concurrent.futures import CancelledError
+
+from utils import comfyui
+from utils import task_manager as task_manager_module
+from utils.comfyui import AsyncComfyUIClient
+from utils.task_models import TaskStatus
+from utils.workspace import Workspace
+from conftest import finish
+
+
+def _scenes(count: int):
+    return [{"sd_prompt": f"scene {idx}", "seed": idx} for idx in range(count)]
+
+
+def _run_images(manager, scenes, **kwargs):
+    async def main():
+        task_id = await manager.submit_image_generation_task(scenes, **kwargs)
+        return await finish(manager, task_id)
+
+    return asyncio.run(main())
+
+
+def test_scenes_render_concurrently_within_bound(workdir, comfyui_backends, manager, monkeypatch):
+    # 每个场景单独提交，ComfyUI 队列深度反映同时在途的场景数
+    monkeypatch.setattr(comfyui, "PACK_SIZE", 1)
+    server, = comfyui_backends(latency=0.3)
+    task = _run_images(manager, _scenes(6))
+
+    assert task.status == TaskStatus.COMPLETED
+    assert task.result["completed_scenes"] == list(range(6))
+    assert task.result["failed_scenes"] == []
+    workspace = Workspace()
+    assert all(os.path.getsize(workspace.image(idx)) > 0 for idx in range(6))
+    # 场景并发提交，但在途数不超过图片线程池的大小（其中一个在执行）
+    assert 2 <= server.stats.max_queue_depth <= manager.image_executor.max_workers - 1
+
+
+def test_failed_scene_does_not_stop_the_others(workdir, comfyui_backends, manager):
+    comfyui_backends()
+    scenes = _scenes(3)
+    scenes[1]["sd_prompt"] = ""
+    task = _run_images(manager, scenes)
+
+    assert task.status == TaskStatus.FAILED
+    assert task.result["completed_scenes"] == [0, 2]
+    assert [item["scene"] for item in task.result["failed_scenes"]] == [1]
+    assert "场景 1" in task.error_message
+
+
+def test_scene_cancelled_without_task_cancel_is_failed(workdir, manager, monkeypatch):
+    # 例如 ComfyUI 上的 prompt 被他人中断、请求在后台被撤销：任务本身没有被取消
+    def interrupted(**kwargs):
+        raise CancelledError("ComfyUI 任务被中断")
+
+    monkeypatch.setattr(task_manager_module, "generate_image", interrupted)
+    task = _run_images(manager, _scenes(2))
+    assert task.status == TaskStatus.FAILED
+    assert [item["scene"] for item in task.result["failed_scenes"]] == [0, 1]
+    assert "中断" in task.error_message
+
+
+def test_external_interrupt_ends_task(workdir, comfyui_backends, manager, monkeypatch):
+    monkeypatch.setattr(task_manager_module, "IMAGE_MAX_ATTEMPTS", 1)
+    server, = comfyui_backends(latency=10.0)
+
+    async def main():
+        task_id = await manager.submit_image_generation_task(_scenes(1))
+        while not server._running:
+            await asyncio.sleep(0.05)
+        # 他人在 ComfyUI 上中断了正在执行的 prompt，本任务并没有被取消
+        other = AsyncComfyUIClient(server.address)
+        try:
+            await other.interrupt()
+        finally:
+            await other.close()
+        return await finish(manager, task_id, timeout=15)
+
+    task = asyncio.run(main())
+    assert task.status == TaskStatus.FAILED
+    assert [item["scene"] for item in task.result["failed_scenes"]] == [0]
+    assert "中断" in task.error_message
+
+
+def test_failed_attempt_is_retried(workdir, comfyui_backends, manager, monkeypatch):
+    monkeypatch.setattr(task_manager_module, "IMAGE_RETRY_BASE_DELAY", 0.01)
+    comfyui_backends()
+    calls = []
+
+    def flaky(**kwargs):
+        calls.append(kwargs["prompt_text"])
+        if len(calls) == 1:
+            raise RuntimeError("ComfyUI 执行失败")
+        return comfyui.generate_image(**kwargs)
+
+    monkeypatch.setattr(task_manager_module, "generate_image", flaky)
+    task = _run_images(manager, _scenes(1))
+    assert task.status == TaskStatus.COMPLETED
+    assert calls == ["scene 0", "scene 0"]
+
+
+def test_retries_are_bounded(workdir, manager, monkeypatch):
+    monkeypatch.setattr(task_manager_module, "IMAGE_RETRY_BASE_DELAY", 0.01)
+    calls = []
+
+    def broken(**kwargs):
+        calls.append(kwargs["prompt_text"])
+        raise RuntimeError("ComfyUI 执行失败")
+
+    monkeypatch.setattr(task_manager_module, "generate_image", broken)
+    task = _run_images(manager, _scenes(1))
+    assert task.status == TaskStatus.FAILED
+    assert len(calls) == task_manager_module.IMAGE_MAX_ATTEMPTS
+
+
+def test_resume_renders_only_changed_scenes(workdir, comfyui_backends, manager):
+    server, = comfyui_backends()
+    scenes = _scenes(3)
+    assert _run_images(manager, scenes).status == TaskStatus.COMPLETED
+    rendered = server.stats.images
+
+    scenes[2]["sd_prompt"] = "scene 2, at night"
+    task = _run_images(manager, scenes, resume=True)
+    assert task.status == TaskStatus.COMPLETED
+    assert task.result["reused_scenes"] == [0, 1]
+    assert task.result["completed_scenes"] == [0, 1, 2]
+    assert server.stats.images == rendered + 1
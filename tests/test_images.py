@@ -0,0 +1,58 @@
+"""
+场景图片落盘与派生图
+"""
+import io
+
+from PIL import Image
+
+from utils import images
+from utils.images import make_derivatives, save_images
+
+
+def _png(size=(64, 48), color=(200, 30, 30)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_save_images_writes_bytes_unchanged(tmp_path):
+    data = [_png(color=(255, 0, 0)), _png(color=(0, 255, 0))]
+    paths = save_images(data, str(tmp_path / "out" / "scene_1.png"))
+    assert paths == [str(tmp_path / "out" / "scene_1.png"), str(tmp_path / "out" / "scene_1_1.png")]
+    # 原样写入，不解码重编码
+    assert [open(path, "rb").read() for path in paths] == data
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == ["scene_1.png", "scene_1_1.png"]
+
+
+def test_derivatives_decode_once_and_fit_sizes(tmp_path, monkeypatch):
+    monkeypatch.setattr(images, "THUMBNAIL_SIZE", 16)
+    src = tmp_path / "scene.png"
+    src.write_bytes(_png(size=(64, 48)))
+    paths = {
+        "frame_path": str(tmp_path / "frames" / "scene.png"),
+        "webp_path": str(tmp_path / "web" / "scene.webp"),
+        "thumbnail_path": str(tmp_path / "web" / "scene_thumb.jpg"),
+    }
+    written = make_derivatives(str(src), frame_size=(32, 32), **paths)
+    assert written == list(paths.values())
+
+    with Image.open(paths["frame_path"]) as frame:
+        # 居中裁剪后缩放到视频分辨率
+        assert (frame.format, frame.size) == ("PNG", (32, 32))
+    with Image.open(paths["webp_path"]) as webp:
+        assert (webp.format, webp.size) == ("WEBP", (64, 48))
+    with Image.open(paths["thumbnail_path"]) as thumbnail:
+        assert (thumbnail.format, thumbnail.size) == ("JPEG", (16, 12))
+
+
+def test_derivatives_follow_configuration(tmp_path, monkeypatch):
+    monkeypatch.setattr(images, "IMAGE_DERIVATIVES", {"thumbnail"})
+    src = tmp_path / "scene.png"
+    src.write_bytes(_png())
+    written = make_derivatives(str(src), frame_path=str(tmp_path / "frame.png"), frame_size=(32, 32),
+                               webp_path=str(tmp_path / "scene.webp"),
+                               thumbnail_path=str(tmp_path / "thumb.jpg"))
+    assert written == [str(tmp_path / "thumb.jpg")]
+    # 没有配置视频分辨率时不生成成片帧
+    monkeypatch.setattr(images, "IMAGE_DERIVATIVES", {"frame"})
+    assert make_derivatives(str(src), frame_path=str(tmp_path / "frame.png")) == []
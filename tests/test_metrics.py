@@ -0,0 +1,104 @@
+"""
+Prometheus 指标：渲染格式与增量的批量写入
+"""
+import pytest
+
+from utils import metrics
+from utils.task_store import TaskStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """独立的指标数据库；测试中注册的指标在结束后注销"""
+    store = TaskStore(str(tmp_path / "metrics.db"))
+    metrics.flush()
+    monkeypatch.setattr(metrics, "_store", store)
+    registered = set(metrics._registry)
+    yield store
+    metrics.flush()
+    for name in set(metrics._registry) - registered:
+        del metrics._registry[name]
+
+
+def _lines(name: str):
+    return [line for line in metrics.render().splitlines() if line.startswith(name)]
+
+
+def test_metric_base_is_abstract():
+    with pytest.raises(TypeError):
+        metrics._Metric("test_abstract_metric", "Abstract.")
+    assert "test_abstract_metric" not in metrics._registry
+
+
+def test_duplicate_name_is_rejected(store):
+    metrics.Counter("test_duplicate_total", "Duplicate.")
+    with pytest.raises(ValueError):
+        metrics.Counter("test_duplicate_total", "Duplicate.")
+
+
+def test_counter_renders_per_label(store):
+    counter = metrics.Counter("test_requests_total", "Requests.")
+    counter.inc(result="hit")
+    counter.inc(2, result="hit")
+    counter.inc(result="miss")
+    assert _lines("test_requests_total") == [
+        'test_requests_total{result="hit"} 3',
+        'test_requests_total{result="miss"} 1',
+    ]
+    text = metrics.render()
+    assert "# HELP test_requests_total Requests.\n# TYPE test_requests_total counter\n" in text
+
+
+def test_gauge_reflects_current_process(store):
+    gauge = metrics.Gauge("test_queue_depth", "Queue depth.")
+    gauge.set(3, backend="a")
+    gauge.set(5, backend="a")
+    assert _lines("test_queue_depth") == ['test_queue_depth{backend="a"} 5']
+    gauge.clear()
+    assert _lines("test_queue_depth") == []
+    # 仪表不写入数据库
+    assert not [row for row in store.metric_values() if row[0] == "test_queue_depth"]
+
+
+def test_histogram_renders_cumulative_buckets(store):
+    histogram = metrics.Histogram("test_duration_seconds", "Duration.", buckets=(1, 5))
+    histogram.observe(0.5, stage="tts")
+    histogram.observe(3, stage="tts")
+    histogram.observe(30, stage="tts")
+    assert _lines("test_duration_seconds") == [
+        'test_duration_seconds_bucket{stage="tts",le="1"} 1',
+        'test_duration_seconds_bucket{stage="tts",le="5"} 2',
+        'test_duration_seconds_bucket{stage="tts",le="+Inf"} 3',
+        'test_duration_seconds_sum{stage="tts"} 33.5',
+        'test_duration_seconds_count{stage="tts"} 3',
+    ]
+
+
+def test_timer_records_status(store):
+    histogram = metrics.Histogram("test_timer_seconds", "Timer.")
+    with histogram.time(agent="story"):
+        pass
+    with pytest.raises(RuntimeError):
+        with histogram.time(agent="story"):
+            raise RuntimeError("boom")
+    assert _lines("test_timer_seconds_count") == [
+        'test_timer_seconds_count{agent="story",status="error"} 1',
+        'test_timer_seconds_count{agent="story",status="success"} 1',
+    ]
+
+
+def test_increments_are_batched_until_flush(store):
+    counter = metrics.Counter("test_batched_total", "Batched.")
+    for _ in range(100):
+        counter.inc(worker="1")
+    # 增量只在内存中累加
+    assert not [row for row in store.metric_values() if row[0] == "test_batched_total"]
+
+    metrics.flush()
+    rows = [row for row in store.metric_values() if row[0] == "test_batched_total"]
+    assert rows == [("test_batched_total", '{"worker": "1"}', 100.0)]
+
+    # 其他进程写入的数值在输出时汇总
+    store.add_metric_values([("test_batched_total", '{"worker": "1"}', 20.0)])
+    counter.inc(worker="1")
+    assert _lines("test_batched_total") == ['test_batched_total{worker="1"} 121']
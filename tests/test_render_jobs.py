@@ -0,0 +1,71 @@
+"""
+视频渲染进程池：子进程通过共享任务存储写入进度、读取取消标记
+
+作业函数定义在模块顶层，spawn 出的子进程按模块路径导入它们。
+"""
+import os
+import threading
+import time
+from concurrent.futures import CancelledError
+
+import pytest
+
+from utils.task_manager import TaskManager
+from utils.task_models import TaskStatus, TaskType
+
+
+def quick_render(cancel_event, on_progress=None, steps: int = 4):
+    for step in range(steps):
+        on_progress((step + 1) / steps)
+    return os.getpid()
+
+
+def slow_render(cancel_event, on_progress=None, seconds: float = 20.0):
+    for step in range(100):
+        if cancel_event.wait(seconds / 100):
+            raise CancelledError("视频渲染已取消")
+        on_progress((step + 1) / 100)
+    return os.getpid()
+
+
+@pytest.fixture
+def render_manager(tmp_path):
+    """使用文件数据库的任务管理器：内存数据库无法跨进程共享，渲染会退回当前线程执行"""
+    manager = TaskManager(db_path=str(tmp_path / "tasks.db"))
+    manager.create_task("video_1", TaskType.VIDEO_COMPOSITION, {"run_id": ""})
+    manager.update_task_status("video_1", TaskStatus.RUNNING, progress=0.0)
+    yield manager
+    if manager._render_pool is not None:
+        manager._render_pool.shutdown(cancel_futures=True)
+
+
+def test_render_runs_in_a_child_process_and_reports_progress(render_manager):
+    pid = render_manager._run_render_job("video_1", quick_render, threading.Event(), report_progress=True)
+    assert pid != os.getpid()
+    assert render_manager.get_task("video_1").progress == 100
+    # 子进程写入的进度同时作为任务事件推送
+    progress = [event["data"]["progress"] for event in render_manager.store.events_after(0)
+                if event["event"] == "task" and event["data"]["task_id"] == "video_1"]
+    assert progress[-1] == 100
+
+
+def test_cancel_reaches_the_child_process(render_manager):
+    result = {}
+
+    def run():
+        try:
+            render_manager._run_render_job("video_1", slow_render, threading.Event(), report_progress=True)
+        except CancelledError:
+            result["cancelled_at"] = time.monotonic()
+
+    worker = threading.Thread(target=run)
+    worker.start()
+    # 等子进程开始渲染（进程池按需启动）
+    deadline = time.monotonic() + 30
+    while render_manager.get_task("video_1").progress == 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    requested_at = time.monotonic()
+    assert render_manager.cancel_task("video_1")
+    worker.join(timeout=10)
+    # 子进程每 0.5 秒轮询一次取消标记，远早于 20 秒的渲染结束
+    assert result["cancelled_at"] - requested_at < 3
@@ -0,0 +1,169 @@
+import asyncio
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import pytest
+
+from utils.task_manager import StageGraph, StageState
+from utils.task_models import TaskStatus
+from conftest import finish
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        yield pool
+
+
+def test_validate_rejects_unknown_dependency():
+    graph = StageGraph()
+    graph.add("a", lambda: None, deps=["missing"])
+    with pytest.raises(ValueError, match="未知阶段"):
+        graph.validate()
+
+
+def test_validate_rejects_cycle():
+    graph = StageGraph()
+    graph.add("a", lambda: None, deps=["c"])
+    graph.add("b", lambda: None, deps=["a"])
+    graph.add("c", lambda: None, deps=["b"])
+    with pytest.raises(ValueError, match="环"):
+        graph.validate()
+
+
+def test_add_rejects_duplicate():
+    graph = StageGraph()
+    graph.add("a", lambda: None)
+    with pytest.raises(ValueError, match="重复"):
+        graph.add("a", lambda: None)
+
+
+def test_runs_in_dependency_order(executor):
+    order = []
+    lock = threading.Lock()
+
+    def record(name):
+        def run():
+            with lock:
+                order.append(name)
+        return run
+
+    graph = StageGraph()
+    graph.add("video", record("video"), deps=["image", "audio"])
+    graph.add("image", record("image"))
+    graph.add("audio", record("audio"))
+    stages = graph.run(executor)
+    assert all(stage.state == StageState.COMPLETED for stage in stages.values())
+    assert order[-1] == "video"
+
+
+def test_failure_skips_only_dependents(executor):
+    def fail():
+        raise RuntimeError("boom")
+
+    graph = StageGraph()
+    graph.add("image_0", fail)
+    graph.add("audio_0", lambda: None)
+    graph.add("segment_0", lambda: None, deps=["image_0", "audio_0"])
+    graph.add("compose", lambda: None, deps=["segment_0"])
+    graph.add("image_1", lambda: None)
+    stages = graph.run(executor)
+    assert stages["image_0"].state == StageState.FAILED
+    assert stages["image_0"].error == "boom"
+    assert stages["segment_0"].state == StageState.SKIPPED
+    # 跳过沿依赖链向下传播
+    assert stages["compose"].state == StageState.SKIPPED
+    assert stages["audio_0"].state == StageState.COMPLETED
+    assert stages["image_1"].state == StageState.COMPLETED
+
+
+def test_cancel_skips_pending_stages(executor):
+    cancel_event = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        cancel_event.wait(5)
+
+    graph = StageGraph()
+    graph.add("first", slow)
+    graph.add("second", lambda: None, deps=["first"])
+    graph.add("third", lambda: None, deps=["second"])
+    threading.Timer(0.1, cancel_event.set).start()
+    stages = graph.run(executor, cancel_event=cancel_event)
+    assert started.is_set()
+    # 运行中的阶段自行结束，其后的阶段不再提交
+    assert stages["first"].state == StageState.COMPLETED
+    assert stages["second"].state == StageState.SKIPPED
+    assert stages["third"].state == StageState.SKIPPED
+    assert stages["second"].error == "任务已取消"
+
+
+def test_cancel_withdraws_queued_stages():
+    cancel_event = threading.Event()
+    release = threading.Event()
+    with ThreadPoolExecutor(max_workers=1) as single:
+        graph = StageGraph()
+        graph.add("busy", lambda: release.wait(5))
+        # 单线程执行器被 busy 占用，queued 只能排队
+        graph.add("queued", lambda: None)
+        threading.Timer(0.1, cancel_event.set).start()
+        threading.Timer(0.8, release.set).start()
+        stages = graph.run(single, cancel_event=cancel_event)
+    assert stages["queued"].state == StageState.CANCELLED
+    assert stages["busy"].state == StageState.COMPLETED
+
+
+def test_cancelled_stage_skips_dependents(executor):
+    def interrupted():
+        raise CancelledError("任务已取消")
+
+    graph = StageGraph()
+    graph.add("image_0", interrupted)
+    graph.add("segment_0", lambda: None, deps=["image_0"])
+    graph.add("final", lambda: None, deps=["segment_0"])
+    stages = graph.run(executor)
+    assert stages["image_0"].state == StageState.CANCELLED
+    assert stages["segment_0"].state == StageState.SKIPPED
+    assert stages["final"].state == StageState.SKIPPED
+
+
+def _pipeline_graph(image_0):
+    def build(task_id, scenes_data, workspace, cancel_event, resume=False, scene_progress=None):
+        graph = StageGraph()
+        graph.add("image_0", image_0)
+        graph.add("audio_0", lambda: None)
+        graph.add("segment_0", lambda: None, deps=["image_0", "audio_0"])
+        graph.add("final", lambda: None, deps=["segment_0"])
+        return graph
+    return build
+
+
+def _run_pipeline(manager):
+    async def main():
+        task_id = await manager.submit_pipeline_task([{"sd_prompt": "a cat"}])
+        return await finish(manager, task_id)
+
+    return asyncio.run(main())
+
+
+def test_pipeline_fails_when_a_stage_is_cancelled_without_task_cancel(workdir, manager, monkeypatch):
+    # 例如 ComfyUI 上的 prompt 被他人中断：阶段以取消结束，但任务本身没有被取消
+    def interrupted():
+        raise CancelledError("ComfyUI 任务已取消")
+
+    monkeypatch.setattr(manager, "_build_pipeline_graph", _pipeline_graph(interrupted))
+    task = _run_pipeline(manager)
+    assert task.status == TaskStatus.FAILED
+    assert "image_0" in task.error_message
+    stages = task.result["stages"]
+    assert stages["image_0"]["state"] == "cancelled"
+    assert stages["segment_0"]["state"] == "skipped"
+    assert stages["final"]["state"] == "skipped"
+
+
+def test_pipeline_completes_when_every_stage_completes(workdir, manager, monkeypatch):
+    monkeypatch.setattr(manager, "_build_pipeline_graph", _pipeline_graph(lambda: None))
+    task = _run_pipeline(manager)
+    assert task.status == TaskStatus.COMPLETED
+    assert {stage["state"] for stage in task.result["stages"].values()} == {"completed"}
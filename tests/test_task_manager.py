@@ -0,0 +1,114 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from utils.task_manager import TaskManager
+from utils.task_models import TaskStatus, TaskType
+from utils.task_store import TaskStore
+from conftest import finish
+
+
+def _insert_orphan(store: TaskStore, task_id: str, status: str = "running", age: float = 600.0):
+    """写入一个由已退出的 worker 留下的任务：心跳停在 age 秒前"""
+    store.insert({"task_id": task_id, "task_type": "image_generation", "status": status,
+                  "params": {"run_id": ""}}, owner="gone-host:1:deadbeef")
+    conn = store._connect()
+    with conn:
+        conn.execute("UPDATE tasks SET heartbeat_at = ? WHERE task_id = ?", (time.time() - age, task_id))
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "tasks.db")
+
+
+@pytest.mark.parametrize("status", ["pending", "running"])
+def test_orphaned_tasks_fail_on_startup(db_path, status):
+    _insert_orphan(TaskStore(db_path), "t1", status)
+    manager = TaskManager(db_path=db_path)
+    task = manager.get_task("t1")
+    assert task.status == TaskStatus.FAILED
+    assert "worker 已退出" in task.error_message
+    assert task.end_time is not None
+
+
+def test_orphaned_task_fails_when_read(db_path):
+    manager = TaskManager(db_path=db_path)
+    # 启动之后才过期的遗留任务在读取时回收，等待它的客户端立即拿到终态
+    _insert_orphan(manager.store, "t1")
+    task = asyncio.run(manager.wait_for("t1", timeout=5))
+    assert task.status == TaskStatus.FAILED
+
+
+def test_live_tasks_are_not_reaped(db_path):
+    manager = TaskManager(db_path=db_path)
+    manager.create_task("live", TaskType.IMAGE_GENERATION, {"run_id": ""})
+    _insert_orphan(manager.store, "orphan")
+    statuses = {task.task_id: task.status for task in manager.list_tasks()}
+    assert statuses == {"live": TaskStatus.PENDING, "orphan": TaskStatus.FAILED}
+    # 心跳刷新的是本实例创建的任务
+    assert manager.store.heartbeat(manager.owner) == 1
+
+
+def test_recent_heartbeat_keeps_task(db_path):
+    _insert_orphan(TaskStore(db_path), "t1", age=5)
+    manager = TaskManager(db_path=db_path)
+    assert manager.get_task("t1").status == TaskStatus.RUNNING
+
+
+def test_cleanup_collects_orphans(db_path):
+    manager = TaskManager(db_path=db_path)
+    _insert_orphan(manager.store, "t1")
+    manager.cleanup_completed_tasks(older_than_hours=0)
+    assert manager.get_task("t1") is None
+
+
+def test_wait_for_returns_on_progress(manager):
+    manager.create_task("t1", TaskType.IMAGE_GENERATION, {"run_id": ""})
+    manager.update_task_status("t1", TaskStatus.RUNNING, progress=0.0)
+    threading.Timer(0.2, manager.update_task_status, ("t1", TaskStatus.RUNNING), {"progress": 5.0}).start()
+    threading.Timer(0.4, manager.update_task_status, ("t1", TaskStatus.RUNNING), {"progress": 30.0}).start()
+
+    start = time.monotonic()
+    task = asyncio.run(manager.wait_for("t1", timeout=10, min_progress_delta=10))
+    # 5% 的进展不足以返回，30% 时立即返回
+    assert task.progress == 30.0
+    assert time.monotonic() - start < 5
+
+
+def test_wait_for_times_out_with_current_state(manager):
+    manager.create_task("t1", TaskType.IMAGE_GENERATION, {"run_id": ""})
+    manager.update_task_status("t1", TaskStatus.RUNNING, progress=10.0)
+    task = asyncio.run(manager.wait_for("t1", timeout=0.3, min_progress_delta=10))
+    assert task.status == TaskStatus.RUNNING
+    assert task.progress == 10.0
+
+
+def test_store_lock_does_not_block_event_loop(db_path, workdir):
+    manager = TaskManager(db_path=db_path)
+    # 另一个 worker 长时间持有写锁
+    locker = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+    locker.execute("BEGIN IMMEDIATE")
+    threading.Timer(1.0, locker.rollback).start()
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.05)
+                ticks += 1
+
+        ticking = asyncio.ensure_future(ticker())
+        task_id = await manager.submit_image_generation_task([{"sd_prompt": "a cat", "seed": 1}])
+        ticks_while_locked = ticks
+        ticking.cancel()
+        await finish(manager, task_id)
+        return ticks_while_locked
+
+    # 提交在等待写锁期间，事件循环上的其他协程照常运行
+    assert asyncio.run(main()) >= 10
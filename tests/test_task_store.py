@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils import task_store
+from utils.task_store import TaskStore
+
+
+def _insert(store: TaskStore, task_id: str, status: str = "pending"):
+    store.insert({"task_id": task_id, "task_type": "video_composition", "status": status,
+                  "progress": 0.0, "params": {"run_id": "r1"}})
+
+
+@pytest.fixture
+def store():
+    return TaskStore(":memory:")
+
+
+def test_update_status_keeps_unset_fields(store):
+    _insert(store, "t1")
+    assert store.update_status("t1", "running", progress=10, start_time=100.0)
+    assert store.update_status("t1", "running", progress=40, start_time=200.0)
+    task = store.get("t1")
+    assert task["progress"] == 40
+    # start_time 只在首次写入
+    assert task["start_time"] == 100.0
+    assert task["params"] == {"run_id": "r1"}
+
+
+@pytest.mark.parametrize("final", ["completed", "failed", "cancelled"])
+def test_final_state_is_not_overwritten(store, final):
+    _insert(store, "t1")
+    assert store.update_status("t1", final, progress=100, end_time=1.0)
+    assert not store.update_status("t1", "running", progress=50)
+    assert not store.update_status("t1", "completed", result={"late": True})
+    task = store.get("t1")
+    assert task["status"] == final
+    assert task["progress"] == 100
+    assert task["result"] is None
+
+
+def test_request_cancel_only_for_unfinished(store):
+    _insert(store, "t1")
+    _insert(store, "t2")
+    store.update_status("t2", "completed")
+    assert store.request_cancel("t1")
+    assert not store.request_cancel("t2")
+    assert not store.request_cancel("missing")
+    assert store.cancel_requested_ids(["t1", "t2"]) == ["t1"]
+
+
+def test_events_after_is_ordered_and_limited(store):
+    ids = [store.append_event("task", {"n": n}) for n in range(5)]
+    assert ids == sorted(ids)
+    events = store.events_after(ids[1], limit=2)
+    assert [event["data"]["n"] for event in events] == [2, 3]
+    assert store.event_id_range() == (ids[0], ids[-1])
+
+
+def test_old_events_are_pruned(store, monkeypatch):
+    monkeypatch.setattr(task_store, "EVENT_RETENTION", 100)
+    for n in range(1000):
+        store.append_event("file", {"n": n})
+    first_id, latest_id = store.event_id_range()
+    assert latest_id == 1000
+    # 每 500 条清理一次，清理后只保留最近 EVENT_RETENTION 条
+    assert first_id == 1000 - 100 + 1
+    assert len(store.events_after(0, limit=2000)) == 100
+
+
+def test_memory_store_allows_concurrent_writers(store):
+    # 共享缓存的内存库并发写入时会直接报 "database table is locked"
+    def write(worker: int):
+        for n in range(50):
+            task_id = f"w{worker}_{n}"
+            _insert(store, task_id)
+            store.update_status(task_id, "running", progress=n)
+            store.append_event("task", {"task_id": task_id})
+            store.get(task_id)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(write, range(8)))
+    assert len(store.list_tasks(status="running")) == 400
+    assert len(store.events_after(0, limit=1000)) == 400
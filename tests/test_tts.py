@@ -0,0 +1,55 @@
+"""
+utils/tts.py 的同步接口：在共享的后台事件循环上调用进程内的 edge-tts 合成
+"""
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("pysrt")
+pytest.importorskip("pydub")
+
+from utils import edge_tts, tts
+
+
+def test_voice_types_map_to_edge_voices(tmp_path, fake_tts):
+    tts.generate_audio("你好。", str(tmp_path / "male.mp3"), voice_type="male")
+    tts.generate_audio("你好。", str(tmp_path / "other.mp3"), voice_type="robot")
+    assert [call["voice"] for call in fake_tts.calls] == [tts.VOICE_MAP["male"], tts.VOICE_MAP["narrator"]]
+    assert os.path.getsize(tmp_path / "male.mp3") == 2 * len(fake_tts.CHUNK)
+
+
+def test_audio_with_srt_reports_duration_from_size(tmp_path, fake_tts):
+    duration, _ = tts.generate_audio_with_srt("今天天气很好", str(tmp_path / "a.mp3"), str(tmp_path / "a.srt"))
+    assert duration == 1.5
+    with open(tmp_path / "a.srt", encoding="utf-8") as f:
+        assert f.read() == "1\n00:00:00,000 --> 00:00:01,500\n今天天气很好\n\n"
+
+
+def test_sync_call_from_running_loop_is_refused(tmp_path, fake_tts):
+    async def main():
+        tts.generate_audio("你好。", str(tmp_path / "a.mp3"))
+
+    with pytest.raises(RuntimeError, match="generate_audio_async"):
+        asyncio.run(main())
+    assert fake_tts.calls == []
+
+
+def test_sync_wait_is_bounded(tmp_path, fake_tts):
+    fake_tts.delay = 5
+    with pytest.raises(TimeoutError):
+        tts._run(tts.generate_audio_async("你好。", str(tmp_path / "a.mp3")), timeout=0.2)
+
+
+def test_sentences_are_synthesized_concurrently(tmp_path, fake_tts, monkeypatch):
+    monkeypatch.setattr(edge_tts, "TTS_CONCURRENCY", 2)
+    fake_tts.fail.add("第三句")
+    sentences = [("第一句", "male"), ("第二句", "female"), ("第三句", "narrator"), ("第四句", "narrator")]
+
+    audio_files, srt_files = tts.generate_sentence_audio_and_srt(sentences, str(tmp_path), scene_id=7)
+    assert fake_tts.max_active == 2
+    # 单句失败不影响其他句子
+    assert [os.path.basename(path) for path in audio_files] == [
+        "scene_7_sentence_1.wav", "scene_7_sentence_2.wav", "scene_7_sentence_4.wav",
+    ]
+    assert all(os.path.exists(path) for path in audio_files + srt_files)
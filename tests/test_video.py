@@ -0,0 +1,62 @@
+"""
+成片时间线：由配音元数据规划，构建片段时不探测音频
+"""
+import os
+
+from PIL import Image
+
+from utils.edge_tts import SubtitleCue, audio_metadata
+from utils.video import create_video_clip, plan_scene, plan_timeline
+from utils.workspace import Workspace
+
+
+def _scene(workspace: Workspace, idx: int, seconds: float, image: bool = True, record: bool = True):
+    """写入一个场景的素材：48 kbps 下 seconds 秒的“音频”（不是有效的 MP3）、图片与配音元数据"""
+    audio = bytes(int(seconds * 6000))
+    os.makedirs(workspace.audio_dir, exist_ok=True)
+    with open(workspace.audio(idx), "wb") as f:
+        f.write(audio)
+    if image:
+        os.makedirs(workspace.images_dir, exist_ok=True)
+        Image.new("RGB", (32, 32), (10, 20, 30)).save(workspace.image(idx))
+    if record:
+        audio_metadata(audio, [SubtitleCue(1, 0.0, seconds, f"第{idx}句")]).save(workspace.audio_record(idx))
+
+
+def test_timeline_is_planned_from_metadata(workdir):
+    workspace = Workspace("run_a")
+    _scene(workspace, 0, 1.5)
+    _scene(workspace, 1, 2.0)
+    _scene(workspace, 2, 1.0, image=False)
+    plans, missing = plan_timeline(workspace, [0, 1, 2])
+
+    assert [plan.scene_id for plan in plans] == [0, 1]
+    assert [plan.duration for plan in plans] == [1.5, 2.0]
+    assert plans[0].image_file == workspace.image(0)
+    assert plans[0].srt_file is None
+    assert len(missing) == 1 and "图片缺失" in missing[0]
+
+
+def test_stale_or_missing_metadata_falls_back_to_probing(workdir):
+    workspace = Workspace()
+    _scene(workspace, 0, 1.0)
+    # 音频在记录元数据之后被替换
+    with open(workspace.audio(0), "ab") as f:
+        f.write(bytes(100))
+    _scene(workspace, 1, 1.0, record=False)
+    assert plan_scene(workspace, 0).duration is None
+    assert plan_scene(workspace, 1).metadata is None
+
+
+def test_clip_from_metadata_does_not_open_audio(workdir):
+    workspace = Workspace()
+    _scene(workspace, 0, 2.5)
+    plan = plan_scene(workspace, 0)
+    plan.metadata.cues = []
+    # 音频不是有效的 MP3：构建片段时若探测音频就会失败
+    clip = create_video_clip(plan.audio_file, plan.image_file, plan.srt_file, metadata=plan.metadata)
+    try:
+        assert clip.duration == 2.5
+        assert clip.audio.duration == 2.5
+    finally:
+        clip.close()
@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from utils.workflow import WorkflowTemplate, get_template
+from conftest import ROOT
+
+WORKFLOW_PATH = os.path.join(ROOT, "assets", "workflow", "config.json")
+
+
+@pytest.fixture
+def template() -> WorkflowTemplate:
+    return WorkflowTemplate.load(WORKFLOW_PATH)
+
+
+def test_slots_follow_sampler_links(template):
+    assert template.output_node == "save_image_websocket_node"
+    assert template.sampler_node == "3"
+    assert template.slots["positive"].node_id == "6"
+    assert template.slots["negative"].node_id == "7"
+    assert template.slots["width"].node_id == "5"
+    assert template.slots["seed"].input_name == "seed"
+
+
+def test_render_rewrites_slots_without_touching_template(template):
+    prompt = template.render(positive="a cat", seed=7, width=512, steps=None)
+    assert prompt["6"]["inputs"]["text"] == "a cat"
+    assert prompt["3"]["inputs"]["seed"] == 7
+    assert prompt["5"]["inputs"]["width"] == 512
+    # None 保持模板默认值
+    assert prompt["3"]["inputs"]["steps"] == template.default("steps")
+    # 只复制被修改的节点，其余节点与模板共享
+    assert template.render()["6"]["inputs"]["text"] == template.default("positive")
+    assert prompt["4"] is template.render()["4"]
+
+
+@pytest.mark.parametrize("values", [{"width": 513}, {"steps": 0}, {"seed": True}, {"unknown": 1}])
+def test_render_rejects_invalid_values(template, values):
+    with pytest.raises(ValueError):
+        template.render(**values)
+
+
+def test_render_batch_clones_varying_nodes(template):
+    prompt, outputs = template.render_batch([
+        {"positive": "a cat", "seed": 1},
+        {"positive": "a dog", "seed": 2},
+    ])
+    assert outputs == ["b0_save_image_websocket_node", "b1_save_image_websocket_node"]
+    # 提示词与种子不同：正向提示词、采样器及其下游按组复制
+    for prefix, text, seed in (("b0_", "a cat", 1), ("b1_", "a dog", 2)):
+        assert prompt[prefix + "6"]["inputs"]["text"] == text
+        assert prompt[prefix + "3"]["inputs"]["seed"] == seed
+        assert prompt[prefix + "3"]["inputs"]["positive"] == [prefix + "6", 0]
+        assert prompt[prefix + "8"]["inputs"]["samples"] == [prefix + "3", 0]
+        assert prompt[prefix + "save_image_websocket_node"]["inputs"]["images"] == [prefix + "8", 0]
+        # 共享节点的连线不加前缀
+        assert prompt[prefix + "3"]["inputs"]["model"] == ["4", 0]
+        assert prompt[prefix + "3"]["inputs"]["negative"] == ["7", 0]
+    # 取值相同的节点只保留一份
+    for node_id in ("4", "5", "7"):
+        assert node_id in prompt
+        assert "b0_" + node_id not in prompt
+    for node_id in ("3", "6", "8", "save_image_websocket_node"):
+        assert node_id not in prompt
+
+
+def test_render_batch_single_item_is_plain_render(template):
+    prompt, outputs = template.render_batch([{"positive": "a cat"}])
+    assert outputs == [template.output_node]
+    assert prompt == template.render(positive="a cat")
+
+
+def test_get_template_reloads_on_change(tmp_path):
+    path = tmp_path / "workflow.json"
+    with open(WORKFLOW_PATH, "r", encoding="utf-8") as f:
+        original = f.read()
+    path.write_text(original, encoding="utf-8")
+    first = get_template(str(path))
+    assert get_template(str(path)) is first
+    path.write_text(original.replace('"steps": 25', '"steps": 30'), encoding="utf-8")
+    os.utime(path, ns=(1, 1))
+    assert get_template(str(path)).default("steps") == 30
@@ -0,0 +1,54 @@
+import asyncio
+import os
+
+import pytest
+
+from utils.task_models import TaskStatus
+from utils.workspace import Workspace, new_run_id
+from conftest import finish
+
+
+def test_default_workspace_uses_output_root():
+    workspace = Workspace()
+    assert workspace.image(3) == os.path.join("output", "images", "scene_3.png")
+    assert workspace.final_video == os.path.join("output", "final_video.mp4")
+
+
+def test_run_workspace_is_isolated():
+    workspace = Workspace("run_1")
+    assert workspace.root == os.path.join("output", "runs", "run_1")
+    assert workspace.audio(0).startswith(workspace.root + os.sep)
+
+
+@pytest.mark.parametrize("run_id", ["../etc", "a/b", "a b", "x" * 65])
+def test_unsafe_run_ids_are_rejected(run_id):
+    with pytest.raises(ValueError, match="非法的运行ID"):
+        Workspace(run_id)
+
+
+def test_new_run_ids_are_valid_and_unique():
+    ids = {new_run_id() for _ in range(50)}
+    assert len(ids) == 50
+    for run_id in ids:
+        Workspace(run_id)
+
+
+def test_concurrent_runs_write_to_their_own_workspace(workdir, comfyui_backends, manager):
+    comfyui_backends()
+    first, second = Workspace("run_a"), Workspace("run_b")
+
+    async def main():
+        task_ids = [
+            await manager.submit_image_generation_task([{"sd_prompt": f"{run} scene", "seed": 1}], workspace=workspace)
+            for run, workspace in (("a", first), ("b", second))
+        ]
+        return [await finish(manager, task_id) for task_id in task_ids]
+
+    tasks = asyncio.run(main())
+    assert [task.status for task in tasks] == [TaskStatus.COMPLETED] * 2
+    assert tasks[0].result["output_directory"] == first.images_dir
+    assert os.path.exists(first.image(0)) and os.path.exists(second.image(0))
+    assert not os.path.exists(Workspace().image(0))
+    # 文件事件的路径相对 output/，前端据此定位到对应的运行
+    paths = {event["data"]["path"] for event in manager.store.events_after(0) if event["event"] == "file"}
+    assert {"runs/run_a/images/scene_0.png", "runs/run_b/images/scene_0.png"} <= paths
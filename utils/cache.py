@@ -0,0 +1,119 @@
+"""
+内容寻址的磁盘缓存：以请求内容的哈希作为键，条目存为 .cache/ 下的独立文件，按总大小做 LRU 淘汰
+
+多个 uvicorn worker 与渲染子进程可共享同一个缓存目录：写入先落到临时文件再原子重命名，
+访问时间记录在文件的 mtime 上，淘汰时按 mtime 从旧到新删除。
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Any, List, Optional, Tuple
+
+# 超过上限后淘汰到上限的该比例以下，避免每次写入都触发淘汰
+_EVICT_RATIO = 0.9
+
+
+def cache_key(*parts: Any) -> str:
+    """由任意可 JSON 序列化的内容计算缓存键（SHA-256 十六进制）"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """内容寻址的磁盘缓存
+
+    条目路径为 {directory}/{key[:2]}/{key}{suffix}。max_bytes 为 0 时缓存关闭，
+    get 总是未命中、put 不写入。
+    """
+
+    def __init__(self, directory: str, max_bytes: int, suffix: str = ""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        # 本进程估计的缓存总大小，首次写入时扫描目录得到；其他进程的写入在下一次淘汰扫描时计入
+        self._size: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """读取条目，未命中返回 None；命中时刷新访问时间"""
+        if not self.enabled:
+            return None
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            print(f"警告：读取缓存失败 {path}: {e}")
+            return None
+        return data
+
+    def put(self, key: str, data: bytes):
+        """写入条目（同键覆盖），必要时淘汰最久未访问的条目；缓存写入失败不影响调用方"""
+        if not self.enabled:
+            return
+        path = self.path(key)
+        dir_name = os.path.dirname(path)
+        try:
+            os.makedirs(dir_name, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=dir_name, prefix=".tmp_")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            print(f"警告：写入缓存失败 {path}: {e}")
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._size = self._evict()
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """扫描缓存目录，返回 (访问时间, 大小, 路径) 列表"""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith(".tmp_"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self) -> int:
+        """按访问时间从旧到新删除条目，直到总大小降到阈值以下，返回剩余大小"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * _EVICT_RATIO
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                # 已被其他进程淘汰
+                pass
+            total -= size
+        return total
@@ -1,93 +1,973 @@
 #This is an example that uses the websockets api and the SaveImageWebsocket node to get images directly without
 #them being saved to disk
 
-import websocket #NOTE: websocket-client (https://github.com/websocket-client/websocket-client)
+import aiohttp
+import asyncio
 import uuid
 import json
-import urllib.request
-import urllib.parse
-from PIL import Image
-import io
 import os
 import dotenv
 import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Union
+from utils.cache import DiskCache, cache_key
+from utils.images import save_images
+from utils.metrics import COMFYUI_WATCHDOG_EVENTS, IMAGE_CACHE_REQUESTS, IMAGE_GENERATION_SECONDS
+from utils.workflow import WorkflowTemplate, get_template
 
 dotenv.load_dotenv('.env')
 
-server_address = os.getenv('COMFYUI_BASE_URL')
-client_id = str(uuid.uuid4())
-
-def queue_prompt(prompt):
-    p = {"prompt": prompt, "client_id": client_id}
-    data = json.dumps(p).encode('utf-8')
-    req =  urllib.request.Request("http://{}/prompt".format(server_address), data=data)
-    return json.loads(urllib.request.urlopen(req).read())
-
-def get_image(filename, subfolder, folder_type):
-    data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
-    url_values = urllib.parse.urlencode(data)
-    with urllib.request.urlopen("http://{}/view?{}".format(server_address, url_values)) as response:
-        return response.read()
-
-def get_history(prompt_id):
-    with urllib.request.urlopen("http://{}/history/{}".format(server_address, prompt_id)) as response:
-        return json.loads(response.read())
-
-def get_images(ws, prompt):
-    prompt_id = queue_prompt(prompt)['prompt_id']
-    output_images = {}
-    current_node = ""
-    while True:
-        out = ws.recv()
-        if isinstance(out, str):
-            message = json.loads(out)
-            if message['type'] == 'executing':
-                data = message['data']
-                if data['prompt_id'] == prompt_id:
-                    if data['node'] is None:
-                        break #Execution is done
-                    else:
-                        current_node = data['node']
+# 可配置多个后端，以逗号分隔；get_client 未指定地址时使用第一个
+server_addresses = [a.strip() for a in (os.getenv('COMFYUI_BASE_URL') or '').split(',') if a.strip()]
+server_address = server_addresses[0] if server_addresses else None
+
+# 连接 ComfyUI websocket 的超时秒数与单个 HTTP 请求的超时秒数
+CONNECT_TIMEOUT = 10
+HTTP_TIMEOUT = 30
+# websocket 心跳间隔（秒）：超过间隔的一半未收到 pong 即视为连接已死，断开重连
+WS_HEARTBEAT = 30
+# prompt 看门狗：检查间隔；某个 prompt 持续多少秒没有任何消息就向后端核实它是否还在队列中；
+# 排队的最长秒数与每个输出（打包时每个请求）执行的最长秒数；丢失的 prompt 自动重新提交的次数
+WATCHDOG_INTERVAL = float(os.getenv("COMFYUI_WATCHDOG_INTERVAL", "5"))
+SILENCE_TIMEOUT = float(os.getenv("COMFYUI_SILENCE_TIMEOUT", "60"))
+QUEUE_TIMEOUT = float(os.getenv("COMFYUI_QUEUE_TIMEOUT", "1800"))
+EXECUTION_TIMEOUT = float(os.getenv("COMFYUI_EXECUTION_TIMEOUT", "300"))
+PROMPT_RETRIES = int(os.getenv("COMFYUI_PROMPT_RETRIES", "2"))
+# 同时到达、采样设置相同的请求合并进一个 prompt：最多合并的请求数与等待凑批的秒数
+PACK_SIZE = int(os.getenv("COMFYUI_PACK_SIZE", "4"))
+PACK_WINDOW = float(os.getenv("COMFYUI_PACK_WINDOW", "0.05"))
+# 渲染结果缓存：相同的 (工作流, 提示词, 负向提示词, 种子, 分辨率, 步数, 批大小) 直接读取磁盘上的图片
+# 后端负载均衡：/queue 队列深度的刷新间隔（秒），与后端失败后移出轮转的冷却时间（秒）
+QUEUE_POLL_INTERVAL = float(os.getenv("COMFYUI_QUEUE_POLL_INTERVAL", "1"))
+BACKEND_COOLDOWN = float(os.getenv("COMFYUI_BACKEND_COOLDOWN", "30"))
+# 渲染延迟的指数滑动平均系数
+LATENCY_EWMA_ALPHA = 0.3
+CACHE_DIR = os.getenv("COMFYUI_CACHE_DIR") or ".cache/images"
+CACHE_MAX_MB = int(os.getenv("COMFYUI_CACHE_MAX_MB", "2048"))
+
+image_cache = DiskCache(CACHE_DIR, CACHE_MAX_MB * 1024 * 1024, suffix=".png")
+
+class PromptLostError(ConnectionError):
+    """ComfyUI 丢失了 prompt（后端重启、队列被清空），或执行完成但图片无法取回；可重新提交"""
+
+
+class PromptTimeoutError(asyncio.TimeoutError):
+    """prompt 排队或执行超过了截止时间"""
+
+
+class PromptInterruptedError(RuntimeError):
+    """prompt 在 ComfyUI 上被中断：有人在 ComfyUI 界面上取消，或旧版 ComfyUI 的 /interrupt
+    忽略 prompt_id，撤销其他任务时中断了它。不是本地取消，按普通失败处理"""
+
+
+class _PromptWaiter:
+    """单个 prompt 的执行状态，由客户端的读任务根据收到的消息更新"""
+
+    def __init__(self, output_nodes: Iterable[str],
+                 on_output: Optional[Callable[[str, List[bytes]], None]] = None,
+                 on_progress: Optional[Callable[[str, int, int], None]] = None,
+                 on_preview: Optional[Callable[[str, bytes], None]] = None):
+        # 输出图片的 SaveImageWebsocket 节点ID，只收集这些节点执行期间的二进制帧（跳过采样预览）
+        self.output_nodes = set(output_nodes)
+        # 某个输出节点执行完毕时回调，打包的 prompt 中先完成的请求可以提前返回
+        self.on_output = on_output
+        # 采样步数进度 (节点ID, 当前步, 总步数) 与潜空间预览图 (节点ID, 图片字节) 回调
+        self.on_progress = on_progress
+        self.on_preview = on_preview
+        self.done = asyncio.Event()
+        self.images: Dict[str, List[bytes]] = {}
+        # 已收齐图片的输出节点
+        self.finished_nodes: Set[str] = set()
+        self.current_node: Optional[str] = None
+        self.started = False
+        # 开始执行的时间（不含排队），用于统计后端的渲染耗时与执行截止时间
+        self.started_at: Optional[float] = None
+        # 提交成功（后端已确认入队）的时间；此前看门狗不检查该 prompt
+        self.queued_at: Optional[float] = None
+        # 最近一次收到该 prompt 消息（或后端确认它仍在队列中）的时间
+        self.last_activity = time.monotonic()
+        # 等待期间 websocket 断开过，部分消息与图片帧可能已丢失
+        self.stream_gap = False
+        self.error: Optional[BaseException] = None
+
+    @property
+    def deadline(self) -> Optional[float]:
+        """当前阶段（排队或执行）的截止时间"""
+        if self.started_at is not None:
+            return self.started_at + EXECUTION_TIMEOUT * max(1, len(self.output_nodes))
+        if self.queued_at is not None:
+            return self.queued_at + QUEUE_TIMEOUT
+        return None
+
+    def handle(self, message):
+        self.last_activity = time.monotonic()
+        message_type = message['type']
+        data = message['data']
+        if message_type == 'executing':
+            self._finish_output()
+            if data['node'] is None:
+                self.done.set() #Execution is done
+            else:
+                self._start()
+                self.current_node = data['node']
+        elif message_type == 'execution_start':
+            self._start()
+        elif message_type == 'progress':
+            if self.on_progress is not None and data.get('max'):
+                self.on_progress(data.get('node') or self.current_node, data['value'], data['max'])
+        elif message_type == 'execution_error':
+            self.fail(RuntimeError(f"ComfyUI 执行失败: {data.get('exception_message', '')}".strip()))
+        elif message_type == 'execution_interrupted':
+            # 看门狗判定超时后会中断 prompt，随后到达的中断消息不能覆盖超时错误
+            self.fail(PromptInterruptedError(f"ComfyUI 任务被中断: {data.get('prompt_id')}"))
+
+    def _start(self):
+        if not self.started:
+            self.started = True
+            self.started_at = time.monotonic()
+
+    def handle_binary(self, out):
+        self.last_activity = time.monotonic()
+        if self.current_node in self.output_nodes:
+            # 去掉 8 字节帧头
+            self.images.setdefault(self.current_node, []).append(out[8:])
+        elif self.current_node is not None and self.on_preview is not None:
+            # 采样节点执行期间的二进制帧是潜空间预览（需 ComfyUI 以 --preview-method 启动）
+            self.on_preview(self.current_node, out[8:])
+
+    def _finish_output(self):
+        node = self.current_node
+        if node in self.output_nodes:
+            self.finished_nodes.add(node)
+            if self.on_output is not None:
+                self.on_output(node, self.images.get(node, []))
+
+    def fail(self, error: BaseException):
+        if not self.done.is_set():
+            self.error = error
+            self.done.set()
+
+    def recover(self, images: Dict[str, List[bytes]]):
+        """用从 /history 取回的图片补齐未收到的输出，并结束等待"""
+        if self.done.is_set():
+            return
+        for node, node_images in images.items():
+            self.images[node] = node_images
+            self.finished_nodes.add(node)
+            if self.on_output is not None:
+                self.on_output(node, node_images)
+        self.done.set()
+
+
+@dataclass
+class _PackMember:
+    """等待打包提交的一个请求"""
+    values: Dict[str, Any]
+    future: asyncio.Future
+    on_progress: Optional[Callable[[int, int], None]] = None
+    on_preview: Optional[Callable[[bytes], None]] = None
+
+
+class AsyncComfyUIClient:
+    """与一个 ComfyUI 后端通信的异步客户端
+
+    HTTP 请求共用一个带连接池的 aiohttp 会话；websocket 只保持一条长连接，读任务按
+    prompt_id 把消息分发给对应的等待者，大量 prompt 可以在同一个事件循环、同一条连接上
+    并发等待，而不需要每张图片占用一个线程。二进制图片帧不带 prompt_id，按 ComfyUI
+    串行执行的特点归属于当前正在执行的 prompt。连接断开后自动重连。
+
+    看门狗任务保证每个等待都会结束：排队或执行超时的 prompt 被撤销并以 PromptTimeoutError
+    失败；长时间没有消息（或断线重连后）的 prompt 向后端核实，已不在队列中的从 /history
+    取回输出，取不回的以 PromptLostError 失败并由 run_prompt 自动重新提交。
+
+    ComfyUI 按 client_id 只保留一条 websocket，因此每个客户端使用独立的 client_id。
+    客户端绑定到首次使用它的事件循环。
+    """
+
+    # 未登记等待者的 prompt 最多缓存的消息数（兼容不支持客户端指定 prompt_id 的旧版 ComfyUI）
+    MAX_UNCLAIMED = 32
+
+    def __init__(self, address: Optional[str] = None):
+        self.address = address or server_address
+        self.client_id = str(uuid.uuid4())
+        self._http: Optional[aiohttp.ClientSession] = None
+        self._ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._watchdog: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+        # 最近一次连接尝试失败、尚未重连成功时置位，等待连接的请求立即失败而不是等到超时
+        self._connect_failed = asyncio.Event()
+        self._closed = False
+        self._waiters: Dict[str, _PromptWaiter] = {}
+        self._unclaimed: "OrderedDict[str, list]" = OrderedDict()
+        # 当前正在执行的 prompt，二进制帧归属于它
+        self._executing: Optional[str] = None
+        # 等待凑批的请求：打包键 -> [请求]
+        self._pending_packs: Dict[tuple, List[_PackMember]] = {}
+        # 最近每张图片渲染耗时（秒）的指数滑动平均，尚无样本时为 None
+        self.latency: Optional[float] = None
+
+    def _session(self) -> aiohttp.ClientSession:
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(
+                base_url="http://{}".format(self.address),
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+            )
+        return self._http
+
+    async def _post(self, path: str, payload) -> bytes:
+        async with self._session().post(path, json=payload) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def queue_prompt(self, prompt, prompt_id: Optional[str] = None) -> str:
+        payload = {"prompt": prompt, "client_id": self.client_id}
+        if prompt_id:
+            # 由客户端指定 prompt_id，提交前即可登记等待者，不会错过最早的执行消息
+            payload["prompt_id"] = prompt_id
+        return json.loads(await self._post("/prompt", payload))['prompt_id']
+
+    async def get_history(self, prompt_id: str):
+        async with self._session().get(f"/history/{prompt_id}") as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def get_image(self, filename: str, subfolder: str, folder_type: str) -> bytes:
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        async with self._session().get("/view", params=params) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def interrupt(self, prompt_id: Optional[str] = None):
+        """中断正在执行的 prompt；新版 ComfyUI 会按 prompt_id 只中断对应任务"""
+        await self._post("/interrupt", {"prompt_id": prompt_id} if prompt_id else {})
+
+    async def delete_queued(self, prompt_ids):
+        """从 ComfyUI 队列中删除尚未开始执行的 prompt"""
+        await self._post("/queue", {"delete": list(prompt_ids)})
+
+    async def _get_queue(self) -> Dict[str, list]:
+        async with self._session().get("/queue") as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def get_queue_depth(self) -> int:
+        """ComfyUI 队列中正在执行与等待执行的 prompt 数"""
+        queue = await self._get_queue()
+        return len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
+
+    async def get_queued_ids(self) -> Set[str]:
+        """ComfyUI 队列中正在执行与等待执行的 prompt_id"""
+        queue = await self._get_queue()
+        return {entry[1] for entry in queue.get("queue_running", []) + queue.get("queue_pending", [])}
+
+    async def _cancel_prompt(self, prompt_id: str, started: bool):
+        try:
+            await self.delete_queued([prompt_id])
+            if started:
+                await self.interrupt(prompt_id)
+        except Exception as e:
+            print(f"警告：取消 ComfyUI 任务 {prompt_id} 失败: {e}")
+
+    async def _ensure_connected(self):
+        if self._reader is None or self._reader.done():
+            self._closed = False
+            self._reader = asyncio.get_running_loop().create_task(self._run())
+        if self._watchdog is None or self._watchdog.done():
+            self._watchdog = asyncio.get_running_loop().create_task(self._watch())
+        if self._connected.is_set():
+            return
+        waits = [asyncio.ensure_future(self._connected.wait()), asyncio.ensure_future(self._connect_failed.wait())]
+        try:
+            await asyncio.wait(waits, timeout=CONNECT_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in waits:
+                task.cancel()
+        if not self._connected.is_set():
+            raise ConnectionError(f"无法连接 ComfyUI: {self.address}")
+
+    async def _run(self):
+        """读任务：维持连接并分发消息，断线后按指数退避重连"""
+        delay = 1.0
+        reconnecting = False
+        while not self._closed:
+            try:
+                ws = await self._session().ws_connect(
+                    "/ws", params={"clientId": self.client_id},
+                    timeout=aiohttp.ClientWSTimeout(ws_receive=None, ws_close=CONNECT_TIMEOUT),
+                    heartbeat=WS_HEARTBEAT,
+                )
+            except Exception as e:
+                print(f"警告：连接 ComfyUI 失败，{delay:.0f}s 后重连: {e}")
+                # 后端不可用时正在等待的 prompt 大概率已丢失，交给调用方重试
+                self._fail_all(ConnectionError(f"ComfyUI 连接中断: {e}"))
+                self._connect_failed.set()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+                continue
+            delay = 1.0
+            self._ws = ws
+            self._connect_failed.clear()
+            self._connected.set()
+            if reconnecting:
+                # 断线期间可能有 prompt 已执行完或被后端丢弃，立即核实而不是等到静默超时
+                await self._probe([(prompt_id, waiter) for prompt_id, waiter in self._waiters.items()
+                                   if waiter.queued_at is not None])
+            try:
+                async for msg in ws:
+                    if msg.type == aiohttp.WSMsgType.TEXT:
+                        self._dispatch(json.loads(msg.data))
+                    elif msg.type == aiohttp.WSMsgType.BINARY:
+                        self._dispatch_binary(msg.data)
+                    elif msg.type == aiohttp.WSMsgType.ERROR:
+                        raise ws.exception() or ConnectionError("websocket 错误")
+                if not self._closed:
+                    print("警告：ComfyUI 连接断开，正在重连")
+            except Exception as e:
+                if not self._closed:
+                    print(f"警告：ComfyUI 连接断开，正在重连: {e}")
+            finally:
+                self._connected.clear()
+                self._ws = None
+                self._executing = None
+                reconnecting = True
+                for waiter in self._waiters.values():
+                    waiter.stream_gap = True
+                await ws.close()
+
+    def _dispatch(self, message):
+        data = message.get('data') or {}
+        prompt_id = data.get('prompt_id')
+        if message.get('type') == 'executing':
+            self._executing = prompt_id if data.get('node') is not None else None
+        if prompt_id is None:
+            return
+        waiter = self._waiters.get(prompt_id)
+        if waiter is None:
+            self._buffer_unclaimed(prompt_id, message)
         else:
-            if current_node == 'save_image_websocket_node':
-                images_output = output_images.get(current_node, [])
-                images_output.append(out[8:])
-                output_images[current_node] = images_output
-
-    return output_images
-
-def generate_image(prompt_text="", negative_prompt=None, save_path: str = '.'):
-    dir_name = os.path.dirname(save_path)
-    if dir_name:
-        os.makedirs(dir_name, exist_ok=True)
-    
-    if not prompt_text:
-        raise ValueError("Prompt must not be empty.")
+            waiter.handle(message)
+
+    def _dispatch_binary(self, out: bytes):
+        prompt_id = self._executing
+        if prompt_id is None:
+            return
+        waiter = self._waiters.get(prompt_id)
+        if waiter is None:
+            self._buffer_unclaimed(prompt_id, out)
+        else:
+            waiter.handle_binary(out)
+
+    def _buffer_unclaimed(self, prompt_id: str, item):
+        self._unclaimed.setdefault(prompt_id, []).append(item)
+        self._unclaimed.move_to_end(prompt_id)
+        while len(self._unclaimed) > self.MAX_UNCLAIMED:
+            self._unclaimed.popitem(last=False)
+
+    def _claim(self, prompt_id: str, waiter: _PromptWaiter):
+        """登记等待者，并补发登记前已收到的该 prompt 的消息"""
+        self._waiters[prompt_id] = waiter
+        for item in self._unclaimed.pop(prompt_id, []):
+            if isinstance(item, dict):
+                waiter.handle(item)
+            else:
+                waiter.handle_binary(item)
+
+    def _fail_all(self, error: BaseException):
+        for waiter in list(self._waiters.values()):
+            waiter.fail(error)
+
+    async def _watch(self):
+        """看门狗任务：定期检查所有等待中的 prompt，保证每个等待都会结束"""
+        while not self._closed:
+            await asyncio.sleep(WATCHDOG_INTERVAL)
+            try:
+                await self._check_waiters()
+            except Exception as e:
+                print(f"警告：ComfyUI 看门狗检查失败: {e}")
+
+    async def _check_waiters(self):
+        now = time.monotonic()
+        silent = []
+        for prompt_id, waiter in list(self._waiters.items()):
+            if waiter.done.is_set() or waiter.queued_at is None:
+                continue
+            if now >= waiter.deadline:
+                stage = "执行" if waiter.started else "排队"
+                COMFYUI_WATCHDOG_EVENTS.inc(event="timeout")
+                waiter.fail(PromptTimeoutError(f"ComfyUI 任务{stage}超时: {prompt_id}"))
+            elif now - waiter.last_activity >= SILENCE_TIMEOUT:
+                silent.append((prompt_id, waiter))
+        # 断线期间由重连后的核实处理
+        if silent and self._connected.is_set():
+            await self._probe(silent)
+
+    async def _probe(self, waiters: List[tuple]):
+        """向后端核实一组 prompt：仍在队列中的继续等待，不在队列中的从 /history 取回结果"""
+        if not waiters:
+            return
+        try:
+            queued = await self.get_queued_ids()
+        except Exception as e:
+            print(f"警告：查询 ComfyUI 队列失败: {e}")
+            return
+        now = time.monotonic()
+        for prompt_id, waiter in waiters:
+            if prompt_id in queued:
+                waiter.last_activity = now
+            elif not waiter.done.is_set():
+                await self._recover(prompt_id, waiter)
+
+    async def _images_from_history(self, prompt_id: str, nodes: Iterable[str]) -> Optional[Dict[str, List[bytes]]]:
+        """从 /history 记录的输出文件取回指定节点的图片；prompt 不在 history 中时返回 None，
+        执行失败时抛出对应异常。SaveImageWebsocket 不把图片写入 history，只有工作流中
+        同时保存了文件的节点能取回"""
+        entry = (await self.get_history(prompt_id)).get(prompt_id)
+        if entry is None:
+            return None
+        status = entry.get("status") or {}
+        if status.get("status_str") == "error":
+            for message_type, data in status.get("messages", []):
+                if message_type == "execution_interrupted":
+                    raise PromptInterruptedError(f"ComfyUI 任务被中断: {prompt_id}")
+                if message_type == "execution_error":
+                    raise RuntimeError(f"ComfyUI 执行失败: {data.get('exception_message', '')}".strip())
+            raise RuntimeError(f"ComfyUI 执行失败: {prompt_id}")
+        outputs = entry.get("outputs") or {}
+        images = {}
+        for node in nodes:
+            files = (outputs.get(node) or {}).get("images") or []
+            if files:
+                images[node] = [
+                    await self.get_image(f["filename"], f.get("subfolder", ""), f.get("type", "output"))
+                    for f in files
+                ]
+        return images
+
+    async def _recover(self, prompt_id: str, waiter: _PromptWaiter):
+        """prompt 已不在后端队列中：执行完的从 /history 补齐输出，否则判定为丢失"""
+        missing = [node for node in waiter.output_nodes if node not in waiter.finished_nodes]
+        try:
+            images = await self._images_from_history(prompt_id, missing)
+        except RuntimeError as e:
+            waiter.fail(e)
+            return
+        except Exception as e:
+            print(f"警告：查询 ComfyUI 任务 {prompt_id} 的 history 失败: {e}")
+            return
+        if waiter.done.is_set():
+            return
+        if images is None:
+            COMFYUI_WATCHDOG_EVENTS.inc(event="lost")
+            waiter.fail(PromptLostError(f"ComfyUI 任务已不在队列与 history 中（后端可能已重启）: {prompt_id}"))
+        elif len(images) < len(missing):
+            COMFYUI_WATCHDOG_EVENTS.inc(event="lost")
+            waiter.fail(PromptLostError(f"ComfyUI 任务已完成，但图片数据在连接中断时丢失: {prompt_id}"))
+        else:
+            COMFYUI_WATCHDOG_EVENTS.inc(event="recovered")
+            waiter.recover(images)
+
+    async def run_prompt(self, prompt, output_nodes: Iterable[str],
+                         on_output: Optional[Callable[[str, List[bytes]], None]] = None,
+                         on_progress: Optional[Callable[[str, int, int], None]] = None,
+                         on_preview: Optional[Callable[[str, bytes], None]] = None) -> Dict[str, List[bytes]]:
+        """提交 prompt 并等待执行完成，返回 {输出节点ID: [图片字节]}；被取消时同时撤销 ComfyUI 上的任务
+
+        后端丢失了 prompt 或图片无法取回时（PromptLostError）自动重新提交，最多 PROMPT_RETRIES 次。
+        """
+        output_nodes = list(output_nodes)
+        for attempt in range(PROMPT_RETRIES + 1):
+            try:
+                return await self._run_prompt_once(prompt, output_nodes, on_output, on_progress, on_preview)
+            except PromptLostError as e:
+                if attempt >= PROMPT_RETRIES:
+                    raise
+                COMFYUI_WATCHDOG_EVENTS.inc(event="requeued")
+                print(f"警告：{e}，重新提交（第 {attempt + 1} 次）")
+
+    async def _run_prompt_once(self, prompt, output_nodes: List[str],
+                               on_output: Optional[Callable[[str, List[bytes]], None]] = None,
+                               on_progress: Optional[Callable[[str, int, int], None]] = None,
+                               on_preview: Optional[Callable[[str, bytes], None]] = None) -> Dict[str, List[bytes]]:
+        await self._ensure_connected()
+        prompt_id = str(uuid.uuid4())
+        waiter = _PromptWaiter(output_nodes, on_output, on_progress, on_preview)
+        self._claim(prompt_id, waiter)
+        try:
+            queued_id = await self.queue_prompt(prompt, prompt_id=prompt_id)
+            if queued_id != prompt_id:
+                # 旧版 ComfyUI 忽略客户端指定的 prompt_id
+                self._waiters.pop(prompt_id, None)
+                prompt_id = queued_id
+                self._claim(prompt_id, waiter)
+            waiter.queued_at = waiter.last_activity = time.monotonic()
+            try:
+                await waiter.done.wait()
+            except asyncio.CancelledError:
+                await asyncio.shield(self._cancel_prompt(prompt_id, waiter.started))
+                raise
+            if isinstance(waiter.error, PromptTimeoutError):
+                # 超时的 prompt 可能仍占着后端，撤销后再交给调用方
+                await asyncio.shield(self._cancel_prompt(prompt_id, waiter.started))
+            if waiter.error is not None:
+                raise waiter.error
+            missing = [node for node in output_nodes if not waiter.images.get(node)]
+            if missing and waiter.stream_gap:
+                # 执行期间断过线：丢失的图片帧尝试从 /history 取回，取不回则重新提交
+                recovered = await self._images_from_history(prompt_id, missing) or {}
+                if len(recovered) < len(missing):
+                    COMFYUI_WATCHDOG_EVENTS.inc(event="lost")
+                    raise PromptLostError(f"ComfyUI 任务已完成，但图片数据在连接中断时丢失: {prompt_id}")
+                COMFYUI_WATCHDOG_EVENTS.inc(event="recovered")
+                waiter.images.update(recovered)
+            if waiter.started_at is not None:
+                sample = (time.monotonic() - waiter.started_at) / max(1, len(output_nodes))
+                self.latency = sample if self.latency is None else (
+                    LATENCY_EWMA_ALPHA * sample + (1 - LATENCY_EWMA_ALPHA) * self.latency)
+            return waiter.images
+        finally:
+            self._waiters.pop(prompt_id, None)
+
+    async def _submit(self, template: WorkflowTemplate, values: Dict[str, Any],
+                      on_progress: Optional[Callable[[int, int], None]] = None,
+                      on_preview: Optional[Callable[[bytes], None]] = None) -> List[bytes]:
+        """提交一次渲染。采样设置相同的并发请求在 PACK_WINDOW 内凑成一批，打包进同一个 prompt：
+        只占一次排队，模型加载等共享节点只执行一次"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # 提示词与种子之外的槽位取值相同的请求才合并
+        key = (id(template),) + tuple(
+            values.get(name) for name in sorted(template.slots) if name not in ("positive", "seed")
+        )
+        group = self._pending_packs.get(key)
+        if group is None:
+            group = self._pending_packs[key] = []
+            if PACK_SIZE > 1:
+                loop.call_later(PACK_WINDOW, self._flush_pack, key, group, template)
+        group.append(_PackMember(values, future, on_progress, on_preview))
+        if len(group) >= max(PACK_SIZE, 1):
+            self._flush_pack(key, group, template)
+        return await future
+
+    def _flush_pack(self, key: tuple, group: list, template: WorkflowTemplate):
+        if self._pending_packs.get(key) is not group:
+            return
+        del self._pending_packs[key]
+        members = [member for member in group if not member.future.done()]
+        if members:
+            self._start_pack(template, members)
+
+    def _start_pack(self, template: WorkflowTemplate, members: List[_PackMember]):
+        task = asyncio.get_running_loop().create_task(self._run_pack(template, members))
+
+        def on_member_done(_):
+            # 批内所有请求都被取消时才撤销 ComfyUI 上的 prompt，避免误伤其他请求
+            if all(member.future.cancelled() for member in members):
+                task.cancel()
+
+        for member in members:
+            member.future.add_done_callback(on_member_done)
+
+    async def _run_pack(self, template: WorkflowTemplate, members: List[_PackMember]):
+        prompt, output_nodes = template.render_batch([member.values for member in members])
+        futures = dict(zip(output_nodes, (member.future for member in members)))
+        # 打包时每个请求的采样节点带有与其输出节点相同的前缀，据此把进度与预览分发给对应请求
+        samplers = {
+            node[:len(node) - len(template.output_node)] + template.sampler_node: member
+            for node, member in zip(output_nodes, members)
+        }
 
-    with open('assets/workflow/config.json', 'r', encoding='utf-8') as f:
-        workflow_json = f.read()
+        def progress(node: str, value: int, maximum: int):
+            member = samplers.get(node)
+            if member is not None and member.on_progress is not None:
+                _call_listener(member.on_progress, value, maximum)
 
-    workflow = json.loads(workflow_json)
-    #set the text prompt for our positive CLIPTextEncode
-    workflow["6"]["inputs"]["text"] = prompt_text
+        def preview(node: str, data: bytes):
+            member = samplers.get(node)
+            if member is not None and member.on_preview is not None:
+                _call_listener(member.on_preview, data)
 
-    # set random seed
-    workflow["3"]["inputs"]["seed"] = random.randint(0, 2147483647)
-    
+        def resolve(node: str, images: List[bytes]):
+            future = futures.get(node)
+            if future is None or future.done():
+                return
+            if images:
+                future.set_result(list(images))
+            else:
+                future.set_exception(RuntimeError("ComfyUI 未返回图片"))
 
-    ws = websocket.WebSocket()
-    ws.connect("ws://{}/ws?clientId={}".format(server_address, client_id))
-    images = get_images(ws, workflow)
-    ws.close() # for in case this example is used in an environment where it will be repeatedly called, like in a Gradio app. otherwise, you'll randomly receive connection timeouts
-    # Commented out code to display the output images:
+        def resolve_ready(node: str, images: List[bytes]):
+            # 没有图片的输出可能是断线丢帧，等 run_prompt 尝试从 /history 取回后再判定
+            if images:
+                resolve(node, images)
 
-    for node_id in images:
-        for idx, image_data in enumerate(images[node_id]):
-            image = Image.open(io.BytesIO(image_data))
-            image.save(save_path)
+        try:
+            images = await self.run_prompt(prompt, output_nodes, on_output=resolve_ready,
+                                           on_progress=progress, on_preview=preview)
+        except asyncio.CancelledError:
+            for future in futures.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            pending = [member for member in members if not member.future.done()]
+            if len(members) > 1 and pending:
+                # 打包的 prompt 可能只因其中一个请求出错（如 execution_error）而整体失败：
+                # 尚未拿到结果的请求拆开单独重新提交，失败只落到真正出错的请求上
+                print(f"警告：打包的 ComfyUI prompt 失败（{e}），{len(pending)} 个请求改为单独提交")
+                for member in pending:
+                    self._start_pack(template, [member])
+                return
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for node in output_nodes:
+            resolve(node, images.get(node, []))
 
-    return True
+    async def generate(self, prompt_text: str, seed: Optional[int] = None,
+                       negative_prompt: Optional[str] = None,
+                       save_path: Optional[str] = None,
+                       width: Optional[int] = None, height: Optional[int] = None,
+                       steps: Optional[int] = None, batch_size: Optional[int] = None,
+                       on_progress: Optional[Callable[[int, int], None]] = None,
+                       on_preview: Optional[Callable[[bytes], None]] = None) -> List[bytes]:
+        """生成图片，返回已编码图片（PNG）的字节列表；指定 save_path 时原样写入文件，
+        多张图片时第一张写入 save_path，其余依次加 _1、_2… 后缀
+
+        negative_prompt、width、height、steps 为 None 时使用工作流模板中的默认值。
+        batch_size=K 时在同一个 latent 批次中生成 K 张候选图（同一提示词、相邻种子），
+        供调用方挑选最佳的一张。
+        on_progress(当前步, 总步数) 与 on_preview(预览图字节) 在 ComfyUI 后台事件循环上调用，
+        应只做轻量的记录，不要阻塞。
+        """
+        if not prompt_text:
+            raise ValueError("Prompt must not be empty.")
+
+        with IMAGE_GENERATION_SECONDS.time():
+            template = get_template()
+            values = dict(
+                positive=prompt_text,
+                negative=negative_prompt,
+                # random unless given, so that a render can be reproduced
+                seed=seed if seed is not None else random.randint(0, 2147483647),
+                width=width,
+                height=height,
+                steps=steps,
+                batch_size=batch_size,
+            )
+            # 提前校验参数，避免无效请求拖累同批的其他请求
+            template.render(**values)
+
+            loop = asyncio.get_running_loop()
+            keys = _cache_keys(template, values)
+            image_list = await loop.run_in_executor(None, _read_cache, keys)
+            if image_list is None:
+                image_list = await self._submit(template, values, on_progress, on_preview)
+                await loop.run_in_executor(None, _write_cache, keys, image_list)
+
+            if save_path:
+                # 文件写入放到线程中执行以免阻塞事件循环
+                await loop.run_in_executor(None, save_images, image_list, save_path)
+            return image_list
+
+    async def generate_batch(self, requests: List[Dict[str, Any]]) -> List[Union[List[bytes], Exception]]:
+        """并发生成多张图片（参数同 generate），采样设置相同的请求自动打包进同一个 prompt
+
+        按请求顺序返回结果；单个请求失败时对应位置为异常对象，不影响其他请求。
+        """
+        return await asyncio.gather(
+            *(self.generate(**request) for request in requests), return_exceptions=True
+        )
+
+    async def close(self):
+        self._closed = True
+        if self._ws is not None:
+            await self._ws.close()
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+        if self._reader is not None:
+            self._reader.cancel()
+        if self._http is not None:
+            await self._http.close()
+
+
+def _call_listener(listener: Callable, *args):
+    # 回调在读任务中执行，异常不能中断消息分发
+    try:
+        listener(*args)
+    except Exception as e:
+        print(f"警告：ComfyUI 进度回调失败: {e}")
+
+
+@dataclass
+class _Backend:
+    """后端池中一个后端的负载与健康状态"""
+    client: AsyncComfyUIClient
+    # 本进程已分派、尚未返回的请求数
+    inflight: int = 0
+    # 最近一次轮询到的 ComfyUI 队列深度（含其他客户端提交的任务）
+    queue_depth: int = 0
+    # 在此时间（monotonic）之前不参与分派
+    unhealthy_until: float = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+
+def _is_backend_failure(error: BaseException) -> bool:
+    """连接失败、超时、5xx 说明后端本身不可用；4xx（如工作流校验失败）与执行错误换后端也无济于事"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500
+    return isinstance(error, (ConnectionError, aiohttp.ClientError, asyncio.TimeoutError))
+
+
+class ComfyUIBackendPool:
+    """多个 ComfyUI 后端组成的池，每次请求分派给预计最快完成的后端
+
+    分数 = (max(队列深度, 本进程在途请求数) + 1) × 每张图片渲染耗时的滑动平均，取最小者。
+    队列深度通过 GET /queue 定期轮询，在途请求数在分派时即时更新，使同时到达的请求也能
+    分散到不同后端。连接失败、超时或 5xx 的后端在 BACKEND_COOLDOWN 秒内移出轮转，请求
+    换一个后端重试；冷却结束或轮询恢复后重新加入。所有后端都不可用时仍尝试冷却最早结束的一个。
+    """
+
+    def __init__(self, addresses: List[str]):
+        if not addresses:
+            raise ValueError("未配置 ComfyUI 后端（COMFYUI_BASE_URL）")
+        self.backends = [_Backend(get_client(address)) for address in addresses]
+        self._polled_at = 0.0
+        self._poll_task: Optional[asyncio.Task] = None
+
+    def _mark_unhealthy(self, backend: _Backend, error: BaseException):
+        if backend.healthy:
+            print(f"警告：ComfyUI 后端 {backend.client.address} 不可用，{BACKEND_COOLDOWN:.0f}s 内移出轮转: {error}")
+        backend.unhealthy_until = time.monotonic() + BACKEND_COOLDOWN
+
+    async def _poll_backend(self, backend: _Backend):
+        try:
+            backend.queue_depth = await asyncio.wait_for(backend.client.get_queue_depth(), CONNECT_TIMEOUT)
+        except Exception as e:
+            if _is_backend_failure(e):
+                self._mark_unhealthy(backend, e)
+            return
+        backend.unhealthy_until = 0.0
+
+    async def _poll_queues(self):
+        await asyncio.gather(*(self._poll_backend(backend) for backend in self.backends))
+
+    def _maybe_poll(self):
+        """队列深度过期时在后台刷新，不阻塞本次分派"""
+        if len(self.backends) < 2:
+            return
+        now = time.monotonic()
+        if now - self._polled_at >= QUEUE_POLL_INTERVAL and (self._poll_task is None or self._poll_task.done()):
+            self._polled_at = now
+            self._poll_task = asyncio.get_running_loop().create_task(self._poll_queues())
+
+    def _choose(self, exclude: List[_Backend]) -> _Backend:
+        candidates = [backend for backend in self.backends if backend not in exclude]
+        healthy = [backend for backend in candidates if backend.healthy]
+        if not healthy:
+            return min(candidates, key=lambda backend: backend.unhealthy_until)
+        # 尚无耗时样本的后端按已知后端的平均耗时估计
+        known = [backend.client.latency for backend in healthy if backend.client.latency is not None]
+        default_latency = sum(known) / len(known) if known else 1.0
+
+        def score(backend: _Backend) -> float:
+            latency = backend.client.latency if backend.client.latency is not None else default_latency
+            return (max(backend.queue_depth, backend.inflight) + 1) * latency
+
+        return min(healthy, key=score)
+
+    async def generate(self, prompt_text: str, **params) -> List[bytes]:
+        """在选中的后端上执行 AsyncComfyUIClient.generate，后端不可用时换下一个"""
+        self._maybe_poll()
+        tried: List[_Backend] = []
+        while True:
+            backend = self._choose(tried)
+            tried.append(backend)
+            backend.inflight += 1
+            try:
+                return await backend.client.generate(prompt_text, **params)
+            except Exception as e:
+                if not _is_backend_failure(e):
+                    raise
+                self._mark_unhealthy(backend, e)
+                if len(tried) == len(self.backends):
+                    raise
+                print(f"警告：ComfyUI 后端 {backend.client.address} 请求失败，改用其他后端重试")
+            finally:
+                backend.inflight -= 1
+
+    async def generate_batch(self, requests: List[Dict[str, Any]]) -> List[Union[List[bytes], Exception]]:
+        """并发生成多张图片，按请求顺序返回结果，失败的位置为异常对象"""
+        return await asyncio.gather(
+            *(self.generate(**request) for request in requests), return_exceptions=True
+        )
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """各后端的负载与健康状态快照"""
+        return [
+            {"address": backend.client.address, "healthy": backend.healthy, "inflight": backend.inflight,
+             "queue_depth": backend.queue_depth, "latency": backend.client.latency}
+            for backend in self.backends
+        ]
+
+
+def _cache_keys(template: WorkflowTemplate, values: Dict[str, Any]) -> List[str]:
+    """每张输出图片一个缓存键；未指定的槽位按模板默认值计入，模板改动后旧缓存自然失效"""
+    resolved = {name: values.get(name) if values.get(name) is not None else template.default(name)
+                for name in template.slots}
+    base = cache_key(template.fingerprint, resolved)
+    return [cache_key(base, i) for i in range(resolved["batch_size"])]
+
+
+def _read_cache(keys: List[str]) -> Optional[List[bytes]]:
+    if not image_cache.enabled:
+        return None
+    images = []
+    for key in keys:
+        data = image_cache.get(key)
+        if data is None:
+            IMAGE_CACHE_REQUESTS.inc(result="miss")
+            return None
+        images.append(data)
+    IMAGE_CACHE_REQUESTS.inc(result="hit")
+    return images
+
+
+def _write_cache(keys: List[str], image_list: List[bytes]):
+    # 返回的图片数与批大小不符时（例如工作流被改成输出多张）不缓存，避免命中不完整的结果
+    if len(image_list) != len(keys):
+        return
+    for key, data in zip(keys, image_list):
+        image_cache.put(key, data)
+
+
+# 所有 ComfyUI 通信都在一个后台事件循环上进行，使每个后端在进程内只保持一条 websocket
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_clients: Dict[str, AsyncComfyUIClient] = {}
+_pool: Optional[ComfyUIBackendPool] = None
+_lock = threading.Lock()
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="comfyui-loop", daemon=True).start()
+        return _loop
+
+
+def get_client(address: Optional[str] = None) -> AsyncComfyUIClient:
+    """获取（必要时创建）指定后端的客户端，客户端运行在 ComfyUI 后台事件循环上"""
+    address = address or server_address
+    with _lock:
+        client = _clients.get(address)
+        if client is None:
+            client = _clients[address] = AsyncComfyUIClient(address)
+        return client
+
+
+def get_pool() -> ComfyUIBackendPool:
+    """获取 COMFYUI_BASE_URL 中配置的全部后端组成的池"""
+    global _pool
+    if _pool is None:
+        pool = ComfyUIBackendPool(server_addresses)
+        with _lock:
+            if _pool is None:
+                _pool = pool
+    return _pool
+
+
+def shutdown():
+    """关闭所有后端客户端的 websocket 与 HTTP 会话，供脚本与测试退出前清理"""
+    if _loop is None:
+        return
+    with _lock:
+        clients = list(_clients.values())
+    for client in clients:
+        asyncio.run_coroutine_threadsafe(client.close(), _loop).result(timeout=CONNECT_TIMEOUT)
+
+
+def backend_stats() -> List[Dict[str, Any]]:
+    """各后端的负载与健康状态；尚未发出过请求时为空"""
+    return _pool.stats() if _pool is not None else []
+
+
+async def generate(prompt_text: str, seed: Optional[int] = None,
+                   negative_prompt: Optional[str] = None,
+                   save_path: Optional[str] = None, **params) -> List[bytes]:
+    """异步生成图片，可在任意事件循环中 await：
+
+        from utils import comfyui as comfy
+        images = await comfy.generate(prompt, seed=42)
+
+    请求分派给负载最低的后端；取消等待会同时撤销 ComfyUI 上的对应任务。
+    """
+    coro = get_pool().generate(
+        prompt_text, seed=seed, negative_prompt=negative_prompt, save_path=save_path, **params
+    )
+    return await _run_on_background_loop(coro)
+
+
+async def generate_batch(requests: List[Dict[str, Any]]) -> List[Union[List[bytes], Exception]]:
+    """异步批量生成，参数与返回值见 ComfyUIBackendPool.generate_batch"""
+    return await _run_on_background_loop(get_pool().generate_batch(requests))
+
+
+async def _run_on_background_loop(coro):
+    loop = _background_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+def _request_timeout() -> float:
+    """一次请求在所有后端、所有重新提交下排队与执行时间的上限"""
+    attempts = (PROMPT_RETRIES + 1) * max(1, len(server_addresses))
+    return attempts * (QUEUE_TIMEOUT + EXECUTION_TIMEOUT * max(1, PACK_SIZE) + WATCHDOG_INTERVAL) + CONNECT_TIMEOUT
+
+
+def generate_image(prompt_text="", negative_prompt=None, save_path: str = '.',
+                   cancel_event: Optional[threading.Event] = None, seed: Optional[int] = None,
+                   **params) -> List[bytes]:
+    """同步封装：在 ComfyUI 后台事件循环上执行 generate，供线程池中的任务调用，返回值同 generate
+
+    看门狗保证异步侧的每个等待都会结束；这里另设一个宽松的总时限，即使后台事件循环本身
+    卡死，调用线程也会以 TimeoutError 返回，不会被永久占用。
+    """
+    if not prompt_text:
+        raise ValueError("Prompt must not be empty.")
+    future = asyncio.run_coroutine_threadsafe(
+        get_pool().generate(
+            prompt_text, seed=seed, negative_prompt=negative_prompt, save_path=save_path, **params
+        ),
+        _background_loop(),
+    )
+    deadline = time.monotonic() + _request_timeout()
+    # 定期醒来检查取消标记
+    while not wait([future], timeout=1.0).done:
+        if cancel_event is not None and cancel_event.is_set():
+            future.cancel()
+            raise CancelledError("ComfyUI 任务已取消")
+        if time.monotonic() >= deadline:
+            future.cancel()
+            raise TimeoutError("ComfyUI 请求超时，后台事件循环无响应")
+    try:
+        return future.result()
+    except (CancelledError, asyncio.CancelledError):
+        # 本地没有取消时不能以取消返回：asyncio.CancelledError 是 BaseException，
+        # 会穿过调用方的 except Exception，任务停在运行中
+        if cancel_event is not None and cancel_event.is_set():
+            raise CancelledError("ComfyUI 任务已取消")
+        raise PromptInterruptedError("ComfyUI 任务在后台被撤销")
 
 
 if __name__ == '__main__':
-    generate_image(prompt_text="embedding:lazypos, agirl, long hair, white hair, cute, happy", negative_prompt=None, save_path="output_images/test.png")
\ No newline at end of file
+    generate_image(prompt_text="embedding:lazypos, agirl, long hair, white hair, cute, happy", negative_prompt=None, save_path="output_images/test.png")
@@ -1,6 +1,131 @@
+import asyncio
+import inspect
+import json
 import os
 import re
+import unicodedata
+from bisect import bisect_right
+from dataclasses import asdict, dataclass, field
+from itertools import accumulate
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 import edge_tts
+from utils.cache import DiskCache, cache_key
+from utils.metrics import TTS_CACHE_REQUESTS, TTS_CHARACTERS, TTS_SECONDS
+
+# 默认音色与语速、音调、音量，以及批量合成时同时进行的请求数
+DEFAULT_VOICE = "zh-CN-XiaoxiaoNeural"
+DEFAULT_RATE = "+0%"
+DEFAULT_PITCH = "+0Hz"
+DEFAULT_VOLUME = "+0%"
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "4"))
+# 合成结果缓存：相同的 (规范化文本, 音色, 语速, 音调, 音量) 直接读取磁盘上的音频与词边界
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR") or ".cache/tts"
+TTS_CACHE_MAX_MB = int(os.getenv("TTS_CACHE_MAX_MB", "512"))
+
+tts_cache = DiskCache(TTS_CACHE_DIR, TTS_CACHE_MAX_MB * 1024 * 1024, suffix=".tts")
+
+# 字幕对齐需要逐词的时间：uv.lock 锁定的 edge-tts 7.0.2 没有 boundary 参数，默认即返回 WordBoundary；
+# 之后的版本新增了 boundary 参数且默认只返回 SentenceBoundary，需显式请求 WordBoundary
+_BOUNDARY_KWARGS = (
+    {"boundary": "WordBoundary"}
+    if "boundary" in inspect.signature(edge_tts.Communicate).parameters else {}
+)
+
+# edge-tts 的时间单位为 100 纳秒
+_TICKS_PER_SECOND = 10000000
+# 句子与词边界文本匹配前去掉的字符：所有标点（含问号）、空白与下划线，两侧按同一规则处理
+_MATCH_STRIP = re.compile(r"[\W_]+")
+# 在预期位置之后额外搜索的字符数，容纳被过滤掉的短句等未出现在句子列表中的文本
+_MATCH_SLACK = 16
+# edge-tts 固定输出 audio-24khz-48kbitrate-mono-mp3（48 kbps 恒定码率），时长可由字节数直接算出
+AUDIO_SAMPLE_RATE = 24000
+AUDIO_CHANNELS = 1
+AUDIO_BITRATE = 48000
+
+
+@dataclass
+class TTSJob:
+    """一段文本的合成任务：输出音频与字幕路径"""
+    text: str
+    audio_path: str
+    srt_path: str
+    voice: str = DEFAULT_VOICE
+    rate: str = DEFAULT_RATE
+    pitch: str = DEFAULT_PITCH
+    volume: str = DEFAULT_VOLUME
+    # 配音元数据（时长、采样率、字幕条目）的保存路径，为空时不写入
+    meta_path: Optional[str] = None
+
+
+@dataclass
+class SubtitleCue:
+    """一条字幕：序号从 1 开始，起止时间单位为秒"""
+    index: int
+    start: float
+    end: float
+    text: str
+
+    def to_srt(self) -> str:
+        return f"{self.index}\n{format_srt_time(self.start)} --> {format_srt_time(self.end)}\n{self.text}\n\n"
+
+
+@dataclass
+class AudioMetadata:
+    """合成时记录的配音元数据，合成视频时据此规划时间线，无需探测或解码音频文件
+
+    audio_bytes 为对应音频文件的大小，用于识别音频被替换后过期的元数据。
+    """
+    duration: float
+    sample_rate: int
+    channels: int
+    bitrate: int
+    audio_bytes: int
+    cues: List[SubtitleCue] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "AudioMetadata":
+        return cls(
+            duration=float(data["duration"]),
+            sample_rate=int(data["sample_rate"]),
+            channels=int(data["channels"]),
+            bitrate=int(data["bitrate"]),
+            audio_bytes=int(data["audio_bytes"]),
+            cues=[SubtitleCue(**cue) for cue in data.get("cues", [])],
+        )
+
+    def save(self, path: str):
+        _ensure_parent(path)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, audio_path: Optional[str] = None) -> Optional["AudioMetadata"]:
+        """读取元数据；文件不存在、损坏，或与 audio_path 的大小不符时返回 None"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                metadata = cls.from_dict(json.load(f))
+            if audio_path is not None and os.path.getsize(audio_path) != metadata.audio_bytes:
+                return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return metadata
+
+
+def audio_metadata(audio: bytes, cues: List[SubtitleCue]) -> AudioMetadata:
+    """由 edge-tts 返回的音频字节与字幕条目构造元数据：恒定码率下时长 = 字节数 × 8 / 码率"""
+    return AudioMetadata(
+        duration=len(audio) * 8 / AUDIO_BITRATE,
+        sample_rate=AUDIO_SAMPLE_RATE,
+        channels=AUDIO_CHANNELS,
+        bitrate=AUDIO_BITRATE,
+        audio_bytes=len(audio),
+        cues=cues,
+    )
 
 
 def clean_text_for_srt(text):
@@ -14,13 +139,8 @@ def clean_text_for_srt(text):
     return cleaned_text
 
 
-def create_sentence_based_srt(word_boundaries, text):
-    """
-    根据词汇边界信息创建基于语句的SRT字幕文件，精准同步音画
-    """
-    if not word_boundaries:
-        return ""
-
+def _split_sentences(text: str) -> List[str]:
+    """按句末标点（。！.!）与问号切分清理后的文本，去掉过短或只有标点的句子"""
     cleaned_text = clean_text_for_srt(text)
     # 智能句子分割
     sentences = []
@@ -50,70 +170,86 @@ def create_sentence_based_srt(word_boundaries, text):
         sentence = sentence.strip()
         if sentence and len(sentence) > 1 and not re.match(r"^[，。！,.!]+$", sentence):
             cleaned_sentences.append(sentence)
-    sentences = cleaned_sentences
+    return cleaned_sentences
+
+
+def _match_key(text: str) -> str:
+    return _MATCH_STRIP.sub("", text)
+
+
+def align_sentences(word_boundaries, text) -> List[SubtitleCue]:
+    """
+    根据词汇边界信息把文本按语句对齐到时间轴，返回字幕条目列表
+
+    句子与词边界文本都按 _match_key 去掉标点与空白后再匹配。预先计算每个词在拼接文本中的
+    起止字符位置（非递减），句子的起止字符位置通过二分查找映射到词序号。句子只从上一句的
+    结束位置向后、在有限的窗口内查找，窗口长度为本句与此前未匹配句子的长度之和加上
+    _MATCH_SLACK，总耗时与文本长度成线性关系；匹配不到的句子按均分时间处理。
+    """
+    if not word_boundaries:
+        return []
+
+    sentences = _split_sentences(text)
     if not sentences:
-        return ""
+        return []
 
     # 拼接所有词边界文本，便于查找句子在词边界中的起止位置
-    boundary_texts = [b.get("text", "").strip() for b in word_boundaries]
+    boundary_texts = [_match_key(b.get("text", "")) for b in word_boundaries]
     joined_text = "".join(boundary_texts)
+    # 第 i 个词占据 joined_text 的 [word_starts[i], word_ends[i])
+    word_ends = list(accumulate(len(t) for t in boundary_texts))
+    word_starts = [end - len(t) for end, t in zip(word_ends, boundary_texts)]
     char_offsets = [b.get("offset", 0) for b in word_boundaries]
     char_durations = [b.get("duration", 1000000) for b in word_boundaries]
+    last_word_idx = len(word_boundaries) - 1
+    total_duration = (char_offsets[-1] + char_durations[-1]) / _TICKS_PER_SECOND
 
-    srt_content = ""
-    srt_index = 1
+    cues = []
     last_end_idx = 0
+    # 上一次匹配之后未匹配句子的长度之和，用于放宽下一句的查找窗口
+    unmatched = 0
     prev_end_time = 0.0  # 初始化，确保时间递增
-    for sentence in sentences:
-        # 去除标点和空格用于匹配
-        sentence_clean = re.sub(r"[，。！,.!\s]+", "", sentence)
-        # 在joined_text中查找该句的起止位置
-        start_idx = joined_text.find(sentence_clean, last_end_idx)
+    for number, sentence in enumerate(sentences, 1):
+        sentence_clean = _match_key(sentence)
+        window_end = last_end_idx + unmatched + len(sentence_clean) + _MATCH_SLACK
+        start_idx = joined_text.find(sentence_clean, last_end_idx, window_end) if sentence_clean else -1
         if start_idx == -1:
-            # 匹配不到时，尝试从头查找
-            start_idx = joined_text.find(sentence_clean)
-        if start_idx == -1:
-            # 仍找不到，回退为均分时间
-            total_duration = (
-                word_boundaries[-1].get("offset", 0)
-                + word_boundaries[-1].get("duration", 1000000)
-            ) / 10000000
+            # 找不到，回退为均分时间
             time_per_sentence = total_duration / len(sentences)
-            start_time = (srt_index - 1) * time_per_sentence
-            end_time = srt_index * time_per_sentence
+            start_time = (number - 1) * time_per_sentence
+            end_time = number * time_per_sentence
+            unmatched += len(sentence_clean)
         else:
-            # 找到起止词边界
             end_idx = start_idx + len(sentence_clean) - 1
-            # 找到对应的词边界索引
-            start_word_idx = None
-            end_word_idx = None
-            char_count = 0
-            for i, t in enumerate(boundary_texts):
-                if char_count == start_idx:
-                    start_word_idx = i
-                if char_count + len(t) - 1 >= end_idx and end_word_idx is None:
-                    end_word_idx = i
-                char_count += len(t)
-            if start_word_idx is None:
-                start_word_idx = 0
-            if end_word_idx is None:
-                end_word_idx = len(word_boundaries) - 1
-            start_time = char_offsets[start_word_idx] / 10000000
+            # 起始字符所在的词，与第一个覆盖到结束字符的词
+            start_word_idx = max(0, bisect_right(word_starts, start_idx) - 1)
+            end_word_idx = min(bisect_right(word_ends, end_idx), last_word_idx)
+            start_time = char_offsets[start_word_idx] / _TICKS_PER_SECOND
             end_time = (
                 char_offsets[end_word_idx] + char_durations[end_word_idx]
-            ) / 10000000
+            ) / _TICKS_PER_SECOND
             last_end_idx = end_idx + 1
+            unmatched = 0
         # 确保时间递增
-        if srt_index > 1 and start_time < prev_end_time:
+        if number > 1 and start_time < prev_end_time:
             start_time = prev_end_time + 0.05
         if end_time <= start_time:
             end_time = start_time + max(len(sentence) * 0.08, 1.0)
         prev_end_time = end_time
-        start_str = format_srt_time(start_time)
-        end_str = format_srt_time(end_time)
-        srt_content += f"{srt_index}\n{start_str} --> {end_str}\n{sentence}\n\n"
-        srt_index += 1
-    return srt_content
+        cues.append(SubtitleCue(number, start_time, end_time, sentence))
+    return cues
+
+
+def format_srt(cues: Sequence[SubtitleCue]) -> str:
+    """把字幕条目序列化为 SRT 文本"""
+    return "".join(cue.to_srt() for cue in cues)
+
+
+def create_sentence_based_srt(word_boundaries, text):
+    """
+    根据词汇边界信息创建基于语句的SRT字幕文件，精准同步音画
+    """
+    return format_srt(align_sentences(word_boundaries, text))
 
 
 def format_srt_time(seconds):
@@ -127,46 +263,151 @@ def format_srt_time(seconds):
     return f"{hours:02d}:{minutes:02d}:{secs:02d},{millisecs:03d}"
 
 
-def generate_audio_for_script(script_path: str, audio_path: str, srt_path: str) -> str:
-    """
-    为单个脚本文件生成音频和字幕的核心函数。
-
-    """
-    dir_name = os.path.dirname(audio_path)
-    if dir_name:
-        os.makedirs(dir_name, exist_ok=True)
-    dir_name = os.path.dirname(srt_path)
+def _ensure_parent(path: str):
+    dir_name = os.path.dirname(path)
     if dir_name:
         os.makedirs(dir_name, exist_ok=True)
 
+
+def _read_script(script_path: str) -> str:
     if not os.path.exists(script_path):
         raise FileNotFoundError(f"脚本文件未找到: {script_path}")
-
     with open(script_path, "r", encoding="utf-8") as f:
         script_content = f.read()
     if not script_content.strip():
         raise ValueError(f"脚本文件内容为空: {script_path}")
+    return script_content
+
+
+def normalize_text(text: str) -> str:
+    """规范化配音文本：Unicode NFC、合并连续空白、去掉首尾空白；缓存键与实际合成都使用规范化结果"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def _pack_entry(audio: bytes, word_boundaries: List[Dict[str, Any]]) -> bytes:
+    """缓存条目格式：一行 JSON 词边界列表，其后为音频原始字节；两者在同一个文件中，一起写入、一起淘汰"""
+    return json.dumps(word_boundaries, ensure_ascii=False).encode("utf-8") + b"\n" + audio
+
+
+def _unpack_entry(data: bytes) -> Tuple[bytes, List[Dict[str, Any]]]:
+    header, audio = data.split(b"\n", 1)
+    return audio, json.loads(header)
+
+
+def _read_cache(key: str) -> Optional[Tuple[bytes, List[Dict[str, Any]]]]:
+    if not tts_cache.enabled:
+        return None
+    data = tts_cache.get(key)
+    if data is not None:
+        try:
+            entry = _unpack_entry(data)
+        except ValueError as e:
+            print(f"警告：TTS 缓存条目损坏 {tts_cache.path(key)}: {e}")
+        else:
+            TTS_CACHE_REQUESTS.inc(result="hit")
+            return entry
+    TTS_CACHE_REQUESTS.inc(result="miss")
+    return None
 
-    # 使用 edge-tts 生成音频
-    communicate = edge_tts.Communicate(
-        text=script_content,
-        voice="zh-CN-XiaoxiaoNeural",
-    )
 
+async def _stream(text: str, voice: str, rate: str, pitch: str,
+                  volume: str) -> Tuple[bytes, List[Dict[str, Any]]]:
+    """调用 edge-tts 的异步 stream()，返回 (音频字节, 词边界列表)"""
+    communicate = edge_tts.Communicate(text=text, voice=voice, rate=rate, pitch=pitch, volume=volume,
+                                       **_BOUNDARY_KWARGS)
+    audio = bytearray()
     # 收集词汇边界信息用于生成基于语句的字幕
     word_boundaries = []
-
-    with open(audio_path, "wb") as file:
-        for chunk in communicate.stream_sync():
+    TTS_CHARACTERS.inc(len(text))
+    with TTS_SECONDS.time():
+        async for chunk in communicate.stream():
             if chunk["type"] == "audio" and "data" in chunk:
-                file.write(chunk["data"])
+                audio += chunk["data"]
             elif chunk["type"] == "WordBoundary":
-                word_boundaries.append(chunk)
+                word_boundaries.append(dict(chunk))
+    if not audio:
+        raise RuntimeError("edge-tts 未返回音频")
+    return bytes(audio), word_boundaries
+
+
+def _write_outputs(audio_path: str, srt_path: Optional[str], audio: bytes, cues: List[SubtitleCue],
+                   meta_path: Optional[str] = None):
+    """音频先写入临时文件再重命名，读取方不会看到写了一半的音频；元数据最后写入，存在即说明音频已完整"""
+    _ensure_parent(audio_path)
+    tmp_path = f"{audio_path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(audio)
+    os.replace(tmp_path, audio_path)
+    if srt_path:
+        _ensure_parent(srt_path)
+        with open(srt_path, "w", encoding="utf-8") as file:
+            file.write(format_srt(cues))
+    if meta_path:
+        audio_metadata(audio, cues).save(meta_path)
+
+
+async def synthesize(text: str, audio_path: str, srt_path: Optional[str], voice: str = DEFAULT_VOICE,
+                     rate: str = DEFAULT_RATE, pitch: str = DEFAULT_PITCH,
+                     volume: str = DEFAULT_VOLUME, meta_path: Optional[str] = None) -> str:
+    """使用 edge-tts 的异步 stream() 合成一段文本，写入音频与基于语句的字幕
 
-    # 使用自定义函数生成基于语句的字幕
-    srt_content = create_sentence_based_srt(word_boundaries, script_content)
+    合成结果（音频与词边界）按 (规范化文本, 音色, 语速, 音调, 音量) 缓存，命中时不调用
+    edge-tts，字幕由缓存的词边界重新生成。srt_path 为空时不写字幕；指定 meta_path 时同时写入 AudioMetadata。
+    """
+    text = normalize_text(text)
+    if not text:
+        raise ValueError("配音文本为空")
+
+    loop = asyncio.get_running_loop()
+    key = cache_key("edge-tts", text, voice, rate, pitch, volume)
+    entry = await loop.run_in_executor(None, _read_cache, key)
+    if entry is None:
+        entry = await _stream(text, voice, rate, pitch, volume)
+        await loop.run_in_executor(None, tts_cache.put, key, _pack_entry(*entry))
+    audio, word_boundaries = entry
 
-    with open(srt_path, "w", encoding="utf-8") as file:
-        file.write(srt_content)
+    # 基于语句对齐字幕
+    cues = align_sentences(word_boundaries, text)
+    await loop.run_in_executor(None, _write_outputs, audio_path, srt_path, audio, cues, meta_path)
 
     return "已生成音频和基于语句分割的字幕文件。"
+
+
+async def generate_audio_for_script_async(script_path: str, audio_path: str, srt_path: str,
+                                          meta_path: Optional[str] = None) -> str:
+    """为单个脚本文件生成音频和字幕（异步版本）"""
+    return await synthesize(_read_script(script_path), audio_path, srt_path, meta_path=meta_path)
+
+
+async def synthesize_batch(jobs: Sequence[TTSJob], concurrency: int = TTS_CONCURRENCY,
+                           on_done: Optional[Callable[[int, Optional[BaseException]], None]] = None
+                           ) -> List[Optional[BaseException]]:
+    """并发合成多段文本，同时进行的请求数不超过 concurrency
+
+    每段完成（或失败）时立即调用 on_done(序号, 异常或 None)，音频与字幕此时已写入。
+    按任务顺序返回结果，成功的位置为 None，失败的位置为异常对象，单段失败不影响其他段。
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(idx: int, job: TTSJob) -> Optional[BaseException]:
+        async with semaphore:
+            try:
+                await synthesize(job.text, job.audio_path, job.srt_path, job.voice,
+                                 job.rate, job.pitch, job.volume, job.meta_path)
+                error = None
+            except Exception as e:
+                error = e
+        if on_done is not None:
+            on_done(idx, error)
+        return error
+
+    return await asyncio.gather(*(run(idx, job) for idx, job in enumerate(jobs)))
+
+
+def generate_audio_for_script(script_path: str, audio_path: str, srt_path: str,
+                              meta_path: Optional[str] = None) -> str:
+    """
+    为单个脚本文件生成音频和字幕的核心函数（同步封装，供线程池中的任务调用）。
+
+    """
+    return asyncio.run(generate_audio_for_script_async(script_path, audio_path, srt_path, meta_path))
@@ -0,0 +1,502 @@
+"""
+离线的 ComfyUI 替身服务，用于在没有 GPU 的机器上测试与压测图片流水线
+
+实现 utils/comfyui.py 用到的接口：POST /prompt、GET|POST /queue、POST /interrupt、
+GET /history[/{prompt_id}]、GET /view 与 /ws 消息协议（status、execution_start、executing、
+progress、execution_error、execution_interrupted，以及 SaveImageWebsocket 节点的二进制图片帧）。
+渲染耗时、失败率、并行执行数与队列容量可配置，图片为按种子着色的纯色 PNG。
+还可以模拟后端静默丢弃 prompt（如崩溃重启）与执行中途断开 websocket，用于验证客户端的看门狗。
+
+命令行启动：
+
+    python -m utils.fake_comfyui --port 8188 --latency 2 --failure-rate 0.05
+
+在测试或压测脚本中启动：
+
+    server = FakeComfyUIServer(latency=0.5).start_in_thread()
+    os.environ["COMFYUI_BASE_URL"] = server.address
+    ...
+    server.stop()
+"""
+import argparse
+import asyncio
+import io
+import json
+import random
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+from aiohttp import web
+from PIL import Image
+
+_SAMPLER_TYPES = ("KSampler", "KSamplerAdvanced")
+_OUTPUT_TYPE = "SaveImageWebsocket"
+
+# 二进制帧类型与图片格式（与 ComfyUI server.py 一致）
+_PREVIEW_IMAGE = 1
+_FORMAT_JPEG = 1
+_FORMAT_PNG = 2
+
+# history 中最多保留的 prompt 数
+_HISTORY_LIMIT = 1000
+
+
+@dataclass
+class _Job:
+    prompt_id: str
+    number: int
+    client_id: Optional[str]
+    prompt: Dict[str, Any]
+    interrupted: bool = False
+
+
+@dataclass
+class _Output:
+    """一个 SaveImageWebsocket 输出及其上游采样器的参数"""
+    node_id: str
+    sampler_id: Optional[str]
+    seed: int
+    steps: int
+    width: int
+    height: int
+    batch_size: int
+
+
+@dataclass
+class FakeStats:
+    """替身服务的累计统计，便于压测脚本核对"""
+    prompts: int = 0
+    images: int = 0
+    failures: int = 0
+    dropped: int = 0
+    disconnects: int = 0
+    interrupted: int = 0
+    rejected: int = 0
+    max_queue_depth: int = 0
+    client_ids: Set[str] = field(default_factory=set)
+
+
+class FakeComfyUIServer:
+    """ComfyUI 替身服务
+
+    Args:
+        host / port: 监听地址，port 为 0 时由系统分配
+        latency: 每张输出图片的模拟渲染秒数
+        jitter: 渲染耗时的随机浮动比例（0.2 表示 ±20%）
+        failure_rate: 每个 prompt 以 execution_error 失败的概率
+        drop_rate: 每个 prompt 被静默丢弃的概率：不执行、不发消息、不写 history
+        disconnect_rate: 每个 prompt 在发送图片前断开客户端 websocket 的概率；图片仍写入 history
+        workers: 并行执行的 prompt 数；真实 ComfyUI 为 1
+        max_queue: 排队上限，超出时 /prompt 返回 503；0 表示不限
+        previews: 采样期间是否发送潜空间预览帧
+        image_scale: 输出图片相对请求分辨率的缩放比例，压测时可调小以减少编码开销
+        seed: 随机数种子，使失败与耗时可复现
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 1.0,
+                 jitter: float = 0.0, failure_rate: float = 0.0, drop_rate: float = 0.0,
+                 disconnect_rate: float = 0.0, workers: int = 1, max_queue: int = 0, previews: bool = False, image_scale: float = 1.0,
+                 seed: Optional[int] = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.disconnect_rate = disconnect_rate
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.previews = previews
+        self.image_scale = image_scale
+        self.stats = FakeStats()
+        self._random = random.Random(seed)
+        self._queue: List[_Job] = []
+        self._running: Dict[str, _Job] = {}
+        self._queue_changed: Optional[asyncio.Condition] = None
+        self._history: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._files: Dict[str, bytes] = {}
+        self._sockets: Dict[str, web.WebSocketResponse] = {}
+        self._number = 0
+        self._runner: Optional[web.AppRunner] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> str:
+        """host:port，可直接写入 COMFYUI_BASE_URL"""
+        return f"{self.host}:{self.port}"
+
+    # ---- 生命周期 ----
+
+    def _make_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/ws", self._handle_ws)
+        app.router.add_post("/prompt", self._handle_prompt)
+        app.router.add_get("/prompt", self._handle_prompt_info)
+        app.router.add_get("/queue", self._handle_get_queue)
+        app.router.add_post("/queue", self._handle_post_queue)
+        app.router.add_post("/interrupt", self._handle_interrupt)
+        app.router.add_get("/history", self._handle_history)
+        app.router.add_get("/history/{prompt_id}", self._handle_history)
+        app.router.add_get("/view", self._handle_view)
+        return app
+
+    async def start(self):
+        """在当前事件循环中启动服务"""
+        self._queue_changed = asyncio.Condition()
+        self._runner = web.AppRunner(self._make_app(), shutdown_timeout=1.0)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # port 为 0 时取实际分配的端口
+        self.port = site._server.sockets[0].getsockname()[1]
+        loop = asyncio.get_running_loop()
+        self._worker_tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        if self._sockets:
+            # 客户端可能不响应关闭握手，不无限等待
+            await asyncio.wait([asyncio.ensure_future(ws.close()) for ws in list(self._sockets.values())], timeout=2)
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def start_in_thread(self) -> "FakeComfyUIServer":
+        """在后台线程的独立事件循环中启动服务，返回自身"""
+        started = threading.Event()
+        errors: List[BaseException] = []
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._loop.run_until_complete(self.start())
+            except BaseException as e:
+                errors.append(e)
+                started.set()
+                return
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="fake-comfyui", daemon=True)
+        self._thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+        return self
+
+    def stop(self):
+        """停止 start_in_thread 启动的服务"""
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.close(), self._loop).result(timeout=10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self._loop = None
+
+    # ---- websocket ----
+
+    async def _send(self, client_id: Optional[str], message_type: str, data: Dict[str, Any]):
+        ws = self._sockets.get(client_id) if client_id else None
+        if ws is not None and not ws.closed:
+            await ws.send_str(json.dumps({"type": message_type, "data": data}))
+
+    async def _send_binary(self, client_id: Optional[str], image_format: int, data: bytes):
+        ws = self._sockets.get(client_id) if client_id else None
+        if ws is not None and not ws.closed:
+            await ws.send_bytes(struct.pack(">II", _PREVIEW_IMAGE, image_format) + data)
+
+    def _status(self) -> Dict[str, Any]:
+        return {"status": {"exec_info": {"queue_remaining": len(self._queue) + len(self._running)}}}
+
+    async def _broadcast_status(self):
+        for client_id in list(self._sockets):
+            await self._send(client_id, "status", self._status())
+
+    async def _handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        client_id = request.query.get("clientId") or uuid.uuid4().hex
+        # 与 ComfyUI 相同：同一 client_id 只保留最新的连接
+        self._sockets[client_id] = ws
+        self.stats.client_ids.add(client_id)
+        await self._send(client_id, "status", dict(self._status(), sid=client_id))
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            if self._sockets.get(client_id) is ws:
+                del self._sockets[client_id]
+        return ws
+
+    # ---- HTTP 接口 ----
+
+    async def _handle_prompt(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        prompt = body.get("prompt")
+        if not isinstance(prompt, dict) or not self._outputs(prompt):
+            return web.json_response(
+                {"error": {"type": "prompt_no_outputs", "message": "Prompt has no outputs"}, "node_errors": {}},
+                status=400,
+            )
+        if self.max_queue and len(self._queue) >= self.max_queue:
+            self.stats.rejected += 1
+            return web.json_response({"error": {"type": "queue_full", "message": "Queue is full"}}, status=503)
+        prompt_id = body.get("prompt_id") or str(uuid.uuid4())
+        self._number += 1
+        job = _Job(prompt_id, self._number, body.get("client_id"), prompt)
+        self._queue.append(job)
+        self.stats.prompts += 1
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, len(self._queue))
+        async with self._queue_changed:
+            self._queue_changed.notify()
+        await self._broadcast_status()
+        return web.json_response({"prompt_id": prompt_id, "number": job.number, "node_errors": {}})
+
+    async def _handle_prompt_info(self, request: web.Request) -> web.Response:
+        return web.json_response(self._status())
+
+    def _queue_entry(self, job: _Job) -> List[Any]:
+        return [job.number, job.prompt_id, job.prompt, {"client_id": job.client_id}, []]
+
+    async def _handle_get_queue(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "queue_running": [self._queue_entry(job) for job in self._running.values()],
+            "queue_pending": [self._queue_entry(job) for job in self._queue],
+        })
+
+    async def _handle_post_queue(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if body.get("clear"):
+            self._queue.clear()
+        delete = set(body.get("delete") or [])
+        if delete:
+            self._queue = [job for job in self._queue if job.prompt_id not in delete]
+        await self._broadcast_status()
+        return web.json_response({})
+
+    async def _handle_interrupt(self, request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+        except ValueError:
+            body = {}
+        prompt_id = body.get("prompt_id")
+        for job in self._running.values():
+            if prompt_id is None or job.prompt_id == prompt_id:
+                job.interrupted = True
+        return web.json_response({})
+
+    async def _handle_history(self, request: web.Request) -> web.Response:
+        prompt_id = request.match_info.get("prompt_id")
+        if prompt_id is None:
+            return web.json_response(dict(self._history))
+        entry = self._history.get(prompt_id)
+        return web.json_response({prompt_id: entry} if entry is not None else {})
+
+    async def _handle_view(self, request: web.Request) -> web.Response:
+        data = self._files.get(request.query.get("filename", ""))
+        if data is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=data, content_type="image/png")
+
+    # ---- 执行 ----
+
+    def _outputs(self, prompt: Dict[str, Any]) -> List[_Output]:
+        """按输出节点向上查找采样器与 latent，取出种子、步数与分辨率"""
+        outputs = []
+        for node_id, node in prompt.items():
+            if not isinstance(node, dict) or node.get("class_type") != _OUTPUT_TYPE:
+                continue
+            sampler_id = self._find_upstream(prompt, node_id, _SAMPLER_TYPES)
+            inputs = prompt[sampler_id]["inputs"] if sampler_id else {}
+            latent_id = self._find_upstream(prompt, sampler_id, ("EmptyLatentImage",)) if sampler_id else None
+            latent = prompt[latent_id]["inputs"] if latent_id else {}
+            outputs.append(_Output(
+                node_id=node_id,
+                sampler_id=sampler_id,
+                seed=int(inputs.get("seed", inputs.get("noise_seed", 0)) or 0),
+                steps=int(inputs.get("steps", 20) or 20),
+                width=int(latent.get("width", 512)),
+                height=int(latent.get("height", 512)),
+                batch_size=int(latent.get("batch_size", 1)),
+            ))
+        return outputs
+
+    @staticmethod
+    def _find_upstream(prompt: Dict[str, Any], start: str, class_types) -> Optional[str]:
+        stack, seen = [start], set()
+        while stack:
+            node_id = stack.pop()
+            if node_id in seen or node_id not in prompt:
+                continue
+            seen.add(node_id)
+            for value in prompt[node_id].get("inputs", {}).values():
+                if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str):
+                    upstream = value[0]
+                    if prompt.get(upstream, {}).get("class_type") in class_types:
+                        return upstream
+                    stack.append(upstream)
+        return None
+
+    def _render(self, output: _Output, index: int) -> bytes:
+        width = max(1, int(output.width * self.image_scale))
+        height = max(1, int(output.height * self.image_scale))
+        rng = random.Random(output.seed + index)
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        buffer = io.BytesIO()
+        Image.new("RGB", (width, height), color).save(buffer, format="PNG", compress_level=1)
+        return buffer.getvalue()
+
+    def _render_seconds(self) -> float:
+        if not self.jitter:
+            return self.latency
+        return max(0.0, self.latency * (1 + self._random.uniform(-self.jitter, self.jitter)))
+
+    async def _worker(self):
+        while True:
+            async with self._queue_changed:
+                await self._queue_changed.wait_for(lambda: bool(self._queue))
+                job = self._queue.pop(0)
+            self._running[job.prompt_id] = job
+            try:
+                await self._execute(job)
+            finally:
+                self._running.pop(job.prompt_id, None)
+                await self._broadcast_status()
+
+    async def _execute(self, job: _Job):
+        client_id = job.client_id
+        prompt_id = job.prompt_id
+        if self._random.random() < self.drop_rate:
+            self.stats.dropped += 1
+            return
+        started = time.time()
+        await self._send(client_id, "execution_start", {"prompt_id": prompt_id, "timestamp": int(started * 1000)})
+        await self._send(client_id, "execution_cached", {"nodes": [], "prompt_id": prompt_id})
+        fail_at = None
+        outputs = self._outputs(job.prompt)
+        if self._random.random() < self.failure_rate:
+            fail_at = self._random.randrange(len(outputs))
+        disconnect_at = None
+        if self._random.random() < self.disconnect_rate:
+            disconnect_at = self._random.randrange(len(outputs))
+
+        history_outputs: Dict[str, Any] = {}
+        status = "success"
+        messages: List[Any] = [["execution_start", {"prompt_id": prompt_id, "timestamp": int(started * 1000)}]]
+        for position, output in enumerate(outputs):
+            sampler_id = output.sampler_id or output.node_id
+            await self._send(client_id, "executing", {"node": sampler_id, "display_node": sampler_id, "prompt_id": prompt_id})
+            seconds = self._render_seconds() * output.batch_size
+            steps = max(1, output.steps)
+            for step in range(1, steps + 1):
+                await asyncio.sleep(seconds / steps)
+                if job.interrupted:
+                    break
+                await self._send(client_id, "progress", {"value": step, "max": steps, "prompt_id": prompt_id, "node": sampler_id})
+                if self.previews:
+                    await self._send_binary(client_id, _FORMAT_JPEG, self._preview(output, step))
+            if job.interrupted:
+                self.stats.interrupted += 1
+                status = "error"
+                data = {"prompt_id": prompt_id, "node_id": sampler_id, "node_type": "KSampler", "executed": []}
+                messages.append(["execution_interrupted", data])
+                await self._send(client_id, "execution_interrupted", data)
+                break
+            if position == fail_at:
+                self.stats.failures += 1
+                status = "error"
+                data = {"prompt_id": prompt_id, "node_id": sampler_id, "node_type": "KSampler",
+                        "exception_message": "fake failure injected by FakeComfyUIServer",
+                        "exception_type": "RuntimeError", "traceback": []}
+                messages.append(["execution_error", data])
+                await self._send(client_id, "execution_error", data)
+                break
+
+            if position == disconnect_at:
+                ws = self._sockets.get(client_id)
+                if ws is not None:
+                    self.stats.disconnects += 1
+                    await ws.close()
+            await self._send(client_id, "executing", {"node": output.node_id, "display_node": output.node_id, "prompt_id": prompt_id})
+            images = []
+            for index in range(output.batch_size):
+                data = await asyncio.get_running_loop().run_in_executor(None, self._render, output, index)
+                filename = f"fake_{prompt_id}_{output.node_id}_{index}.png"
+                self._files[filename] = data
+                images.append({"filename": filename, "subfolder": "", "type": "output"})
+                await self._send_binary(client_id, _FORMAT_PNG, data)
+                self.stats.images += 1
+            history_outputs[output.node_id] = {"images": images}
+        else:
+            messages.append(["execution_success", {"prompt_id": prompt_id}])
+        # 与 ComfyUI 相同，无论成功与否最后都发送 node 为 null 的 executing
+        await self._send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+
+        self._remember(prompt_id, {
+            "prompt": [job.number, prompt_id, job.prompt, {"client_id": client_id}, list(history_outputs)],
+            "outputs": history_outputs,
+            "status": {"status_str": status, "completed": status == "success", "messages": messages},
+        })
+
+    def _preview(self, output: _Output, step: int) -> bytes:
+        buffer = io.BytesIO()
+        shade = int(255 * step / max(1, output.steps))
+        Image.new("RGB", (64, 64), (shade, shade, shade)).save(buffer, format="JPEG")
+        return buffer.getvalue()
+
+    def _remember(self, prompt_id: str, entry: Dict[str, Any]):
+        self._history[prompt_id] = entry
+        while len(self._history) > _HISTORY_LIMIT:
+            _, old = self._history.popitem(last=False)
+            for output in old["outputs"].values():
+                for image in output["images"]:
+                    self._files.pop(image["filename"], None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线 ComfyUI 替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--latency", type=float, default=1.0, help="每张图片的模拟渲染秒数")
+    parser.add_argument("--jitter", type=float, default=0.0, help="渲染耗时随机浮动比例")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="prompt 执行失败的概率")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="prompt 被静默丢弃的概率")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="发送图片前断开 websocket 的概率")
+    parser.add_argument("--workers", type=int, default=1, help="并行执行的 prompt 数")
+    parser.add_argument("--max-queue", type=int, default=0, help="排队上限，0 表示不限")
+    parser.add_argument("--previews", action="store_true", help="采样期间发送潜空间预览帧")
+    parser.add_argument("--image-scale", type=float, default=1.0, help="输出图片相对请求分辨率的缩放比例")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = FakeComfyUIServer(
+        host=args.host, port=args.port, latency=args.latency, jitter=args.jitter,
+        failure_rate=args.failure_rate, drop_rate=args.drop_rate,
+        disconnect_rate=args.disconnect_rate, workers=args.workers, max_queue=args.max_queue,
+        previews=args.previews, image_scale=args.image_scale, seed=args.seed,
+    )
+
+    async def serve():
+        await server.start()
+        print(f"Fake ComfyUI listening on http://{server.address}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
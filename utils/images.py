@@ -0,0 +1,81 @@
+"""
+场景图片的落盘与派生图：原始字节直接写入文件，缩放、WebP 预览与缩略图在后台线程池中生成
+"""
+import os
+from typing import List, Optional, Sequence, Tuple, Union
+
+from PIL import Image, ImageOps
+
+# 需要生成的派生图，逗号分隔：frame（缩放到视频分辨率的成片帧，需配置 VIDEO_SIZE）、webp、thumbnail
+IMAGE_DERIVATIVES = {
+    name.strip() for name in os.getenv("IMAGE_DERIVATIVES", "frame,webp,thumbnail").split(",") if name.strip()
+}
+# 缩略图的最长边像素与 WebP 预览的压缩质量
+THUMBNAIL_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", "256"))
+WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+
+def _atomic_write(path: str, data: BytesLike):
+    """先写临时文件再重命名，读取方不会看到写了一半的图片"""
+    dir_name = os.path.dirname(path)
+    if dir_name:
+        os.makedirs(dir_name, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def image_paths(save_path: str, count: int) -> List[str]:
+    """批量输出的保存路径：第一张为 save_path，其余依次加 _1、_2… 后缀"""
+    stem, ext = os.path.splitext(save_path)
+    return [save_path] + [f"{stem}_{i}{ext}" for i in range(1, count)]
+
+
+def save_images(image_list: Sequence[BytesLike], save_path: str) -> List[str]:
+    """把 ComfyUI 返回的已编码图片原样写入文件（不解码重编码），返回写入的路径"""
+    paths = image_paths(save_path, len(image_list))
+    for path, data in zip(paths, image_list):
+        _atomic_write(path, data)
+    return paths
+
+
+def _save_image(image: Image.Image, path: str, **params):
+    dir_name = os.path.dirname(path)
+    if dir_name:
+        os.makedirs(dir_name, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    image.save(tmp_path, format=params.pop("format"), **params)
+    os.replace(tmp_path, path)
+
+
+def make_derivatives(src: str, frame_path: Optional[str] = None,
+                     frame_size: Optional[Tuple[int, int]] = None,
+                     webp_path: Optional[str] = None,
+                     thumbnail_path: Optional[str] = None) -> List[str]:
+    """由场景图片生成派生图，只解码一次源图；返回生成的文件路径
+
+    - frame：按视频分辨率居中裁剪缩放，合成视频时直接使用，无需逐帧缩放
+    - webp：同尺寸的 WebP 预览，供前端快速加载
+    - thumbnail：最长边为 THUMBNAIL_SIZE 的 JPEG 缩略图
+    """
+    written = []
+    with Image.open(src) as image:
+        image.load()
+        if frame_path and frame_size and "frame" in IMAGE_DERIVATIVES:
+            frame = image if image.size == tuple(frame_size) else ImageOps.fit(
+                image, frame_size, Image.Resampling.LANCZOS
+            )
+            _save_image(frame, frame_path, format="PNG")
+            written.append(frame_path)
+        if webp_path and "webp" in IMAGE_DERIVATIVES:
+            _save_image(image, webp_path, format="WEBP", quality=WEBP_QUALITY)
+            written.append(webp_path)
+        if thumbnail_path and "thumbnail" in IMAGE_DERIVATIVES:
+            thumbnail = image.convert("RGB")
+            thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.LANCZOS)
+            _save_image(thumbnail, thumbnail_path, format="JPEG", quality=85)
+            written.append(thumbnail_path)
+    return written
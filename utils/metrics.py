@@ -0,0 +1,306 @@
+"""
+Prometheus 文本格式的运行指标
+
+计数器与直方图累计在共享的 SQLite 任务数据库中，多个 uvicorn worker 与视频渲染子进程
+的数据汇总为同一份指标；仪表（Gauge）只反映当前进程，在抓取时由调用方设置。
+
+inc / observe 只在内存中累加增量，不访问数据库，可在事件循环上直接调用；后台线程每隔
+METRICS_FLUSH_INTERVAL 秒把增量合并为一次事务写入，进程退出与输出指标前也会写入一次。
+"""
+import asyncio
+import atexit
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import CancelledError
+from typing import Dict, List, Optional, Tuple
+
+# Prometheus 文本格式的 Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 默认直方图分桶（秒），覆盖 TTS 的亚秒级到整片渲染的十分钟级
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# 内存中累加的增量写入数据库的间隔（秒）
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+_registry: Dict[str, "_Metric"] = {}
+_store = None
+_store_lock = threading.Lock()
+# 尚未写入数据库的增量：(名称, 标签 JSON) -> 增量
+_pending: Dict[Tuple[str, str], float] = {}
+_pending_lock = threading.Lock()
+# 启动了写入线程的进程ID；fork 出的子进程不继承线程，需要重新启动
+_flusher_pid: Optional[int] = None
+
+
+def _get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            # 延迟导入并创建，避免模块导入时就打开数据库
+            from utils.task_store import TaskStore
+            _store = TaskStore()
+        return _store
+
+
+def _labels_key(labels: Dict[str, str]) -> str:
+    return json.dumps({k: str(v) for k, v in labels.items()}, sort_keys=True, ensure_ascii=False)
+
+
+def _record(rows: List[Tuple[str, str, float]]):
+    """在内存中累加指标增量，由后台线程批量写入"""
+    global _flusher_pid
+    with _pending_lock:
+        for name, labels, value in rows:
+            _pending[(name, labels)] = _pending.get((name, labels), 0.0) + value
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush()
+
+
+def flush():
+    """把内存中累加的增量合并为一次事务写入数据库；写入失败时保留增量，下次重试，不影响业务流程"""
+    with _pending_lock:
+        if not _pending:
+            return
+        rows = [(name, labels, value) for (name, labels), value in _pending.items()]
+        _pending.clear()
+    try:
+        _get_store().add_metric_values(rows)
+    except sqlite3.Error as e:
+        print(f"警告：写入指标失败: {e}")
+        _record(rows)
+
+
+atexit.register(flush)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    items = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        items.append(f'{key}="{value}"')
+    return "{" + ",".join(items) + "}"
+
+
+class _Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str):
+        if name in _registry:
+            raise ValueError(f"指标重复注册: {name}")
+        self.name = name
+        self.documentation = documentation
+        _registry[name] = self
+
+    @abstractmethod
+    def _render(self, stored: Dict[str, List[Tuple[Dict[str, str], float]]]) -> List[str]:
+        """把数据库中汇总的数值与本进程的瞬时值渲染为 Prometheus 文本行"""
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    type = "counter"
+
+    def inc(self, value: float = 1.0, **labels):
+        _record([(self.name, _labels_key(labels), value)])
+
+    def _render(self, stored):
+        return [f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+                for labels, value in sorted(stored.get(self.name, []), key=lambda x: _labels_key(x[0]))]
+
+
+class Gauge(_Metric):
+    """当前进程内的瞬时值，抓取前由调用方设置"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: Dict[str, Tuple[Dict[str, str], float]] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_labels_key(labels)] = (labels, value)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _render(self, stored):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+                for _, (labels, value) in items]
+
+
+class Histogram(_Metric):
+    """耗时直方图。各分桶单独累计，输出时再转为 Prometheus 的累积分桶"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        bucket = next(b for b in self.buckets if value <= b)
+        key = _labels_key(labels)
+        _record([
+            (f"{self.name}_bucket", _labels_key(dict(labels, le=_format_value(bucket))), 1),
+            (f"{self.name}_sum", key, value),
+            (f"{self.name}_count", key, 1),
+        ])
+
+    def time(self, **labels) -> "_Timer":
+        """计时器，可用作 with 语句或函数装饰器；按退出方式记录 status 标签
+        （success / error / cancelled）"""
+        return _Timer(self, labels)
+
+    def _render(self, stored):
+        buckets: Dict[str, Dict[str, float]] = {}
+        for labels, value in stored.get(f"{self.name}_bucket", []):
+            labels = dict(labels)
+            le = labels.pop("le")
+            buckets.setdefault(_labels_key(labels), {})[le] = value
+        sums = {_labels_key(labels): value for labels, value in stored.get(f"{self.name}_sum", [])}
+
+        lines = []
+        for labels, count in sorted(stored.get(f"{self.name}_count", []), key=lambda x: _labels_key(x[0])):
+            key = _labels_key(labels)
+            cumulative = 0.0
+            for bound in self.buckets:
+                le = _format_value(bound)
+                cumulative += buckets.get(key, {}).get(le, 0)
+                lines.append(f"{self.name}_bucket{_format_labels(dict(labels, le=le))} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(sums.get(key, 0))}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {_format_value(count)}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+        # 函数以返回值而非异常表示失败时，可在 with 块内改写
+        self.status = "success"
+        self._start: Optional[float] = None
+
+    def __enter__(self) -> "_Timer":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        status = self.status
+        if exc_type is not None:
+            cancelled = issubclass(exc_type, (CancelledError, asyncio.CancelledError))
+            status = "cancelled" if cancelled else "error"
+        self.histogram.observe(time.perf_counter() - self._start, status=status, **self.labels)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # 每次调用使用独立计时器，支持并发调用
+            with _Timer(self.histogram, self.labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def render() -> str:
+    """以 Prometheus 文本格式输出所有指标；先写入本进程尚未写入的增量"""
+    stored: Dict[str, List[Tuple[Dict[str, str], float]]] = {}
+    flush()
+    try:
+        rows = _get_store().metric_values()
+    except sqlite3.Error as e:
+        print(f"警告：读取指标失败: {e}")
+        rows = []
+    for name, labels, value in rows:
+        stored.setdefault(name, []).append((json.loads(labels), value))
+
+    lines = []
+    for name in sorted(_registry):
+        metric = _registry[name]
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        lines.extend(metric._render(stored))
+    return "\n".join(lines) + "\n"
+
+
+# 流水线各环节耗时
+AGENT_RUN_SECONDS = Histogram(
+    "agent_run_duration_seconds", "Duration of LLM agent runs, by agent and status."
+)
+IMAGE_GENERATION_SECONDS = Histogram(
+    "image_generation_duration_seconds", "Duration of ComfyUI generate_image calls, by status."
+)
+IMAGE_CACHE_REQUESTS = Counter(
+    "image_cache_requests_total", "Image render cache lookups, by result (hit / miss)."
+)
+COMFYUI_BACKEND_HEALTHY = Gauge(
+    "comfyui_backend_healthy", "Whether a ComfyUI backend is in rotation in this process (1) or cooling down (0)."
+)
+COMFYUI_BACKEND_QUEUE_DEPTH = Gauge(
+    "comfyui_backend_queue_depth", "Last polled ComfyUI queue depth, by backend."
+)
+COMFYUI_BACKEND_INFLIGHT = Gauge(
+    "comfyui_backend_inflight", "Image requests dispatched by this process and not yet returned, by backend."
+)
+COMFYUI_WATCHDOG_EVENTS = Counter(
+    "comfyui_watchdog_events_total",
+    "ComfyUI prompt watchdog actions, by event (timeout / lost / recovered / requeued).",
+)
+TTS_SECONDS = Histogram(
+    "tts_duration_seconds", "Duration of TTS synthesis per script, by status."
+)
+TTS_CHARACTERS = Counter(
+    "tts_characters_total", "Characters of script text sent to TTS."
+)
+TTS_CACHE_REQUESTS = Counter(
+    "tts_cache_requests_total", "TTS synthesis cache lookups, by result (hit / miss)."
+)
+VIDEO_STAGE_SECONDS = Histogram(
+    "video_stage_duration_seconds", "Duration of video composition stages, by stage and status."
+)
+
+# 任务管理器
+TASKS = Gauge(
+    "taskmanager_tasks", "Unfinished tasks in the shared task store, by task type and status."
+)
+EXECUTOR_QUEUED = Gauge(
+    "taskmanager_executor_queued", "Jobs waiting for a free worker in this process, by executor."
+)
+EXECUTOR_ACTIVE = Gauge(
+    "taskmanager_executor_active", "Jobs currently running in this process, by executor."
+)
+EXECUTOR_MAX_WORKERS = Gauge(
+    "taskmanager_executor_max_workers", "Configured workers per executor in this process."
+)
+EXECUTOR_UTILIZATION = Gauge(
+    "taskmanager_executor_utilization", "Active jobs divided by max workers in this process, by executor."
+)
+EXECUTOR_BUSY_SECONDS = Counter(
+    "taskmanager_executor_busy_seconds_total", "Cumulative time workers spent running jobs, by executor."
+)
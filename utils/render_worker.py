@@ -0,0 +1,61 @@
+"""
+视频渲染子进程入口
+
+子进程只通过共享的任务存储与父进程交互：轮询取消标记、写入进度与任务事件。本模块不导入
+任务管理器，子进程中不会创建线程池与全局任务管理器实例。
+"""
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from utils.metrics import EXECUTOR_BUSY_SECONDS, flush as flush_metrics
+from utils.task_models import Task, TaskStatus, progress_reporter
+from utils.task_store import TaskStore
+
+# 子进程中按数据库路径缓存的任务存储
+_stores: Dict[str, TaskStore] = {}
+
+
+def _get_store(db_path: str) -> TaskStore:
+    store = _stores.get(db_path)
+    if store is None:
+        store = _stores[db_path] = TaskStore(db_path)
+    return store
+
+
+def _write_progress(store: TaskStore, task_id: str, progress: float):
+    """写入运行进度并追加任务事件；任务已进入终态时不写入"""
+    if not store.update_status(task_id, TaskStatus.RUNNING.value, progress=progress, start_time=time.time()):
+        return
+    data = store.get(task_id)
+    if data is not None:
+        store.append_event("task", Task.from_dict(data).to_event())
+
+
+def render_process_entry(db_path: str, task_id: str, job: Callable[..., Any],
+                         report_progress: bool, kwargs: Dict[str, Any]) -> Any:
+    """渲染子进程入口：轮询共享存储中的取消标记转为取消信号，并把进度写回共享存储"""
+    store = _get_store(db_path)
+
+    cancel_event = threading.Event()
+    done = threading.Event()
+
+    def watch_cancel():
+        while not done.wait(0.5):
+            if store.cancel_requested_ids([task_id]):
+                cancel_event.set()
+                return
+
+    threading.Thread(target=watch_cancel, name="render-cancel-watcher", daemon=True).start()
+    if report_progress:
+        kwargs = dict(kwargs, on_progress=progress_reporter(
+            lambda progress: _write_progress(store, task_id, progress)
+        ))
+    start = time.perf_counter()
+    try:
+        return job(cancel_event=cancel_event, **kwargs)
+    finally:
+        done.set()
+        EXECUTOR_BUSY_SECONDS.inc(time.perf_counter() - start, executor="render")
+        # 进程池关闭时子进程可能来不及执行退出处理，每次渲染结束即写入本次的指标
+        flush_metrics()
@@ -74,8 +74,8 @@ def generate_scene_image(scene_data: Dict[str, Any], images_dir: str = "output/i
     image_path = os.path.join(images_dir, f"scene_{scene_id}.png")
     
     try:
-        result = generate_image(prompt_text=image_prompt, save_path=image_path)
-        return result and os.path.exists(image_path)
+        images = generate_image(prompt_text=image_prompt, save_path=image_path)
+        return bool(images) and os.path.exists(image_path)
     except Exception as e:
         print(f"生成场景 {scene_id} 图片失败: {e}")
         return False
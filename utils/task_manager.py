@@ -2,168 +2,930 @@
 异步任务管理器，用于管理图片生成和视频合成任务
 """
 import asyncio
+import hashlib
+import json
+import multiprocessing
 import os
-import time
+import random
+import socket
 import threading
-from concurrent.futures import ThreadPoolExecutor
+import time
+import uuid
+from concurrent.futures import (
+    CancelledError, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor,
+    TimeoutError as FuturesTimeoutError, wait, FIRST_COMPLETED,
+)
+from concurrent.futures.process import BrokenProcessPool
 from enum import Enum
-from typing import Dict, Any, Optional, List
-from dataclasses import dataclass, asdict
-from utils.comfyui import generate_image
-from utils.video import generate_video as sync_generate_video
-
+from typing import Callable, Dict, Any, Optional, List, Set, Tuple
+from dataclasses import dataclass, field
+from utils.comfyui import PACK_SIZE, backend_stats, generate_image
+from utils.edge_tts import TTS_CONCURRENCY, TTSJob, generate_audio_for_script, synthesize_batch
+from utils.images import make_derivatives
+from utils.metrics import (
+    COMFYUI_BACKEND_HEALTHY, COMFYUI_BACKEND_INFLIGHT, COMFYUI_BACKEND_QUEUE_DEPTH, EXECUTOR_ACTIVE, EXECUTOR_BUSY_SECONDS, EXECUTOR_MAX_WORKERS, EXECUTOR_QUEUED,
+    EXECUTOR_UTILIZATION, TASKS,
+)
+from utils.render_worker import render_process_entry
+from utils.task_models import Task, TaskStatus, TaskType, progress_reporter
+from utils.task_store import TaskStore
+from utils.workspace import OUTPUT_ROOT, Workspace
+from utils.video import (
+    VIDEO_SIZE,
+    compose_segments,
+    generate_video as sync_generate_video,
+    render_scene_segment,
+)
 
-class TaskStatus(Enum):
-    PENDING = "pending"      # 等待中
-    RUNNING = "running"      # 运行中
-    COMPLETED = "completed"  # 已完成
-    FAILED = "failed"        # 失败
+# 同时提交给 ComfyUI 的场景数，可通过环境变量 COMFYUI_CONCURRENCY 配置
+IMAGE_CONCURRENCY = int(os.getenv("COMFYUI_CONCURRENCY", "2"))
+# 单个场景图片的最大尝试次数与重试退避基数（秒）
+IMAGE_MAX_ATTEMPTS = int(os.getenv("COMFYUI_MAX_ATTEMPTS", "3"))
+IMAGE_RETRY_BASE_DELAY = float(os.getenv("COMFYUI_RETRY_BASE_DELAY", "2"))
+# 未指定种子的场景按提示词派生固定种子（而非随机），重跑同一小说时可命中图片缓存
+IMAGE_DETERMINISTIC_SEED = os.getenv("COMFYUI_DETERMINISTIC_SEED", "0").lower() in ("1", "true", "yes")
+# 同时进行的场景片段渲染数（TTS 合成数 TTS_CONCURRENCY 见 utils/edge_tts.py）
+VIDEO_CONCURRENCY = int(os.getenv("VIDEO_CONCURRENCY", "2"))
+# 同时生成场景图片派生图（成片帧、WebP 预览、缩略图）的线程数
+DERIVATIVE_CONCURRENCY = int(os.getenv("IMAGE_DERIVATIVE_CONCURRENCY", "2"))
+# 任务心跳：执行任务的 worker 每 TASK_HEARTBEAT_INTERVAL 秒刷新一次，超过 TASK_HEARTBEAT_TIMEOUT 秒
+# 未刷新的未结束任务视为其 worker 已退出（进程崩溃或服务重启），标记为失败
+TASK_HEARTBEAT_INTERVAL = float(os.getenv("TASK_HEARTBEAT_INTERVAL", "10"))
+TASK_HEARTBEAT_TIMEOUT = float(os.getenv("TASK_HEARTBEAT_TIMEOUT", "60"))
 
 
-class TaskType(Enum):
-    IMAGE_GENERATION = "image_generation"     # 图片生成
-    VIDEO_COMPOSITION = "video_composition"   # 视频合成
+class StageState(Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    SKIPPED = "skipped"      # 上游阶段失败或任务取消，未执行
+    CANCELLED = "cancelled"  # 执行中被取消
 
 
 @dataclass
-class Task:
-    task_id: str
-    task_type: TaskType
-    status: TaskStatus
-    progress: float = 0.0
+class Stage:
+    name: str
+    func: Callable[[], Any]
+    deps: List[str] = field(default_factory=list)
+    executor: Optional[Executor] = None
+    # 阶段完成后产出的文件，用于推送文件事件
+    outputs: List[str] = field(default_factory=list)
+    state: StageState = StageState.PENDING
+    error: Optional[str] = None
     start_time: Optional[float] = None
     end_time: Optional[float] = None
-    error_message: Optional[str] = None
-    result: Optional[Dict[str, Any]] = None
-    params: Optional[Dict[str, Any]] = None
 
-    def to_dict(self) -> Dict[str, Any]:
-        data = asdict(self)
-        data['task_type'] = self.task_type.value
-        data['status'] = self.status.value
-        return data
 
+class StageGraph:
+    """阶段依赖图调度器
 
-class TaskManager:
-    """异步任务管理器"""
+    每个阶段在其所有依赖完成后立即提交到自己的执行器，互不依赖的阶段并行运行，
+    整体耗时约等于图中最长的一条路径。某个阶段失败或被取消时，只有依赖它的下游阶段被跳过。
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Stage] = {}
+
+    def add(self, name: str, func: Callable[[], Any], deps: Optional[List[str]] = None,
+            executor: Optional[Executor] = None, outputs: Optional[List[str]] = None) -> Stage:
+        """添加一个阶段"""
+        if name in self.stages:
+            raise ValueError(f"阶段重复: {name}")
+        stage = Stage(name=name, func=func, deps=list(deps or []), executor=executor,
+                      outputs=list(outputs or []))
+        self.stages[name] = stage
+        return stage
+
+    def validate(self):
+        """检查依赖是否存在且无环"""
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"阶段 {stage.name} 依赖未知阶段: {dep}")
+        indegree = {name: len(stage.deps) for name, stage in self.stages.items()}
+        ready = [name for name, count in indegree.items() if count == 0]
+        visited = 0
+        while ready:
+            name = ready.pop()
+            visited += 1
+            for other in self.stages.values():
+                if name in other.deps:
+                    indegree[other.name] -= 1
+                    if indegree[other.name] == 0:
+                        ready.append(other.name)
+        if visited != len(self.stages):
+            raise ValueError("阶段依赖图存在环")
+
+    def _skip_dependents(self, name: str):
+        for stage in self.stages.values():
+            if name in stage.deps and stage.state == StageState.PENDING:
+                stage.state = StageState.SKIPPED
+                stage.error = f"上游阶段 {name} 未完成"
+                self._skip_dependents(stage.name)
+
+    def run(self, default_executor: Executor,
+            on_stage_done: Optional[Callable[[Stage], None]] = None,
+            cancel_event: Optional[threading.Event] = None,
+            on_tick: Optional[Callable[[], None]] = None) -> Dict[str, Stage]:
+        """阻塞执行整张图，返回各阶段的最终状态
+
+        cancel_event 置位后不再提交新阶段，已排队未开始的阶段立即撤出执行器，
+        运行中的阶段由各自的取消逻辑中止。on_tick 在每轮等待后调用，用于刷新阶段内的细粒度进度。
+        """
+        self.validate()
+        running: Dict[Future, Stage] = {}
+
+        def submit_ready():
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            for stage in self.stages.values():
+                if stage.state != StageState.PENDING:
+                    continue
+                if all(self.stages[dep].state == StageState.COMPLETED for dep in stage.deps):
+                    stage.state = StageState.RUNNING
+                    stage.start_time = time.time()
+                    executor = stage.executor or default_executor
+                    running[executor.submit(stage.func)] = stage
+
+        submit_ready()
+        while running:
+            done, _ = wait(list(running), timeout=0.5, return_when=FIRST_COMPLETED)
+            if cancel_event is not None and cancel_event.is_set():
+                for future in running:
+                    future.cancel()
+                for stage in self.stages.values():
+                    if stage.state == StageState.PENDING:
+                        stage.state = StageState.SKIPPED
+                        stage.error = "任务已取消"
+            for future in done:
+                stage = running.pop(future)
+                stage.end_time = time.time()
+                try:
+                    future.result()
+                    stage.state = StageState.COMPLETED
+                except CancelledError:
+                    stage.state = StageState.CANCELLED
+                    stage.error = "任务已取消"
+                    self._skip_dependents(stage.name)
+                except Exception as e:
+                    stage.state = StageState.FAILED
+                    stage.error = str(e)
+                    self._skip_dependents(stage.name)
+                if on_stage_done is not None:
+                    on_stage_done(stage)
+            if on_tick is not None:
+                on_tick()
+            submit_ready()
+        return self.stages
+
+
+# 事件流监听者在等待者表中使用的键
+_EVENTS_KEY = "*"
+
+
+class _SceneProgress:
+    """按场景聚合 ComfyUI 的采样步数进度与潜空间预览图
+
+    回调在 ComfyUI 后台事件循环上执行，只在内存中记录；由任务线程定期读取并写入任务进度与
+    预览文件，避免在事件循环上访问数据库和磁盘。
+    """
     
-    def __init__(self, max_workers: int = 4):
-        self.tasks: Dict[str, Task] = {}
-        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+    def __init__(self, workspace: Workspace):
+        self.workspace = workspace
         self._lock = threading.Lock()
+        self._fractions: Dict[int, float] = {}
+        self._previews: Dict[int, bytes] = {}
+        self._finished: Set[int] = set()
+    
+    def listeners(self, idx: int) -> Dict[str, Callable]:
+        """场景 idx 的 on_progress / on_preview 回调"""
+        def on_progress(value: int, maximum: int):
+            with self._lock:
+                if idx not in self._finished:
+                    # 重试时步数从头开始，进度不回退
+                    self._fractions[idx] = max(self._fractions.get(idx, 0.0), min(value / maximum, 1.0))
+        
+        def on_preview(data: bytes):
+            with self._lock:
+                if idx not in self._finished:
+                    self._previews[idx] = data
+        
+        return {"on_progress": on_progress, "on_preview": on_preview}
+    
+    def in_flight(self) -> float:
+        """尚未结束的场景的进度之和（以场景数计）"""
+        with self._lock:
+            return sum(self._fractions.values())
+    
+    def flush_previews(self):
+        """把最新的预览图写入各场景的预览文件"""
+        with self._lock:
+            previews, self._previews = self._previews, {}
+        for idx, data in previews.items():
+            path = self.workspace.image_preview(idx)
+            try:
+                with open(path + ".tmp", "wb") as f:
+                    f.write(data)
+                os.replace(path + ".tmp", path)
+            except OSError as e:
+                print(f"警告：写入场景 {idx} 预览图失败: {e}")
+    
+    def finish(self, idx: int):
+        """场景结束（成功或失败）：不再计入进行中进度，删除预览文件"""
+        with self._lock:
+            self._finished.add(idx)
+            self._fractions.pop(idx, None)
+            self._previews.pop(idx, None)
+        try:
+            os.remove(self.workspace.image_preview(idx))
+        except FileNotFoundError:
+            pass
+
+
+class MeteredThreadPoolExecutor(ThreadPoolExecutor):
+    """记录排队数、运行数与累计忙碌时间的线程池，用于容量规划"""
+    
+    def __init__(self, name: str, max_workers: int):
+        super().__init__(max_workers=max_workers, thread_name_prefix=name)
+        self.name = name
+        self.max_workers = max_workers
+        self.queued = 0
+        self.active = 0
+        self._stats_lock = threading.Lock()
+    
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        def run():
+            with self._stats_lock:
+                self.queued -= 1
+                self.active += 1
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._stats_lock:
+                    self.active -= 1
+                EXECUTOR_BUSY_SECONDS.inc(time.perf_counter() - start, executor=self.name)
+        
+        def on_done(future: Future):
+            # 开始执行前被撤销的任务不会进入 run
+            if future.cancelled():
+                with self._stats_lock:
+                    self.queued -= 1
+        
+        with self._stats_lock:
+            self.queued += 1
+        future = super().submit(run)
+        future.add_done_callback(on_done)
+        return future
+
+
+def _new_task_id(prefix: str) -> str:
+    """生成任务ID；附加随机后缀，避免多个 worker 在同一秒内提交任务时冲突"""
+    return f"{prefix}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+
+
+class TaskManager:
+    """异步任务管理器
+
+    任务状态保存在共享的 SQLite 存储中，因此同一主机上的所有 uvicorn worker
+    都能查询到彼此提交的任务，服务重启后任务记录依然保留。
+    """
+    
+    def __init__(self, max_workers: int = 4, db_path: Optional[str] = None,
+                 image_concurrency: int = IMAGE_CONCURRENCY):
+        self.store = TaskStore(db_path)
+        self.executor = MeteredThreadPoolExecutor("task", max_workers)
+        # 单场景渲染线程池，所有图片任务共享。并发场景在客户端按 PACK_SIZE 打包成一次提交，
+        # 因此同时压到 ComfyUI 上的 prompt 数约为 image_concurrency
+        self.image_executor = MeteredThreadPoolExecutor(
+            "comfyui", max(1, image_concurrency) * max(1, PACK_SIZE))
+        # 流水线中的配音与场景片段渲染阶段各自使用独立线程池，避免与调度线程互相占用
+        self.audio_executor = MeteredThreadPoolExecutor("tts", max(1, TTS_CONCURRENCY))
+        self.video_executor = MeteredThreadPoolExecutor("video", max(1, VIDEO_CONCURRENCY))
+        # 图片派生图在独立线程池中生成，不占用图片线程池的 ComfyUI 并发名额
+        self.derivative_executor = MeteredThreadPoolExecutor("derivatives", max(1, DERIVATIVE_CONCURRENCY))
+        # 视频渲染进程池（按需创建）：moviepy 逐帧合成长时间持有 GIL，放在子进程中执行，
+        # 多个渲染可以利用多核，API 进程的事件循环也不受影响
+        self._render_pool: Optional[ProcessPoolExecutor] = None
+        self._render_pool_lock = threading.Lock()
+        # 已提交到渲染进程池、尚未结束的作业，用于统计排队与运行数
+        self._render_futures: Set[Future] = set()
+        # wait_for 的等待者：task_id -> [(事件循环, 事件)]，任务更新时跨线程唤醒
+        self._waiters: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+        self._waiters_lock = threading.Lock()
+        # 本进程内正在执行的任务的取消信号，由后台线程根据共享存储中的取消标记置位
+        self._cancel_events: Dict[str, threading.Event] = {}
+        self._cancel_lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        # 本实例的标识，记录在它创建的任务上，后台线程据此刷新这些任务的心跳；
+        # 带随机后缀，服务重启后复用了同一 pid 也不会认领旧任务
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # 上次运行遗留的任务：心跳已过期的直接标记为失败，其余在读取时再检查
+        try:
+            self.reap_orphaned_tasks()
+        except Exception as e:
+            print(f"警告：检查遗留任务失败: {e}")
         
     def create_task(self, task_id: str, task_type: TaskType, params: Dict[str, Any]) -> Task:
         """创建一个新任务"""
-        with self._lock:
-            task = Task(
-                task_id=task_id,
-                task_type=task_type,
-                status=TaskStatus.PENDING,
-                params=params
-            )
-            self.tasks[task_id] = task
-            return task
+        task = Task(
+            task_id=task_id,
+            task_type=task_type,
+            status=TaskStatus.PENDING,
+            params=params
+        )
+        self.store.insert(task.to_dict(), owner=self.owner)
+        self._ensure_watcher()
+        self._emit_task_event(task)
+        return task
     
     def get_task(self, task_id: str) -> Optional[Task]:
         """获取任务状态"""
-        return self.tasks.get(task_id)
+        data = self.store.get(task_id)
+        if data and _is_orphaned(data) and self.reap_orphaned_tasks([task_id]):
+            data = self.store.get(task_id)
+        return Task.from_dict(data) if data else None
+    
+    def reap_orphaned_tasks(self, task_ids: Optional[List[str]] = None) -> List[str]:
+        """把心跳超时的未结束任务标记为失败（执行它的 worker 已退出），返回这些任务ID"""
+        orphaned = self.store.fail_orphaned(
+            time.time() - TASK_HEARTBEAT_TIMEOUT, "执行任务的 worker 已退出（进程崩溃或服务重启）", task_ids
+        )
+        for task_id in orphaned:
+            self._notify_waiters(task_id)
+            data = self.store.get(task_id)
+            if data is not None:
+                self._emit_task_event(Task.from_dict(data))
+        return orphaned
     
     def update_task_status(self, task_id: str, status: TaskStatus, 
                           progress: Optional[float] = None, error_message: Optional[str] = None,
                           result: Optional[Dict[str, Any]] = None):
         """更新任务状态"""
-        with self._lock:
-            if task_id in self.tasks:
-                task = self.tasks[task_id]
-                task.status = status
-                if progress is not None:
-                    task.progress = progress
-                if error_message is not None:
-                    task.error_message = error_message
-                if result is not None:
-                    task.result = result
+        now = time.time()
+        self.store.update_status(
+            task_id,
+            status.value,
+            progress=progress,
+            error_message=error_message,
+            result=result,
+            start_time=now if status == TaskStatus.RUNNING else None,
+            end_time=now if status.is_finished else None,
+        )
+        self._notify_waiters(task_id)
+        task = self.get_task(task_id)
+        if task is not None:
+            self._emit_task_event(task)
+    
+    def cancel_task(self, task_id: str) -> bool:
+        """取消任务。等待中的任务立即标记为已取消；运行中的任务由执行它的 worker
+        在检测到取消标记后中止（ComfyUI 任务会被中断并移出队列，视频渲染在下一帧停止）。
+        
+        Returns:
+            bool: 任务存在且尚未结束时返回 True
+        """
+        task = self.get_task(task_id)
+        if task is None or task.status.is_finished:
+            return False
+        if not self.store.request_cancel(task_id):
+            return False
+        with self._cancel_lock:
+            cancel_event = self._cancel_events.get(task_id)
+        if cancel_event is not None:
+            cancel_event.set()
+        elif task.status == TaskStatus.PENDING:
+            self.update_task_status(task_id, TaskStatus.CANCELLED, error_message="任务已取消")
+        return True
+    
+    def _begin_task(self, task_id: str) -> Optional[threading.Event]:
+        """工作线程开始执行任务：登记取消信号并标记为运行中；任务已被取消时返回 None"""
+        cancel_event = threading.Event()
+        with self._cancel_lock:
+            self._cancel_events[task_id] = cancel_event
+        self._ensure_watcher()
+        task = self.get_task(task_id)
+        if task is None or task.status.is_finished or self.store.cancel_requested_ids([task_id]):
+            self._end_task(task_id)
+            self.update_task_status(task_id, TaskStatus.CANCELLED, error_message="任务已取消")
+            return None
+        self.update_task_status(task_id, TaskStatus.RUNNING, progress=0.0)
+        return cancel_event
+    
+    def _end_task(self, task_id: str):
+        with self._cancel_lock:
+            self._cancel_events.pop(task_id, None)
+    
+    def _ensure_watcher(self):
+        with self._cancel_lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch_tasks, name="task-watcher", daemon=True)
+                self._watcher.start()
+    
+    def _watch_tasks(self, interval: float = 1.0):
+        """后台线程：定期刷新本实例任务的心跳并回收其他 worker 遗留的任务；
+        轮询共享存储，把其他 worker 发出的取消请求转为本进程的取消信号"""
+        next_heartbeat = 0.0
+        while True:
+            time.sleep(interval)
+            if time.monotonic() >= next_heartbeat:
+                next_heartbeat = time.monotonic() + TASK_HEARTBEAT_INTERVAL
+                try:
+                    self.store.heartbeat(self.owner)
+                    self.reap_orphaned_tasks()
+                except Exception as e:
+                    print(f"警告：刷新任务心跳失败: {e}")
+            with self._cancel_lock:
+                task_ids = list(self._cancel_events)
+            if not task_ids:
+                continue
+            try:
+                cancelled = self.store.cancel_requested_ids(task_ids)
+            except Exception as e:
+                print(f"警告：读取任务取消标记失败: {e}")
+                continue
+            with self._cancel_lock:
+                for task_id in cancelled:
+                    cancel_event = self._cancel_events.get(task_id)
+                    if cancel_event is not None:
+                        cancel_event.set()
+    
+    def _progress_reporter(self, task_id: str, start: float = 0.0,
+                           span: float = 100.0) -> Callable[[float], None]:
+        """返回进度回调（参数 0~1），映射到 [start, start + span] 并按整数百分比节流写入"""
+        return progress_reporter(
+            lambda progress: self.update_task_status(task_id, TaskStatus.RUNNING, progress=progress),
+            start, span,
+        )
+    
+    def _get_render_pool(self) -> ProcessPoolExecutor:
+        with self._render_pool_lock:
+            if self._render_pool is None:
+                # 使用 spawn：当前进程有多个线程持有锁和数据库连接，fork 不安全
+                self._render_pool = ProcessPoolExecutor(
+                    max_workers=max(1, VIDEO_CONCURRENCY),
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._render_pool
+    
+    def _reset_render_pool(self, pool: ProcessPoolExecutor):
+        """渲染子进程异常退出后进程池不可再用，丢弃后下次按需重建"""
+        with self._render_pool_lock:
+            if self._render_pool is pool:
+                self._render_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+    
+    def _discard_render_future(self, future: Future):
+        with self._render_pool_lock:
+            self._render_futures.discard(future)
+    
+    def _run_render_job(self, task_id: str, job: Callable[..., Any], cancel_event: threading.Event,
+                        report_progress: bool = False, **kwargs) -> Any:
+        """在渲染进程池中执行视频渲染函数并等待其结果
+        
+        子进程通过共享任务存储读取取消标记、写入任务进度。内存数据库无法跨进程共享，
+        此时直接在当前线程中执行。
+        """
+        if self.store.db_path == ":memory:":
+            if report_progress:
+                kwargs["on_progress"] = self._progress_reporter(task_id)
+            return job(cancel_event=cancel_event, **kwargs)
+        
+        pool = self._get_render_pool()
+        try:
+            future = pool.submit(
+                render_process_entry, self.store.db_path, task_id, job, report_progress, kwargs
+            )
+            with self._render_pool_lock:
+                self._render_futures.add(future)
+            future.add_done_callback(self._discard_render_future)
+            while True:
+                try:
+                    return future.result(timeout=0.5)
+                except FuturesTimeoutError:
+                    # 尚未开始的渲染直接撤销；已开始的由子进程轮询取消标记后中止
+                    if cancel_event.is_set() and future.cancel():
+                        raise CancelledError("任务已取消")
+        except BrokenProcessPool:
+            self._reset_render_pool(pool)
+            raise RuntimeError("视频渲染进程异常退出")
+    
+    def emit_event(self, event: str, data: Dict[str, Any]) -> int:
+        """写入一条事件（所有 worker 共享），并唤醒本进程内的事件流"""
+        event_id = self.store.append_event(event, data)
+        self._notify_waiters(_EVENTS_KEY)
+        return event_id
+    
+    def _emit_task_event(self, task: Task):
+        self.emit_event("task", task.to_event())
+    
+    def notify_file(self, path: str):
+        """记录一次输出文件创建/更新事件，事件中的路径相对 output 目录"""
+        rel = os.path.relpath(os.path.abspath(path), os.path.abspath(OUTPUT_ROOT))
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = None
+        self.emit_event("file", {"path": rel.replace(os.sep, "/"), "size": size})
+    
+    def last_event_id(self) -> int:
+        """当前最新事件ID"""
+        return self.store.event_id_range()[1]
+    
+    async def next_events(self, after_id: int, timeout: float = 15.0,
+                          poll_interval: float = 0.5) -> List[Dict[str, Any]]:
+        """等待并返回 ID 大于 after_id 的事件；超时返回空列表。存储查询在线程中执行，不阻塞事件循环"""
+        events = await asyncio.to_thread(self.store.events_after, after_id)
+        if events:
+            return events
+        
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        event = asyncio.Event()
+        entry = (loop, event)
+        with self._waiters_lock:
+            self._waiters.setdefault(_EVENTS_KEY, []).append(entry)
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return []
+                event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(poll_interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
+                events = await asyncio.to_thread(self.store.events_after, after_id)
+                if events:
+                    return events
+        finally:
+            self._remove_waiter(_EVENTS_KEY, entry)
+    
+    def _notify_waiters(self, task_id: str):
+        """唤醒本进程内等待该任务的协程（可在任意线程调用）"""
+        with self._waiters_lock:
+            waiters = list(self._waiters.get(task_id, []))
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+    
+    async def wait_for(self, task_id: str, timeout: float = 25.0, min_progress_delta: float = 0.0,
+                       poll_interval: float = 0.5) -> Optional[Task]:
+        """等待任务结束、状态变化或进度推进至少 min_progress_delta，超时则返回当前状态
+        
+        本进程内的更新会立即唤醒等待者；其他 worker 写入的更新通过每 poll_interval
+        秒读取一次共享存储获得。等待期间不阻塞事件循环：存储查询在线程中执行，
+        数据库锁等待不会卡住事件循环。
+        """
+        task = await asyncio.to_thread(self.get_task, task_id)
+        if task is None or task.status.is_finished:
+            return task
+        
+        initial_status = task.status
+        baseline = task.progress
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        event = asyncio.Event()
+        entry = (loop, event)
+        
+        with self._waiters_lock:
+            self._waiters.setdefault(task_id, []).append(entry)
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return task
+                event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(poll_interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
                 
-                if status == TaskStatus.RUNNING and task.start_time is None:
-                    task.start_time = time.time()
-                elif status in [TaskStatus.COMPLETED, TaskStatus.FAILED]:
-                    task.end_time = time.time()
+                task = await asyncio.to_thread(self.get_task, task_id)
+                if task is None or task.status.is_finished:
+                    return task
+                if task.status != initial_status:
+                    return task
+                delta = task.progress - baseline
+                if delta > 0 and delta >= min_progress_delta:
+                    return task
+        finally:
+            self._remove_waiter(task_id, entry)
+    
+    def _remove_waiter(self, key: str, entry: Tuple[asyncio.AbstractEventLoop, asyncio.Event]):
+        with self._waiters_lock:
+            waiters = self._waiters.get(key, [])
+            if entry in waiters:
+                waiters.remove(entry)
+            if not waiters:
+                self._waiters.pop(key, None)
     
-    async def submit_image_generation_task(self, scenes_data: List[Dict[str, Any]]) -> str:
-        """提交图片生成任务"""
-        task_id = f"images_{int(time.time())}"
-        params = {"scenes": scenes_data, "total_scenes": len(scenes_data)}
+    def list_tasks(self, status: Optional[TaskStatus] = None,
+                   task_type: Optional[TaskType] = None) -> List[Task]:
+        """按状态和类型查询任务"""
+        self.reap_orphaned_tasks()
+        rows = self.store.list_tasks(
+            status=status.value if status else None,
+            task_type=task_type.value if task_type else None,
+        )
+        return [Task.from_dict(row) for row in rows]
+    
+    async def submit_image_generation_task(self, scenes_data: List[Dict[str, Any]],
+                                           resume: bool = False,
+                                           workspace: Optional[Workspace] = None) -> str:
+        """提交图片生成任务
+        
+        Args:
+            scenes_data: 场景列表
+            resume: 为 True 时跳过图片已存在且提示词/种子与记录一致的场景，只重新生成缺失或失败的场景
+            workspace: 运行工作区，默认使用 output/ 根目录
+        """
+        workspace = workspace or Workspace()
+        task_id = _new_task_id("images")
+        params = {
+            "scenes": scenes_data,
+            "total_scenes": len(scenes_data),
+            "resume": resume,
+            "run_id": workspace.run_id,
+        }
         
-        self.create_task(task_id, TaskType.IMAGE_GENERATION, params)
+        # 写入任务存储可能要等待其他 worker 释放数据库锁，在线程中执行，不阻塞事件循环
+        await asyncio.to_thread(self.create_task, task_id, TaskType.IMAGE_GENERATION, params)
         
         # 在线程池中异步执行
         loop = asyncio.get_event_loop()
-        loop.run_in_executor(self.executor, self._generate_images_worker, task_id, scenes_data)
+        loop.run_in_executor(
+            self.executor, self._generate_images_worker, task_id, scenes_data, resume, workspace
+        )
         
         return task_id
     
-    def _generate_images_worker(self, task_id: str, scenes_data: List[Dict[str, Any]]):
-        """图片生成工作线程"""
+    def _generate_images_worker(self, task_id: str, scenes_data: List[Dict[str, Any]],
+                                resume: bool, workspace: Workspace):
+        """图片生成工作线程：各场景并发提交到图片线程池，单个场景失败不影响其他场景"""
+        cancel_event = self._begin_task(task_id)
+        if cancel_event is None:
+            return
         try:
-            self.update_task_status(task_id, TaskStatus.RUNNING, progress=0.0)
-            
             total_scenes = len(scenes_data)
-            completed = 0
+            completed_scenes: List[int] = []
+            reused_scenes: List[int] = []
+            failed_scenes: List[Dict[str, Any]] = []
             
             # 确保输出目录存在
-            os.makedirs("output/images", exist_ok=True)
+            os.makedirs(workspace.images_dir, exist_ok=True)
+            
+            scene_progress = _SceneProgress(workspace)
+            report = self._progress_reporter(task_id)
+            futures = {
+                self.image_executor.submit(
+                    self._render_scene_image, idx, scene, workspace, cancel_event, resume,
+                    **scene_progress.listeners(idx)
+                ): idx
+                for idx, scene in enumerate(scenes_data)
+            }
             
+            def overall() -> float:
+                # 已完成场景计 1，渲染中的场景按采样步数计入
+                return (len(completed_scenes) + scene_progress.in_flight()) / total_scenes
+            
+            def build_result() -> Dict[str, Any]:
+                return {
+                    "total_images": total_scenes,
+                    "completed_images": len(completed_scenes),
+                    "completed_scenes": sorted(completed_scenes),
+                    "reused_scenes": sorted(reused_scenes),
+                    "failed_scenes": sorted(failed_scenes, key=lambda item: item["scene"]),
+                    "output_directory": workspace.images_dir
+                }
+            
+            # 每个场景完成后立即记录结果；等待期间按采样步数刷新进度与预览图
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                scene_progress.flush_previews()
+                if cancel_event.is_set():
+                    # 撤下尚未开始的场景，立即释放线程池名额
+                    for future in pending:
+                        future.cancel()
+                for future in done:
+                    idx = futures[future]
+                    scene_progress.finish(idx)
+                    try:
+                        rendered = future.result()
+                        completed_scenes.append(idx)
+                        if rendered:
+                            self.notify_file(workspace.image(idx))
+                            self._submit_derivatives(workspace, idx)
+                        else:
+                            reused_scenes.append(idx)
+                    except CancelledError as e:
+                        if cancel_event.is_set():
+                            continue
+                        # 任务没有被取消（如 ComfyUI 上的 prompt 被他人中断）：按失败记录，不能悄悄丢掉场景
+                        failed_scenes.append({"scene": idx, "error": str(e) or "场景渲染被中止"})
+                    except Exception as e:
+                        failed_scenes.append({"scene": idx, "error": str(e)})
+                    self.update_task_status(task_id, TaskStatus.RUNNING, progress=overall() * 100, result=build_result())
+                if not done:
+                    report(overall())
+            
+            if cancel_event.is_set():
+                self.update_task_status(task_id, TaskStatus.CANCELLED, error_message="任务已取消", result=build_result())
+                return
+            
+            if failed_scenes:
+                error_msg = "；".join(
+                    f"生成场景 {item['scene']} 图片失败: {item['error']}"
+                    for item in build_result()["failed_scenes"]
+                )
+                self.update_task_status(task_id, TaskStatus.FAILED, error_message=error_msg, result=build_result())
+                return
+            
+            # 所有图片生成完成
+            self.update_task_status(task_id, TaskStatus.COMPLETED, progress=100.0, result=build_result())
+            
+        except Exception as e:
+            self.update_task_status(task_id, TaskStatus.FAILED, error_message=str(e))
+        finally:
+            self._end_task(task_id)
+    
+    async def submit_audio_generation_task(self, scenes_data: List[Dict[str, Any]],
+                                           workspace: Optional[Workspace] = None) -> str:
+        """提交配音任务：所有场景的音频与字幕并发合成，同时进行的请求数为 TTS_CONCURRENCY"""
+        workspace = workspace or Workspace()
+        task_id = _new_task_id("audio")
+        params = {
+            "total_scenes": len(scenes_data),
+            "run_id": workspace.run_id,
+        }
+        
+        await asyncio.to_thread(self.create_task, task_id, TaskType.AUDIO_GENERATION, params)
+        
+        loop = asyncio.get_event_loop()
+        loop.run_in_executor(
+            self.executor, self._generate_audios_worker, task_id, scenes_data, workspace
+        )
+        
+        return task_id
+    
+    def _generate_audios_worker(self, task_id: str, scenes_data: List[Dict[str, Any]],
+                                workspace: Workspace):
+        """配音工作线程：在独立事件循环中用 edge-tts 的异步接口并发合成，各场景完成即落盘并记录"""
+        cancel_event = self._begin_task(task_id)
+        if cancel_event is None:
+            return
+        try:
+            total_scenes = len(scenes_data)
+            completed_scenes: List[int] = []
+            failed_scenes: List[Dict[str, Any]] = []
+            
+            jobs = []
             for idx, scene in enumerate(scenes_data):
+                script_path = _write_scene_script(workspace, idx, scene["script"])
+                self.notify_file(script_path)
+                jobs.append(TTSJob(scene["script"], workspace.audio(idx), workspace.subtitle(idx),
+                                   meta_path=workspace.audio_record(idx)))
+            
+            def build_result() -> Dict[str, Any]:
+                return {
+                    "total_scenes": total_scenes,
+                    "completed_scenes": sorted(completed_scenes),
+                    "failed_scenes": sorted(failed_scenes, key=lambda item: item["scene"]),
+                    "audio_directory": workspace.audio_dir,
+                    "subtitle_directory": workspace.subtitles_dir,
+                }
+            
+            def on_done(idx: int, error: Optional[BaseException]):
+                if error is None:
+                    completed_scenes.append(idx)
+                    self.notify_file(workspace.audio(idx))
+                    self.notify_file(workspace.subtitle(idx))
+                else:
+                    failed_scenes.append({"scene": idx, "error": str(error)})
+                progress = (len(completed_scenes) + len(failed_scenes)) / max(1, total_scenes) * 100
+                self.update_task_status(task_id, TaskStatus.RUNNING, progress=progress, result=build_result())
+            
+            async def run_batch():
+                batch = asyncio.ensure_future(synthesize_batch(jobs, TTS_CONCURRENCY, on_done))
+                # 定期醒来检查取消标记
+                while not batch.done():
+                    await asyncio.wait([batch], timeout=1.0)
+                    if cancel_event.is_set():
+                        batch.cancel()
+                        break
                 try:
-                    # 生成单个场景图片
-                    generate_image(
-                        prompt_text=scene["sd_prompt"],
-                        save_path=f"output/images/scene_{idx}.png",
-                    )
-                    completed += 1
-                    progress = (completed / total_scenes) * 100
-                    self.update_task_status(task_id, TaskStatus.RUNNING, progress=progress)
-                    
-                except Exception as e:
-                    error_msg = f"生成场景 {idx} 图片失败: {str(e)}"
-                    self.update_task_status(task_id, TaskStatus.FAILED, error_message=error_msg)
-                    return
+                    await batch
+                except asyncio.CancelledError:
+                    pass
             
-            # 所有图片生成完成
-            result = {
-                "total_images": total_scenes,
-                "completed_images": completed,
-                "output_directory": "output/images"
-            }
-            self.update_task_status(task_id, TaskStatus.COMPLETED, progress=100.0, result=result)
+            asyncio.run(run_batch())
+            
+            if cancel_event.is_set():
+                self.update_task_status(task_id, TaskStatus.CANCELLED, error_message="任务已取消", result=build_result())
+                return
+            
+            if failed_scenes:
+                error_msg = "；".join(
+                    f"生成场景 {item['scene']} 配音失败: {item['error']}"
+                    for item in build_result()["failed_scenes"]
+                )
+                self.update_task_status(task_id, TaskStatus.FAILED, error_message=error_msg, result=build_result())
+                return
+            
+            self.update_task_status(task_id, TaskStatus.COMPLETED, progress=100.0, result=build_result())
             
         except Exception as e:
             self.update_task_status(task_id, TaskStatus.FAILED, error_message=str(e))
+        finally:
+            self._end_task(task_id)
+    
+    def _submit_derivatives(self, workspace: Workspace, idx: int):
+        """在后台生成场景图片的派生图，生成后推送文件事件；不等待结果"""
+        def on_done(future: Future):
+            for path in future.result():
+                self.notify_file(path)
+        
+        self.derivative_executor.submit(_make_scene_derivatives, workspace, idx).add_done_callback(on_done)
+    
+    @staticmethod
+    def _render_scene_image(idx: int, scene: Dict[str, Any], workspace: Workspace,
+                            cancel_event: threading.Event, resume: bool = False,
+                            on_progress: Optional[Callable[[int, int], None]] = None,
+                            on_preview: Optional[Callable[[bytes], None]] = None) -> bool:
+        """渲染单个场景图片，失败时按指数退避加随机抖动重试
+        
+        on_progress / on_preview 透传给 generate_image，接收采样步数进度与潜空间预览图。
+        
+        Returns:
+            bool: 实际渲染返回 True；resume 模式下复用已有图片返回 False
+        """
+        if cancel_event.is_set():
+            raise CancelledError("任务已取消")
+        if resume and _scene_image_matches(workspace, idx, scene):
+            return False
+        
+        seed = _scene_seed(scene)
+        for attempt in range(IMAGE_MAX_ATTEMPTS):
+            try:
+                generate_image(
+                    prompt_text=scene["sd_prompt"],
+                    save_path=workspace.image(idx),
+                    cancel_event=cancel_event,
+                    seed=seed,
+                    on_progress=on_progress,
+                    on_preview=on_preview,
+                )
+                break
+            except (CancelledError, ValueError):
+                # 取消与参数错误不重试
+                raise
+            except Exception as e:
+                if attempt == IMAGE_MAX_ATTEMPTS - 1:
+                    raise
+                delay = IMAGE_RETRY_BASE_DELAY * 2 ** attempt
+                delay = delay / 2 + random.uniform(0, delay / 2)
+                print(f"警告：场景 {idx} 图片生成失败（第 {attempt + 1} 次），{delay:.1f}s 后重试: {e}")
+                if cancel_event.wait(delay):
+                    raise CancelledError("任务已取消")
+        
+        _write_scene_image_record(workspace, idx, scene, seed)
+        return True
     
-    async def submit_video_composition_task(self) -> str:
+    async def submit_video_composition_task(self, workspace: Optional[Workspace] = None) -> str:
         """提交视频合成任务"""
-        task_id = f"video_{int(time.time())}"
-        params = {"output_path": "output/final_video.mp4"}
+        workspace = workspace or Workspace()
+        task_id = _new_task_id("video")
+        params = {"output_path": workspace.final_video, "run_id": workspace.run_id}
         
-        self.create_task(task_id, TaskType.VIDEO_COMPOSITION, params)
+        await asyncio.to_thread(self.create_task, task_id, TaskType.VIDEO_COMPOSITION, params)
         
         # 在线程池中异步执行
         loop = asyncio.get_event_loop()
-        loop.run_in_executor(self.executor, self._generate_video_worker, task_id)
+        loop.run_in_executor(self.executor, self._generate_video_worker, task_id, workspace)
         
         return task_id
     
-    def _generate_video_worker(self, task_id: str):
+    def _generate_video_worker(self, task_id: str, workspace: Workspace):
         """视频合成工作线程"""
+        cancel_event = self._begin_task(task_id)
+        if cancel_event is None:
+            return
         try:
-            self.update_task_status(task_id, TaskStatus.RUNNING, progress=0.0)
-            
-            # 调用视频生成函数
-            result_message = sync_generate_video()
+            # 在渲染子进程中调用视频生成函数，进度由子进程写入共享存储
+            result_message = self._run_render_job(
+                task_id, sync_generate_video, cancel_event,
+                report_progress=True, workspace=workspace,
+            )
             
             if "✅" in result_message:
                 # 成功
+                self.notify_file(workspace.final_video)
                 result = {
-                    "output_path": "output/final_video.mp4",
+                    "output_path": workspace.final_video,
                     "message": result_message
                 }
                 self.update_task_status(task_id, TaskStatus.COMPLETED, progress=100.0, result=result)
@@ -171,27 +933,284 @@ class TaskManager:
                 # 失败
                 self.update_task_status(task_id, TaskStatus.FAILED, error_message=result_message)
                 
+        except CancelledError:
+            self.update_task_status(task_id, TaskStatus.CANCELLED, error_message="任务已取消")
         except Exception as e:
             self.update_task_status(task_id, TaskStatus.FAILED, error_message=str(e))
+        finally:
+            self._end_task(task_id)
+    
+    async def submit_pipeline_task(self, scenes_data: List[Dict[str, Any]],
+                                   resume: bool = False,
+                                   workspace: Optional[Workspace] = None) -> str:
+        """提交流水线任务：图片、配音与场景片段按依赖关系重叠执行，最后拼接成片
+        
+        resume 为 True 时复用提示词未变化的已有场景图片。
+        """
+        workspace = workspace or Workspace()
+        task_id = _new_task_id("pipeline")
+        params = {
+            "scenes": scenes_data,
+            "total_scenes": len(scenes_data),
+            "output_path": workspace.final_video,
+            "resume": resume,
+            "run_id": workspace.run_id,
+        }
+        
+        await asyncio.to_thread(self.create_task, task_id, TaskType.VIDEO_PIPELINE, params)
+        
+        # 调度线程只负责等待各阶段完成，实际工作在各自的线程池中执行
+        loop = asyncio.get_event_loop()
+        loop.run_in_executor(
+            self.executor, self._pipeline_worker, task_id, scenes_data, resume, workspace
+        )
+        
+        return task_id
+    
+    def _build_pipeline_graph(self, task_id: str, scenes_data: List[Dict[str, Any]], workspace: Workspace,
+                              cancel_event: threading.Event, resume: bool = False,
+                              scene_progress: Optional[_SceneProgress] = None) -> StageGraph:
+        """构建流水线依赖图：image_i 与 audio_i 并行，derive_i 由图片生成派生图，segment_i 依赖
+        derive_i 与 audio_i，final 依赖所有片段
+        
+        片段渲染与最终拼接在渲染进程池中执行，video_executor 的线程只负责等待结果。
+        """
+        graph = StageGraph()
+        segment_paths = [workspace.segment(idx) for idx in range(len(scenes_data))]
+        
+        for idx, scene in enumerate(scenes_data):
+            graph.add(
+                f"image_{idx}",
+                lambda idx=idx, scene=scene: self._render_scene_image(
+                    idx, scene, workspace, cancel_event, resume,
+                    **(scene_progress.listeners(idx) if scene_progress is not None else {})
+                ),
+                executor=self.image_executor,
+                outputs=[workspace.image(idx)],
+            )
+            graph.add(
+                f"derive_{idx}",
+                lambda idx=idx: _make_scene_derivatives(workspace, idx),
+                deps=[f"image_{idx}"],
+                executor=self.derivative_executor,
+                outputs=[workspace.frame(idx), workspace.web_image(idx), workspace.thumbnail(idx)],
+            )
+            graph.add(
+                f"audio_{idx}",
+                lambda idx=idx, scene=scene: _synthesize_scene_audio(workspace, idx, scene["script"]),
+                executor=self.audio_executor,
+                outputs=[workspace.script(idx), workspace.audio(idx), workspace.subtitle(idx)],
+            )
+            graph.add(
+                f"segment_{idx}",
+                lambda idx=idx: self._run_render_job(
+                    task_id, render_scene_segment, cancel_event, scene_id=idx, workspace=workspace
+                ),
+                # 片段使用预先缩放好的成片帧，因此等待派生图而非原图
+                deps=[f"derive_{idx}", f"audio_{idx}"],
+                executor=self.video_executor,
+                outputs=[segment_paths[idx]],
+            )
+        
+        graph.add(
+            "final",
+            lambda: self._run_render_job(
+                task_id, compose_segments, cancel_event,
+                segment_files=segment_paths, output_path=workspace.final_video,
+            ),
+            deps=[f"segment_{idx}" for idx in range(len(scenes_data))],
+            executor=self.video_executor,
+            outputs=[workspace.final_video],
+        )
+        return graph
+    
+    def _pipeline_worker(self, task_id: str, scenes_data: List[Dict[str, Any]],
+                         resume: bool, workspace: Workspace):
+        """流水线调度线程"""
+        cancel_event = self._begin_task(task_id)
+        if cancel_event is None:
+            return
+        try:
+            workspace.ensure_dirs()
+            
+            scene_progress = _SceneProgress(workspace)
+            report = self._progress_reporter(task_id)
+            graph = self._build_pipeline_graph(
+                task_id, scenes_data, workspace, cancel_event, resume, scene_progress
+            )
+            total_stages = len(graph.stages)
+            
+            def overall() -> float:
+                # 已完成阶段计 1，渲染中的图片阶段按采样步数计入
+                finished = sum(1 for item in graph.stages.values() if item.state == StageState.COMPLETED)
+                return (finished + scene_progress.in_flight()) / total_stages
+            
+            def build_result() -> Dict[str, Any]:
+                return {
+                    "output_path": workspace.final_video,
+                    "stages": {
+                        name: {
+                            "state": stage.state.value,
+                            "error": stage.error,
+                            "duration": (stage.end_time - stage.start_time)
+                            if stage.start_time and stage.end_time else None,
+                        }
+                        for name, stage in graph.stages.items()
+                    },
+                }
+            
+            def on_stage_done(stage: Stage):
+                if stage.name.startswith("image_"):
+                    scene_progress.finish(int(stage.name[len("image_"):]))
+                if stage.state == StageState.COMPLETED:
+                    for path in stage.outputs:
+                        # 按配置未生成的派生图不推送
+                        if os.path.exists(path):
+                            self.notify_file(path)
+                self.update_task_status(task_id, TaskStatus.RUNNING, progress=overall() * 100, result=build_result())
+            
+            def on_tick():
+                scene_progress.flush_previews()
+                report(overall())
+            
+            stages = graph.run(self.executor, on_stage_done=on_stage_done, cancel_event=cancel_event,
+                               on_tick=on_tick)
+            
+            if cancel_event.is_set():
+                self.update_task_status(task_id, TaskStatus.CANCELLED, error_message="任务已取消", result=build_result())
+                return
+            
+            # 任务未被取消时，任何没有完成的阶段（失败、执行中被取消、因上游未完成而跳过）都意味着没有成片
+            unfinished = [stage for stage in stages.values() if stage.state != StageState.COMPLETED]
+            if unfinished:
+                # 跳过的阶段只是连带结果，报告其根因
+                failed = [stage for stage in unfinished if stage.state != StageState.SKIPPED] or unfinished
+                error_msg = "；".join(
+                    f"阶段 {stage.name} 失败: {stage.error}" if stage.state == StageState.FAILED
+                    else f"阶段 {stage.name} 未完成（{stage.state.value}）: {stage.error}"
+                    for stage in failed
+                )
+                self.update_task_status(task_id, TaskStatus.FAILED, error_message=error_msg, result=build_result())
+                return
+            
+            self.update_task_status(task_id, TaskStatus.COMPLETED, progress=100.0, result=build_result())
+            
+        except Exception as e:
+            self.update_task_status(task_id, TaskStatus.FAILED, error_message=str(e))
+        finally:
+            self._end_task(task_id)
+    
+    def collect_metrics(self):
+        """刷新任务队列深度与各执行器利用率指标（执行器部分为当前进程的视图）"""
+        TASKS.clear()
+        unfinished = [TaskStatus.PENDING.value, TaskStatus.RUNNING.value]
+        for task_type, status, count in self.store.count_by_status(unfinished):
+            TASKS.set(count, task_type=task_type, status=status)
+        
+        stats = [
+            (executor.name, executor.max_workers, executor.queued, executor.active)
+            for executor in (self.executor, self.image_executor, self.audio_executor, self.video_executor,
+                             self.derivative_executor)
+        ]
+        with self._render_pool_lock:
+            running = sum(1 for future in self._render_futures if future.running())
+            stats.append(("render", max(1, VIDEO_CONCURRENCY), len(self._render_futures) - running, running))
+        for name, max_workers, queued, active in stats:
+            EXECUTOR_MAX_WORKERS.set(max_workers, executor=name)
+            EXECUTOR_QUEUED.set(queued, executor=name)
+            EXECUTOR_ACTIVE.set(active, executor=name)
+            EXECUTOR_UTILIZATION.set(active / max_workers, executor=name)
+        
+        for backend in backend_stats():
+            COMFYUI_BACKEND_HEALTHY.set(1 if backend["healthy"] else 0, backend=backend["address"])
+            COMFYUI_BACKEND_QUEUE_DEPTH.set(backend["queue_depth"], backend=backend["address"])
+            COMFYUI_BACKEND_INFLIGHT.set(backend["inflight"], backend=backend["address"])
     
     def get_all_tasks_status(self) -> List[Dict[str, Any]]:
         """获取所有任务状态"""
-        return [task.to_dict() for task in self.tasks.values()]
+        return [task.to_dict() for task in self.list_tasks()]
     
     def cleanup_completed_tasks(self, older_than_hours: int = 24):
-        """清理已完成的旧任务"""
-        current_time = time.time()
-        cutoff_time = current_time - (older_than_hours * 3600)
-        
-        with self._lock:
-            to_remove = []
-            for task_id, task in self.tasks.items():
-                if (task.status in [TaskStatus.COMPLETED, TaskStatus.FAILED] and 
-                    task.end_time and task.end_time < cutoff_time):
-                    to_remove.append(task_id)
-            
-            for task_id in to_remove:
-                del self.tasks[task_id]
+        """清理已完成的旧任务；worker 已退出的遗留任务先标记为失败，到期后一并清理"""
+        self.reap_orphaned_tasks()
+        cutoff_time = time.time() - (older_than_hours * 3600)
+        self.store.delete_finished_before(
+            [TaskStatus.COMPLETED.value, TaskStatus.FAILED.value, TaskStatus.CANCELLED.value], cutoff_time
+        )
+
+
+def _is_orphaned(data: Dict[str, Any]) -> bool:
+    """存储中的任务记录是否未结束且心跳已超时"""
+    if TaskStatus(data["status"]).is_finished:
+        return False
+    heartbeat = data.get("heartbeat_at") or data["updated_at"]
+    return heartbeat < time.time() - TASK_HEARTBEAT_TIMEOUT
+
+
+def _scene_seed(scene: Dict[str, Any]) -> int:
+    """场景图片的种子：优先使用场景指定的种子，其次按配置由提示词派生或随机生成"""
+    if scene.get("seed") is not None:
+        return scene["seed"]
+    if IMAGE_DETERMINISTIC_SEED:
+        digest = hashlib.sha256(scene["sd_prompt"].encode("utf-8")).digest()
+        return int.from_bytes(digest[:4], "big") & 0x7FFFFFFF
+    return random.randint(0, 2147483647)
+
+
+def _make_scene_derivatives(workspace: Workspace, idx: int) -> List[str]:
+    """生成场景图片的派生图；失败只影响派生图本身，合成视频时回退到原图"""
+    try:
+        return make_derivatives(
+            workspace.image(idx),
+            frame_path=workspace.frame(idx),
+            frame_size=VIDEO_SIZE,
+            webp_path=workspace.web_image(idx),
+            thumbnail_path=workspace.thumbnail(idx),
+        )
+    except Exception as e:
+        print(f"警告：生成场景 {idx} 的派生图失败: {e}")
+        return []
+
+
+def _write_scene_image_record(workspace: Workspace, idx: int, scene: Dict[str, Any], seed: int):
+    """记录场景图片对应的提示词与种子，供 resume 模式判断图片是否可复用"""
+    record = {"sd_prompt": scene["sd_prompt"], "seed": seed}
+    with open(workspace.image_record(idx), "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False)
+
+
+def _scene_image_matches(workspace: Workspace, idx: int, scene: Dict[str, Any]) -> bool:
+    """场景图片已存在，且记录的提示词（以及指定的种子）与当前场景一致"""
+    if not os.path.exists(workspace.image(idx)):
+        return False
+    try:
+        with open(workspace.image_record(idx), "r", encoding="utf-8") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if record.get("sd_prompt") != scene.get("sd_prompt"):
+        return False
+    return scene.get("seed") is None or record.get("seed") == scene.get("seed")
+
+
+def _write_scene_script(workspace: Workspace, idx: int, script: str) -> str:
+    """保存场景脚本，返回脚本路径"""
+    script_path = workspace.script(idx)
+    os.makedirs(workspace.scripts_dir, exist_ok=True)
+    with open(script_path, "w", encoding="utf-8") as sf:
+        sf.write(script)
+    return script_path
+
+
+def _synthesize_scene_audio(workspace: Workspace, idx: int, script: str) -> str:
+    """保存场景脚本并生成对应的音频与字幕"""
+    script_path = _write_scene_script(workspace, idx, script)
+    return generate_audio_for_script(
+        script_path=script_path,
+        audio_path=workspace.audio(idx),
+        srt_path=workspace.subtitle(idx),
+        meta_path=workspace.audio_record(idx),
+    )
 
 
 # 全局任务管理器实例
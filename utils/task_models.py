@@ -0,0 +1,89 @@
+"""
+任务的数据模型与进度回调，由任务管理器与视频渲染子进程共用
+"""
+import time
+from dataclasses import asdict, dataclass
+from enum import Enum
+from typing import Any, Callable, Dict, Optional
+
+
+class TaskStatus(Enum):
+    PENDING = "pending"      # 等待中
+    RUNNING = "running"      # 运行中
+    COMPLETED = "completed"  # 已完成
+    FAILED = "failed"        # 失败
+    CANCELLED = "cancelled"  # 已取消
+
+    @property
+    def is_finished(self) -> bool:
+        """是否为终态"""
+        return self in (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED)
+
+
+class TaskType(Enum):
+    IMAGE_GENERATION = "image_generation"     # 图片生成
+    VIDEO_COMPOSITION = "video_composition"   # 视频合成
+    VIDEO_PIPELINE = "video_pipeline"         # 图片/配音/视频流水线
+    AUDIO_GENERATION = "audio_generation"     # 配音与字幕生成
+
+
+@dataclass
+class Task:
+    task_id: str
+    task_type: TaskType
+    status: TaskStatus
+    progress: float = 0.0
+    start_time: Optional[float] = None
+    end_time: Optional[float] = None
+    error_message: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    params: Optional[Dict[str, Any]] = None
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        """按已用时间与当前进度线性估计的剩余秒数，无法估计时为 None"""
+        if self.status != TaskStatus.RUNNING or not self.start_time or not 0 < self.progress < 100:
+            return None
+        elapsed = time.time() - self.start_time
+        return round(elapsed * (100 - self.progress) / self.progress, 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data['task_type'] = self.task_type.value
+        data['status'] = self.status.value
+        data['eta_seconds'] = self.eta_seconds
+        return data
+
+    def to_event(self) -> Dict[str, Any]:
+        """任务事件的数据：参数中包含完整分镜内容，事件里不需要"""
+        data = self.to_dict()
+        data.pop("params", None)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Task":
+        return cls(
+            task_id=data["task_id"],
+            task_type=TaskType(data["task_type"]),
+            status=TaskStatus(data["status"]),
+            progress=data.get("progress") or 0.0,
+            start_time=data.get("start_time"),
+            end_time=data.get("end_time"),
+            error_message=data.get("error_message"),
+            result=data.get("result"),
+            params=data.get("params"),
+        )
+
+
+def progress_reporter(update: Callable[[float], None], start: float = 0.0,
+                      span: float = 100.0) -> Callable[[float], None]:
+    """返回进度回调（参数 0~1），映射到 [start, start + span] 并按整数百分比节流调用 update"""
+    last = [-1]
+
+    def report(fraction: float):
+        progress = start + span * fraction
+        if int(progress) > last[0]:
+            last[0] = int(progress)
+            update(progress)
+
+    return report
@@ -0,0 +1,354 @@
+"""
+任务持久化存储，基于 SQLite（WAL 模式），供多个 uvicorn worker 共享任务状态
+"""
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional, List, Tuple
+
+# 默认数据库路径，可通过环境变量 TASK_DB_PATH 覆盖；":memory:" 表示进程内的本地替身
+DEFAULT_DB_PATH = os.getenv("TASK_DB_PATH") or ".cache/tasks.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id       TEXT PRIMARY KEY,
+    task_type     TEXT NOT NULL,
+    status        TEXT NOT NULL,
+    progress      REAL NOT NULL DEFAULT 0,
+    start_time    REAL,
+    end_time      REAL,
+    error_message TEXT,
+    result        TEXT,
+    params        TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    owner         TEXT,
+    heartbeat_at  REAL,
+    created_at    REAL NOT NULL,
+    updated_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status);
+CREATE INDEX IF NOT EXISTS idx_tasks_type_status ON tasks (task_type, status);
+CREATE TABLE IF NOT EXISTS events (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    event      TEXT NOT NULL,
+    data       TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    name   TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    value  REAL NOT NULL,
+    PRIMARY KEY (name, labels)
+);
+"""
+
+# 事件表保留的最近事件条数，更早的事件在写入时顺带清理
+EVENT_RETENTION = 5000
+
+# 以 JSON 文本形式存储的字段
+_JSON_FIELDS = ("result", "params")
+
+# 旧版本数据库中缺失、需要补充的列
+_MIGRATIONS = {
+    "cancel_requested": "INTEGER NOT NULL DEFAULT 0",
+    "owner": "TEXT",
+    "heartbeat_at": "REAL",
+}
+
+# 终态，进入后状态不再被覆盖
+_FINISHED_STATUSES = ("completed", "failed", "cancelled")
+_UNFINISHED_STATUSES = ("pending", "running")
+
+
+def _serialized(method):
+    """内存库的写操作在进程内串行执行：共享缓存按表加锁，并发写入直接报
+    "database table is locked"，不会像文件库那样等待锁释放"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._write_lock is None:
+            return method(self, *args, **kwargs)
+        with self._write_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class TaskStore:
+    """SQLite 任务存储，每个线程持有独立连接"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        db_path = db_path or DEFAULT_DB_PATH
+        if db_path == ":memory:":
+            # 共享缓存的内存数据库，使同一进程内的多个线程看到同一份数据
+            self._uri = f"file:tasks_{id(self)}?mode=memory&cache=shared"
+            # 内存库在最后一个连接关闭时销毁，因此保留一个常驻连接
+            self._keepalive = sqlite3.connect(self._uri, uri=True)
+            self._write_lock: Optional[threading.RLock] = threading.RLock()
+        else:
+            dir_name = os.path.dirname(db_path)
+            if dir_name:
+                os.makedirs(dir_name, exist_ok=True)
+            self._uri = f"file:{os.path.abspath(db_path)}"
+            self._keepalive = None
+            self._write_lock = None
+        self.db_path = db_path
+        self._local = threading.local()
+
+        conn = self._connect()
+        if self._keepalive is None:
+            # WAL 允许读写并发，多个进程可同时读取任务状态
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(tasks)")}
+        for column, ddl in _MIGRATIONS.items():
+            if column not in columns:
+                conn.execute(f"ALTER TABLE tasks ADD COLUMN {column} {ddl}")
+        conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._uri, uri=True, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if self._write_lock is not None:
+                # 读取不加表锁，不与进行中的写入冲突
+                conn.execute("PRAGMA read_uncommitted=1")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        data = dict(row)
+        for field in _JSON_FIELDS:
+            if data.get(field) is not None:
+                data[field] = json.loads(data[field])
+        return data
+
+    @_serialized
+    def insert(self, task: Dict[str, Any], owner: Optional[str] = None):
+        """插入一个新任务（同 ID 任务会被覆盖）；owner 为负责执行它的 worker 标识"""
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO tasks (
+                    task_id, task_type, status, progress, start_time, end_time,
+                    error_message, result, params, owner, heartbeat_at, created_at, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    task["task_id"],
+                    task["task_type"],
+                    task["status"],
+                    task.get("progress", 0.0),
+                    task.get("start_time"),
+                    task.get("end_time"),
+                    task.get("error_message"),
+                    json.dumps(task["result"], ensure_ascii=False) if task.get("result") is not None else None,
+                    json.dumps(task["params"], ensure_ascii=False) if task.get("params") is not None else None,
+                    owner,
+                    now,
+                    now,
+                    now,
+                ),
+            )
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """按 ID 读取任务"""
+        row = self._connect().execute(
+            "SELECT * FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    @_serialized
+    def update_status(self, task_id: str, status: str,
+                      progress: Optional[float] = None, error_message: Optional[str] = None,
+                      result: Optional[Dict[str, Any]] = None,
+                      start_time: Optional[float] = None, end_time: Optional[float] = None) -> bool:
+        """原子更新任务状态；为 None 的字段保持原值，start_time 只在首次写入。
+
+        已处于终态（完成/失败/取消）的任务不会被再次修改，返回 False。
+        """
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                """
+                UPDATE tasks SET
+                    status = ?,
+                    progress = COALESCE(?, progress),
+                    error_message = COALESCE(?, error_message),
+                    result = COALESCE(?, result),
+                    start_time = COALESCE(start_time, ?),
+                    end_time = COALESCE(?, end_time),
+                    heartbeat_at = ?,
+                    updated_at = ?
+                WHERE task_id = ? AND status NOT IN (?, ?, ?)
+                """,
+                (
+                    status,
+                    progress,
+                    error_message,
+                    json.dumps(result, ensure_ascii=False) if result is not None else None,
+                    start_time,
+                    end_time,
+                    now,
+                    now,
+                    task_id,
+                    *_FINISHED_STATUSES,
+                ),
+            )
+        return cursor.rowcount > 0
+
+    @_serialized
+    def request_cancel(self, task_id: str) -> bool:
+        """为未结束的任务设置取消标记，由执行该任务的 worker 轮询后中止"""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET cancel_requested = 1, updated_at = ? "
+                "WHERE task_id = ? AND status NOT IN (?, ?, ?)",
+                (time.time(), task_id, *_FINISHED_STATUSES),
+            )
+        return cursor.rowcount > 0
+
+    @_serialized
+    def heartbeat(self, owner: str) -> int:
+        """刷新 owner 负责的所有未结束任务的心跳时间，返回刷新的任务数"""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET heartbeat_at = ? WHERE owner = ? AND status IN (?, ?)",
+                (time.time(), owner, *_UNFINISHED_STATUSES),
+            )
+        return cursor.rowcount
+
+    @_serialized
+    def fail_orphaned(self, cutoff_time: float, error_message: str,
+                      task_ids: Optional[List[str]] = None) -> List[str]:
+        """把心跳早于 cutoff_time 的未结束任务标记为失败，返回这些任务的ID
+
+        执行任务的 worker 异常退出（或服务重启）后，任务会停在等待中/运行中，心跳不再刷新。
+        旧数据库中没有心跳的任务按最后更新时间判断。task_ids 为 None 时检查全部任务。
+        """
+        clauses = ["status IN (?, ?)", "COALESCE(heartbeat_at, updated_at) < ?"]
+        args: List[Any] = [*_UNFINISHED_STATUSES, cutoff_time]
+        if task_ids is not None:
+            if not task_ids:
+                return []
+            clauses.append(f"task_id IN ({', '.join('?' for _ in task_ids)})")
+            args.extend(task_ids)
+        where = " AND ".join(clauses)
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            orphaned = [row[0] for row in conn.execute(f"SELECT task_id FROM tasks WHERE {where}", args)]
+            if orphaned:
+                conn.execute(
+                    f"UPDATE tasks SET status = 'failed', error_message = ?, end_time = ?, updated_at = ? "
+                    f"WHERE {where}",
+                    (error_message, now, now, *args),
+                )
+        return orphaned
+
+    def cancel_requested_ids(self, task_ids: List[str]) -> List[str]:
+        """返回给定任务中已被请求取消的任务ID"""
+        if not task_ids:
+            return []
+        placeholders = ", ".join("?" for _ in task_ids)
+        rows = self._connect().execute(
+            f"SELECT task_id FROM tasks WHERE cancel_requested = 1 AND task_id IN ({placeholders})",
+            task_ids,
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def list_tasks(self, status: Optional[str] = None, task_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        """按状态/类型查询任务（走索引），按创建时间排序"""
+        clauses = []
+        args: List[Any] = []
+        if task_type is not None:
+            clauses.append("task_type = ?")
+            args.append(task_type)
+        if status is not None:
+            clauses.append("status = ?")
+            args.append(status)
+        sql = "SELECT * FROM tasks"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY created_at"
+        rows = self._connect().execute(sql, args).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    @_serialized
+    def delete_finished_before(self, statuses: List[str], cutoff_time: float) -> int:
+        """删除指定状态中结束时间早于 cutoff_time 的任务，返回删除数量"""
+        placeholders = ", ".join("?" for _ in statuses)
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                f"DELETE FROM tasks WHERE status IN ({placeholders}) "
+                "AND end_time IS NOT NULL AND end_time < ?",
+                (*statuses, cutoff_time),
+            )
+        return cursor.rowcount
+
+    @_serialized
+    def append_event(self, event: str, data: Dict[str, Any]) -> int:
+        """追加一条事件，返回单调递增的事件ID"""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO events (event, data, created_at) VALUES (?, ?, ?)",
+                (event, json.dumps(data, ensure_ascii=False), time.time()),
+            )
+            event_id = cursor.lastrowid
+            if event_id % 500 == 0:
+                conn.execute("DELETE FROM events WHERE id <= ?", (event_id - EVENT_RETENTION,))
+        return event_id
+
+    def events_after(self, after_id: int, limit: int = 500) -> List[Dict[str, Any]]:
+        """读取 ID 大于 after_id 的事件"""
+        rows = self._connect().execute(
+            "SELECT id, event, data, created_at FROM events WHERE id > ? ORDER BY id LIMIT ?",
+            (after_id, limit),
+        ).fetchall()
+        return [
+            {"id": row["id"], "event": row["event"], "data": json.loads(row["data"]),
+             "created_at": row["created_at"]}
+            for row in rows
+        ]
+
+    def count_by_status(self, statuses: List[str]) -> List[Tuple[str, str, int]]:
+        """按 (任务类型, 状态) 统计指定状态的任务数"""
+        placeholders = ", ".join("?" for _ in statuses)
+        rows = self._connect().execute(
+            f"SELECT task_type, status, COUNT(*) FROM tasks WHERE status IN ({placeholders}) "
+            "GROUP BY task_type, status",
+            statuses,
+        ).fetchall()
+        return [(row[0], row[1], row[2]) for row in rows]
+
+    @_serialized
+    def add_metric_values(self, rows: List[Tuple[str, str, float]]):
+        """累加指标样本 (名称, 标签 JSON, 增量)"""
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT INTO metrics (name, labels, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+                rows,
+            )
+
+    def metric_values(self) -> List[Tuple[str, str, float]]:
+        """读取所有累计的指标样本"""
+        rows = self._connect().execute("SELECT name, labels, value FROM metrics").fetchall()
+        return [(row[0], row[1], row[2]) for row in rows]
+
+    def event_id_range(self) -> Tuple[int, int]:
+        """返回当前保留事件的 (最小ID, 最大ID)，无事件时为 (0, 0)"""
+        row = self._connect().execute("SELECT MIN(id), MAX(id) FROM events").fetchone()
+        return (row[0] or 0, row[1] or 0)
@@ -1,65 +1,124 @@
+import asyncio
+import concurrent.futures
+import math
 import os
+import threading
 import pysrt
-import subprocess
 from typing import Optional, List, Tuple
 from datetime import timedelta
 from pydub import AudioSegment
 
-try:
-    # 检查edge-tts是否可用
-    subprocess.run(["edge-tts", "--help"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
-except (FileNotFoundError, subprocess.SubprocessError):
-    print("警告: edge-tts 命令未找到，音频生成功能将不可用")
+# 音色类型到 edge-tts 音色的映射，未知类型使用旁白音色
+VOICE_MAP = {
+    "male": "zh-CN-YunxiNeural",
+    "female": "zh-CN-XiaoxiaoNeural",
+    "narrator": "zh-CN-YunyangNeural"
+}
+DEFAULT_VOICE_TYPE = "narrator"
+# 同步接口等待单段文本合成的秒数上限；批量合成按并发轮数放大
+TTS_TIMEOUT = float(os.getenv("TTS_TIMEOUT", "120"))
+
+# 合成引擎（utils.edge_tts）在首次使用时才导入；不可用时只警告一次，之后的调用直接报错
+_engine_module = None
+_engine_error: Optional[str] = None
+# 所有合成都在同一个后台事件循环上进行，多音色、多句子的合成共享一个循环与并发上限
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
+
+
+def _engine():
+    global _engine_module, _engine_error
+    with _lock:
+        if _engine_module is None and _engine_error is None:
+            try:
+                from utils import edge_tts as engine
+            except ImportError as e:
+                _engine_error = f"edge-tts 未安装，音频生成功能将不可用: {e}"
+                print(f"警告: {_engine_error}")
+            else:
+                _engine_module = engine
+        if _engine_module is None:
+            raise RuntimeError(_engine_error)
+        return _engine_module
+
+
+def is_available() -> bool:
+    """edge-tts 是否可用（首次调用时检查）"""
+    try:
+        _engine()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="tts-loop", daemon=True).start()
+        return _loop
+
+
+def _run(coro, timeout: float = TTS_TIMEOUT):
+    """在 TTS 后台事件循环上执行协程并等待结果，供同步调用方使用
+
+    在运行中的事件循环里调用会阻塞该循环，因此直接报错，调用方应改为 await 对应的 *_async 版本；
+    超过 timeout 秒时撤销合成并抛出 TimeoutError。
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        coro.close()
+        raise RuntimeError(
+            "不能在运行中的事件循环里调用同步 TTS 接口，请改为 await generate_audio_async、"
+            "generate_audio_with_srt_async 或 generate_sentence_audio_and_srt_async"
+        )
+    future = asyncio.run_coroutine_threadsafe(coro, _background_loop())
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise TimeoutError(f"TTS 合成超时（{timeout:g}s）")
+
+
+def _voice(voice_type: str) -> str:
+    return VOICE_MAP.get(voice_type, VOICE_MAP[DEFAULT_VOICE_TYPE])
+
+
+def _audio_duration(audio_path: str) -> float:
+    """edge-tts 输出恒定码率的 MP3，时长由文件大小直接算出，无需解码"""
+    return os.path.getsize(audio_path) * 8 / _engine().AUDIO_BITRATE
+
+
+async def generate_audio_async(text: str, audio_path: str, srt_path: Optional[str] = None,
+                               voice_type: str = DEFAULT_VOICE_TYPE):
+    """generate_audio 的异步版本，可在任意事件循环中 await"""
+    engine = _engine()
+    try:
+        await engine.synthesize(text, audio_path, srt_path, _voice(voice_type))
+    except Exception as e:
+        raise RuntimeError(f"edge-tts 生成音频失败: {e}")
+
+    print(f"✅ 音频已生成 ({voice_type} 音色): {audio_path}")
 
 
 def generate_audio(text: str, audio_path: str, srt_path: Optional[str] = None, voice_type: str = "narrator"):
     """
     使用edge-tts生成音频
-    
+
+    在进程内通过 edge-tts 的异步接口合成（与 utils.edge_tts 共用合成缓存），不再为每段文本
+    启动 edge-tts 子进程。输出为 MP3 数据，与文件扩展名无关。
+
     Args:
         text: 要转换为语音的文本
         audio_path: 输出音频文件路径
         srt_path: 输出SRT字幕文件路径（可选）
         voice_type: 音色类型 ("male", "female", "narrator")
     """
-    # 确保输出目录存在
-    if os.path.dirname(audio_path):
-        os.makedirs(os.path.dirname(audio_path), exist_ok=True)
-    
-    # 如果有字幕路径，确保该目录存在
-    if srt_path and os.path.dirname(srt_path):
-        os.makedirs(os.path.dirname(srt_path), exist_ok=True)
-    
-    # 根据音色类型选择对应的edge-tts音色
-    voice_map = {
-        "male": "zh-CN-YunxiNeural",
-        "female": "zh-CN-XiaoxiaoNeural", 
-        "narrator": "zh-CN-YunyangNeural"
-    }
-    
-    # 如果指定的音色类型不存在，使用默认音色
-    voice = voice_map.get(voice_type, "zh-CN-YunyangNeural")
-    
-    # 使用subprocess调用edge-tts命令行工具
-    import subprocess
-    
-    try:
-        cmd = ["edge-tts", "--text", text, "--voice", voice, "--write-media", audio_path]
-        
-        # 如果需要生成字幕
-        if srt_path:
-            cmd.extend(["--write-subtitles", srt_path])
-        
-        # 执行命令
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            raise RuntimeError(f"edge-tts执行失败: {result.stderr}")
-            
-    except Exception as e:
-        raise RuntimeError(f"edge-tts 生成音频失败: {e}")
-    
-    print(f"✅ 音频已生成 ({voice_type} 音色): {audio_path}")
+    _run(generate_audio_async(text, audio_path, srt_path, voice_type))
 
 
 def generate_audio_for_script(script_path: str, audio_path: str, srt_path: str, voice_type: str = "narrator") -> str:
@@ -121,6 +180,30 @@ def split_text_into_sentences(text: str) -> List[str]:
     return refined_sentences
 
 
+async def generate_audio_with_srt_async(text: str, audio_path: str, srt_path: str,
+                                        voice_type: str = DEFAULT_VOICE_TYPE) -> Tuple[float, str]:
+    """generate_audio_with_srt 的异步版本"""
+    engine = _engine()
+    # 生成音频
+    await generate_audio_async(text, audio_path, voice_type=voice_type)
+
+    # 获取音频时长
+    try:
+        duration = _audio_duration(audio_path)
+    except OSError as e:
+        print(f"警告：无法获取音频时长: {e}")
+        duration = len(text) * 0.1  # 估算时长（每个字符0.1秒）
+
+    # 生成SRT字幕文件：整段文本一条字幕，覆盖全部时长
+    srt_content = engine.format_srt([engine.SubtitleCue(1, 0.0, duration, text)])
+    if os.path.dirname(srt_path):
+        os.makedirs(os.path.dirname(srt_path), exist_ok=True)
+    with open(srt_path, "w", encoding="utf-8") as f:
+        f.write(srt_content)
+
+    return duration, f"已生成音频 ({duration:.2f}s) 和SRT字幕"
+
+
 def generate_audio_with_srt(text: str, audio_path: str, srt_path: str, voice_type: str = "narrator") -> Tuple[float, str]:
     """
     生成音频文件和对应的SRT字幕文件
@@ -134,34 +217,7 @@ def generate_audio_with_srt(text: str, audio_path: str, srt_path: str, voice_typ
     Returns:
         Tuple[float, str]: (音频时长, 结果描述)
     """
-    # 确保输出目录存在
-    os.makedirs(os.path.dirname(audio_path), exist_ok=True)
-    os.makedirs(os.path.dirname(srt_path), exist_ok=True)
-    
-    # 生成音频
-    generate_audio(text, audio_path, voice_type=voice_type)
-    
-    # 获取音频时长
-    try:
-        audio = AudioSegment.from_file(audio_path)
-        duration = len(audio) / 1000.0  # 转换为秒
-    except Exception as e:
-        print(f"警告：无法获取音频时长: {e}")
-        duration = len(text) * 0.1  # 估算时长（每个字符0.1秒）
-    
-    # 生成SRT字幕文件
-    srt_content = pysrt.SubRipFile()
-    srt_item = pysrt.SubRipItem()
-    srt_item.index = 1
-    srt_item.start = pysrt.SubRipTime(0, 0, 0, 0)
-    srt_item.end = pysrt.SubRipTime(seconds=int(duration), milliseconds=int((duration % 1) * 1000))
-    srt_item.text = text
-    srt_content.append(srt_item)
-    
-    # 保存SRT文件
-    srt_content.save(srt_path, encoding='utf-8')
-    
-    return duration, f"已生成音频 ({duration:.2f}s) 和SRT字幕"
+    return _run(generate_audio_with_srt_async(text, audio_path, srt_path, voice_type))
 
 
 def merge_audio_files(audio_files: List[str], output_path: str) -> str:
@@ -303,9 +359,48 @@ def merge_srt_files(srt_files: List[str], output_path: str) -> str:
     return f"已合并 {len(srt_files)} 个SRT文件，共 {len(combined_srt)} 个字幕条目"
 
 
+def _sentence_jobs(sentences: List[Tuple[str, str]], output_dir: str, scene_id: int) -> List[Tuple[str, str, str, str]]:
+    jobs = []
+    for i, (text, voice_type) in enumerate(sentences):
+        sentence_id = i + 1
+        audio_file = os.path.join(output_dir, f"scene_{scene_id}_sentence_{sentence_id}.wav")
+        srt_file = os.path.join(output_dir, f"scene_{scene_id}_sentence_{sentence_id}.srt")
+        jobs.append((text, audio_file, srt_file, voice_type))
+    return jobs
+
+
+async def generate_sentence_audio_and_srt_async(sentences: List[Tuple[str, str]], output_dir: str,
+                                                scene_id: int) -> Tuple[List[str], List[str]]:
+    """generate_sentence_audio_and_srt 的异步版本"""
+    jobs = _sentence_jobs(sentences, output_dir, scene_id)
+    # 并发合成各句，同时进行的请求数不超过 TTS_CONCURRENCY
+    semaphore = asyncio.Semaphore(max(1, _engine().TTS_CONCURRENCY))
+
+    async def run(text: str, audio_file: str, srt_file: str, voice_type: str):
+        async with semaphore:
+            return await generate_audio_with_srt_async(text, audio_file, srt_file, voice_type)
+
+    results = await asyncio.gather(*(run(*job) for job in jobs), return_exceptions=True)
+
+    audio_files = []
+    srt_files = []
+    for sentence_id, ((_, audio_file, srt_file, _), outcome) in enumerate(zip(jobs, results), 1):
+        if isinstance(outcome, BaseException):
+            print(f"❌ 句子 {sentence_id} 生成失败: {outcome}")
+            continue
+        _, result = outcome
+        audio_files.append(audio_file)
+        srt_files.append(srt_file)
+        print(f"✅ 句子 {sentence_id}: {result}")
+
+    return audio_files, srt_files
+
+
 def generate_sentence_audio_and_srt(sentences: List[Tuple[str, str]], output_dir: str, scene_id: int) -> Tuple[List[str], List[str]]:
     """
     为句子列表生成音频和SRT文件
+
+    所有句子（不论音色）在同一个事件循环上并发合成，单句失败不影响其他句子。
     
     Args:
         sentences: 句子列表，每个元素为 (text, voice_type)
@@ -315,23 +410,11 @@ def generate_sentence_audio_and_srt(sentences: List[Tuple[str, str]], output_dir
     Returns:
         Tuple[List[str], List[str]]: (音频文件列表, SRT文件列表)
     """
-    audio_files = []
-    srt_files = []
-    
-    for i, (text, voice_type) in enumerate(sentences):
-        sentence_id = i + 1
-        audio_file = os.path.join(output_dir, f"scene_{scene_id}_sentence_{sentence_id}.wav")
-        srt_file = os.path.join(output_dir, f"scene_{scene_id}_sentence_{sentence_id}.srt")
-        
-        try:
-            duration, result = generate_audio_with_srt(text, audio_file, srt_file, voice_type)
-            audio_files.append(audio_file)
-            srt_files.append(srt_file)
-            print(f"✅ 句子 {sentence_id}: {result}")
-        except Exception as e:
-            print(f"❌ 句子 {sentence_id} 生成失败: {e}")
-    
-    return audio_files, srt_files
+    if not sentences:
+        return [], []
+    rounds = math.ceil(len(sentences) / max(1, _engine().TTS_CONCURRENCY))
+    return _run(generate_sentence_audio_and_srt_async(sentences, output_dir, scene_id),
+                timeout=TTS_TIMEOUT * rounds)
 
 
 if __name__ == "__main__":
@@ -4,21 +4,90 @@ from moviepy import (
     CompositeAudioClip,
     AudioFileClip,
     ImageClip,
+    VideoFileClip,
     concatenate_videoclips,
     vfx,
     afx
 )
+from moviepy.audio.AudioClip import AudioClip
 from moviepy.video.VideoClip import VideoClip
+import numpy as np
 import os
 import random
+import threading
+from concurrent.futures import CancelledError
+from dataclasses import dataclass
 from moviepy.video.tools.subtitles import SubtitlesClip
-from typing import cast, Optional
+from PIL import Image, ImageOps
+from proglog import ProgressBarLogger
+from typing import Callable, cast, List, Optional, Sequence, Tuple
 import dotenv
+from utils.edge_tts import AudioMetadata, SubtitleCue
+from utils.metrics import VIDEO_STAGE_SECONDS
+from utils.workspace import Workspace
 
 dotenv.load_dotenv()
 
 FONT_PATH = os.getenv("FONT_PATH") or 'assets/font/MapleMono-NF-CN-Regular.ttf'
 
+# 支持的扩展名
+AUDIO_EXTS = [".mp3", ".wav", ".ogg", ".m4a"]
+IMAGE_EXTS = [".png", ".jpg", ".jpeg", ".webp"]
+
+
+def _parse_size(value: Optional[str]) -> Optional[Tuple[int, int]]:
+    if not value:
+        return None
+    try:
+        width, height = (int(part) for part in value.lower().split("x"))
+    except ValueError:
+        print(f"警告：VIDEO_SIZE 格式应为 宽x高，已忽略: {value}")
+        return None
+    return width, height
+
+
+# 成片分辨率（如 720x1440）；未配置时使用场景图片的原始尺寸
+VIDEO_SIZE = _parse_size(os.getenv("VIDEO_SIZE"))
+
+
+class RenderLogger(ProgressBarLogger):
+    """moviepy 渲染日志：按帧回报进度，并在取消信号置位后于下一帧中止渲染"""
+
+    def __init__(self, cancel_event: Optional[threading.Event] = None,
+                 on_progress: Optional[Callable[[float], None]] = None):
+        super().__init__()
+        self.cancel_event = cancel_event
+        self.on_progress = on_progress
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise CancelledError("视频渲染已取消")
+        if self.on_progress is not None and bar == "frame_index" and attr == "index":
+            total = self.bars[bar].get("total")
+            if total:
+                self.on_progress(min(value / total, 1.0))
+
+
+def _write_videofile(clip: VideoClip, output_path: str,
+                     cancel_event: Optional[threading.Event] = None,
+                     on_progress: Optional[Callable[[float], None]] = None,
+                     logger="bar"):
+    """渲染视频文件；被取消时删除未写完的输出与临时音频"""
+    temp_dir = os.path.dirname(output_path)
+    if cancel_event is not None or on_progress is not None:
+        logger = RenderLogger(cancel_event, on_progress)
+    try:
+        clip.write_videofile(output_path, fps=24, logger=logger, temp_audiofile_path=temp_dir)
+    except CancelledError:
+        name = os.path.splitext(os.path.basename(output_path))[0]
+        for ext in (".mp3", ".ogg"):
+            temp_audio = os.path.join(temp_dir, f"{name}TEMP_MPY_wvf_snd{ext}")
+            if os.path.exists(temp_audio):
+                os.remove(temp_audio)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
 
 def _find_with_exts(base_dir: str, base_name: str, exts: list[str]) -> Optional[str]:
     """在 base_dir 下按给定扩展名顺序查找文件，返回首个存在的路径。"""
@@ -29,21 +98,123 @@ def _find_with_exts(base_dir: str, base_name: str, exts: list[str]) -> Optional[
     return None
 
 
-def generate_video() -> str:
+def _scene_image_file(workspace: Workspace, scene_id: int) -> Optional[str]:
+    """场景图片：优先使用后台预先缩放到成片分辨率、且不旧于原图的帧"""
+    image_file = _find_with_exts(workspace.images_dir, f"scene_{scene_id}", IMAGE_EXTS)
+    frame_file = workspace.frame(scene_id)
+    if (image_file and VIDEO_SIZE and os.path.exists(frame_file)
+            and os.path.getmtime(frame_file) >= os.path.getmtime(image_file)):
+        return frame_file
+    return image_file
+
+
+def _load_image_clip(image_file: str, duration: float) -> ImageClip:
+    """加载场景图片；尺寸与 VIDEO_SIZE 不符（派生帧尚未生成）时在此居中裁剪缩放一次"""
+    if VIDEO_SIZE is not None:
+        with Image.open(image_file) as image:
+            if image.size != VIDEO_SIZE:
+                frame = ImageOps.fit(image.convert("RGB"), VIDEO_SIZE, Image.Resampling.LANCZOS)
+                return ImageClip(np.asarray(frame), duration=duration)
+    return ImageClip(image_file, duration=duration)
+
+
+class _ManifestAudioClip(AudioClip):
+    """时长与声道数取自配音元数据的音频片段：渲染读取第一帧时才打开并解码文件，
+    构建与规划时间线时不探测音频"""
+
+    # AudioFileClip 总是把音频解码为双声道，与文件本身的声道数无关
+    DECODED_CHANNELS = 2
+
+    def __init__(self, filename: str, duration: float, fps: int = 44100):
+        super().__init__()
+        self.filename = filename
+        self.fps = fps
+        self.nchannels = self.DECODED_CHANNELS
+        self.duration = self.end = duration
+        self._source: Optional[AudioFileClip] = None
+        self.frame_function = self._read_frame
+
+    def _read_frame(self, t):
+        if self._source is None:
+            self._source = AudioFileClip(self.filename, fps=self.fps)
+        return self._source.get_frame(t)
+
+    def close(self):
+        if self._source is not None:
+            self._source.close()
+            self._source = None
+        super().close()
+
+
+@dataclass
+class ScenePlan:
+    """时间线上的一个场景
+
+    metadata 为合成配音时记录的元数据；旧的运行或外部放入的音频没有元数据，
+    此时 duration 为 None，构建片段时才通过探测音频得到时长。
+    """
+    scene_id: int
+    audio_file: str
+    image_file: str
+    srt_file: Optional[str]
+    metadata: Optional[AudioMetadata]
+
+    @property
+    def duration(self) -> Optional[float]:
+        return self.metadata.duration if self.metadata is not None else None
+
+
+def plan_scene(workspace: Workspace, scene_id: int) -> ScenePlan:
+    """按工作区中的文件与配音元数据规划单个场景，素材缺失时抛出 FileNotFoundError"""
+    base = f"scene_{scene_id}"
+    audio_file = _find_with_exts(workspace.audio_dir, base, AUDIO_EXTS)
+    image_file = _scene_image_file(workspace, scene_id)
+    if not audio_file:
+        raise FileNotFoundError(f"音频缺失: {os.path.join(workspace.audio_dir, base)}.*")
+    if not image_file:
+        raise FileNotFoundError(f"图片缺失: {os.path.join(workspace.images_dir, base)}.*")
+    srt_file = os.path.join(workspace.subtitles_dir, f"{base}.srt")
+    if not os.path.exists(srt_file):
+        srt_file = None
+    metadata = AudioMetadata.load(workspace.audio_record(scene_id), audio_file)
+    return ScenePlan(scene_id, audio_file, image_file, srt_file, metadata)
+
+
+def plan_timeline(workspace: Workspace, scene_ids: Sequence[int]) -> Tuple[List[ScenePlan], List[str]]:
+    """规划成片时间线：返回 (各场景的规划, 缺失素材的说明)，只读取元数据，不打开音频"""
+    plans: List[ScenePlan] = []
+    missing: List[str] = []
+    for scene_id in scene_ids:
+        try:
+            plans.append(plan_scene(workspace, scene_id))
+        except FileNotFoundError as e:
+            missing.append(str(e))
+    return plans, missing
+
+
+def generate_video(workspace: Optional[Workspace] = None,
+                   cancel_event: Optional[threading.Event] = None,
+                   on_progress: Optional[Callable[[float], None]] = None) -> str:
     """
-    根据最新的 output 目录结构（无需 scenes.json）生成最终视频：
-    - 扫描 output/audio 下的 scene_*.{mp3,wav,ogg,m4a}
-    - 匹配 output/images 下对应 scene_*.{png,jpg,jpeg,webp}
-    - 匹配 output/subtitles 下对应 scene_*.srt（可选）
+    根据工作区的目录结构（无需 scenes.json）生成最终视频：
+    - 扫描 audio 下的 scene_*.{mp3,wav,ogg,m4a}
+    - 匹配 images 下对应 scene_*.{png,jpg,jpeg,webp}
+    - 匹配 subtitles 下对应 scene_*.srt（可选）
+    - 读取 audio 下对应的配音元数据 .scene_*.json（可选），时长与字幕取自元数据
+    
+    Args:
+        workspace: 运行工作区，默认使用 output/ 根目录
+        cancel_event: 取消信号，置位后在下一帧中止渲染并抛出 CancelledError
+        on_progress: 渲染进度回调（0~1）
     
     Returns:
         str: 生成结果描述
     """
+    workspace = workspace or Workspace()
     try:
         # 检查必要的目录
-        audio_dir = "output/audio"
-        image_dir = "output/images"
-        srt_dir = "output/subtitles"
+        audio_dir = workspace.audio_dir
+        image_dir = workspace.images_dir
 
         if not os.path.isdir(audio_dir):
             return f"❌ 音频目录不存在: {audio_dir}"
@@ -52,17 +223,12 @@ def generate_video() -> str:
 
         # 收集所有场景的媒体文件（以音频为基准）
         clips = []
-        missing_files = []
-
-        # 支持的扩展名
-        audio_exts = [".mp3", ".wav", ".ogg", ".m4a"]
-        image_exts = [".png", ".jpg", ".jpeg", ".webp"]
 
         # 从音频目录提取 scene_id
         candidates = []
         for fname in os.listdir(audio_dir):
             name_lower = fname.lower()
-            if not any(name_lower.endswith(ext) for ext in audio_exts):
+            if not any(name_lower.endswith(ext) for ext in AUDIO_EXTS):
                 continue
             # 匹配 scene_{id}.ext
             if name_lower.startswith("scene_"):
@@ -72,29 +238,20 @@ def generate_video() -> str:
                     candidates.append(int(parts[1]))
 
         if not candidates:
-            return "❌ 未在 output/audio 下找到任何场景音频文件"
-
-        for scene_id in sorted(candidates):
-            base = f"scene_{scene_id}"
-            audio_file = _find_with_exts(audio_dir, base, audio_exts)
-            image_file = _find_with_exts(image_dir, base, image_exts)
-            srt_file = os.path.join(srt_dir, f"{base}.srt") if os.path.isdir(srt_dir) else None
-            if srt_file and not os.path.exists(srt_file):
-                srt_file = None
-
-            if not audio_file:
-                missing_files.append(f"音频缺失: {os.path.join(audio_dir, base)}.*")
-                continue
-            if not image_file:
-                missing_files.append(f"图片缺失: {os.path.join(image_dir, base)}.*")
-                continue
+            return f"❌ 未在 {audio_dir} 下找到任何场景音频文件"
 
+        # 先由配音元数据规划整条时间线，素材缺失时在打开任何媒体文件之前返回
+        plans, missing_files = plan_timeline(workspace, sorted(candidates))
+        if missing_files:
+            return "❌ 以下文件缺失或处理失败:\n" + "\n".join(missing_files)
+
+        for plan in plans:
             # 创建视频片段
             try:
-                clip = create_video_clip(audio_file, image_file, srt_file)
+                clip = create_video_clip(plan.audio_file, plan.image_file, plan.srt_file, metadata=plan.metadata)
                 clips.append(clip)
             except Exception as e:
-                missing_files.append(f"场景 {scene_id} 处理失败: {str(e)}")
+                missing_files.append(f"场景 {plan.scene_id} 处理失败: {str(e)}")
         
         if missing_files:
             return "❌ 以下文件缺失或处理失败:\n" + "\n".join(missing_files)
@@ -103,15 +260,22 @@ def generate_video() -> str:
             return "❌ 没有可用的视频片段"
         
         # 合成最终视频
-        final_video_path = compose_final_video(clips)
+        final_video_path = compose_final_video(
+            clips, output_path=workspace.final_video, cancel_event=cancel_event, on_progress=on_progress
+        )
         
         return f"✅ 视频生成成功: {final_video_path}\n共包含 {len(clips)} 个场景"
         
+    except CancelledError:
+        raise
     except Exception as e:
         return f"❌ 视频生成失败: {str(e)}"
 
 
-def create_video_clip(audio_file: str, image_file: str, srt_file: Optional[str]) -> VideoClip:
+@VIDEO_STAGE_SECONDS.time(stage="clip")
+def create_video_clip(audio_file: str, image_file: str, srt_file: Optional[str],
+                      cues: Optional[Sequence[SubtitleCue]] = None,
+                      metadata: Optional[AudioMetadata] = None) -> VideoClip:
     """
     创建单个视频片段
     
@@ -119,21 +283,29 @@ def create_video_clip(audio_file: str, image_file: str, srt_file: Optional[str])
         audio_file: 音频文件路径
         image_file: 图片文件路径
         srt_file: 字幕文件路径（可为 None 表示无字幕）
+        cues: 已对齐的字幕条目，提供时直接使用其时间轴，不再读取与解析 srt_file
+        metadata: 配音元数据，提供时时长与字幕条目取自元数据，音频直到渲染时才解码
         
     Returns:
         VideoClip: 视频片段
     """
     # 加载音频
-    audio_clip = AudioFileClip(audio_file)
+    if metadata is not None:
+        audio_clip = _ManifestAudioClip(audio_file, metadata.duration)
+        if cues is None:
+            cues = metadata.cues
+    else:
+        audio_clip = AudioFileClip(audio_file)
     
     # 加载图片并设置持续时间
-    image_clip = ImageClip(image_file, duration=audio_clip.duration)
+    image_clip = _load_image_clip(image_file, audio_clip.duration)
 
     # 创建字幕（可选）
     srt_clip = None
-    if srt_file:
+    subtitles = [((cue.start, cue.end), cue.text) for cue in cues] if cues is not None else srt_file
+    if subtitles:
         srt_clip = SubtitlesClip(
-            subtitles=srt_file,
+            subtitles=subtitles,
             encoding="utf-8",
             make_textclip=lambda text: TextClip(
                 font=FONT_PATH if os.path.exists(FONT_PATH) else "Arial",
@@ -169,12 +341,71 @@ def create_video_clip(audio_file: str, image_file: str, srt_file: Optional[str])
     return video_clip
 
 
-def compose_final_video(clips: list) -> str:
+@VIDEO_STAGE_SECONDS.time(stage="segment")
+def render_scene_segment(scene_id: int, workspace: Optional[Workspace] = None,
+                         cancel_event: Optional[threading.Event] = None) -> str:
+    """
+    渲染单个场景的视频片段，供流水线在场景的图片和音频就绪后立即执行
+    
+    Args:
+        scene_id: 场景序号
+        workspace: 运行工作区，默认使用 output/ 根目录
+        cancel_event: 取消信号
+        
+    Returns:
+        str: 片段文件路径
+    """
+    workspace = workspace or Workspace()
+    plan = plan_scene(workspace, scene_id)
+
+    os.makedirs(workspace.segments_dir, exist_ok=True)
+    segment_path = workspace.segment(scene_id)
+
+    clip = create_video_clip(plan.audio_file, plan.image_file, plan.srt_file, metadata=plan.metadata)
+    try:
+        _write_videofile(clip, segment_path, cancel_event=cancel_event, logger=None)
+    finally:
+        clip.close()
+    return segment_path
+
+
+def compose_segments(segment_files: list[str], output_path: str = "output/final_video.mp4",
+                     cancel_event: Optional[threading.Event] = None,
+                     on_progress: Optional[Callable[[float], None]] = None) -> str:
+    """
+    将已渲染好的场景片段拼接为最终视频
+    
+    Args:
+        segment_files: 按场景顺序排列的片段文件路径
+        output_path: 输出视频文件路径
+        cancel_event: 取消信号
+        on_progress: 渲染进度回调（0~1）
+        
+    Returns:
+        str: 输出视频文件路径
+    """
+    clips = [VideoFileClip(path) for path in segment_files]
+    try:
+        return compose_final_video(
+            clips, output_path=output_path, cancel_event=cancel_event, on_progress=on_progress
+        )
+    finally:
+        for clip in clips:
+            clip.close()
+
+
+@VIDEO_STAGE_SECONDS.time(stage="compose")
+def compose_final_video(clips: list, output_path: str = "output/final_video.mp4",
+                        cancel_event: Optional[threading.Event] = None,
+                        on_progress: Optional[Callable[[float], None]] = None) -> str:
     """
     合成最终视频
     
     Args:
         clips: 视频片段列表
+        output_path: 输出视频文件路径
+        cancel_event: 取消信号
+        on_progress: 渲染进度回调（0~1）
         
     Returns:
         str: 输出视频文件路径
@@ -183,7 +414,9 @@ def compose_final_video(clips: list) -> str:
         raise ValueError("没有视频片段可合成")
     
     # 确保输出目录存在
-    os.makedirs("output", exist_ok=True)
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
     
     # 合并所有视频片段
     final_clip = concatenate_videoclips(clips=clips, method="compose")
@@ -191,14 +424,8 @@ def compose_final_video(clips: list) -> str:
     # 添加背景音乐
     final_clip = add_background_music(final_clip)
     
-    # 输出文件路径
-    output_path = "output/final_video.mp4"
-    
     # 渲染视频
-    final_clip.write_videofile(
-        output_path,
-        fps=24
-    )
+    _write_videofile(final_clip, output_path, cancel_event=cancel_event, on_progress=on_progress)
     
     return output_path
 
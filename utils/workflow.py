@@ -0,0 +1,205 @@
+"""
+ComfyUI 工作流模板：加载并校验一次，按文件修改时间失效；通过命名参数槽位生成每次请求的 prompt
+"""
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# 默认工作流文件（ComfyUI「导出（API）」格式）
+DEFAULT_WORKFLOW_PATH = "assets/workflow/config.json"
+
+_SAMPLER_TYPES = ("KSampler", "KSamplerAdvanced")
+_OUTPUT_TYPE = "SaveImageWebsocket"
+
+# 整数槽位及其允许的最小值
+_INT_SLOTS = {"seed": 0, "width": 8, "height": 8, "steps": 1, "batch_size": 1}
+
+
+@dataclass(frozen=True)
+class Slot:
+    """参数槽位：节点ID与该节点的输入名"""
+    node_id: str
+    input_name: str
+
+
+class WorkflowTemplate:
+    """预编译的工作流模板
+
+    按节点的 class_type 与连线查找参数槽位，而不是写死节点ID：
+    - seed / steps：采样器（KSampler）
+    - positive / negative：采样器正、负向条件所连接的 CLIPTextEncode 的 text
+    - width / height / batch_size：采样器 latent_image 所连接的 EmptyLatentImage
+    - output_node：SaveImageWebsocket 节点；sampler_node：采样器节点（进度与预览消息来自该节点）
+    """
+
+    def __init__(self, workflow: Dict[str, Any], path: str = ""):
+        self.path = path
+        self._workflow = workflow
+        # 工作流内容的哈希，模板变化时缓存键随之变化
+        self.fingerprint = hashlib.sha256(
+            json.dumps(workflow, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        self.slots: Dict[str, Slot] = {}
+        self.output_node = self._find_output_node()
+        self._compile()
+
+    @classmethod
+    def load(cls, path: str) -> "WorkflowTemplate":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), path)
+
+    def _error(self, message: str) -> ValueError:
+        return ValueError(f"工作流模板无效（{self.path or '<内存>'}）: {message}")
+
+    def _find_output_node(self) -> str:
+        nodes = [node_id for node_id, node in self._workflow.items()
+                 if node.get("class_type") == _OUTPUT_TYPE]
+        if len(nodes) != 1:
+            raise self._error(f"需要恰好一个 {_OUTPUT_TYPE} 节点，实际 {len(nodes)} 个")
+        return nodes[0]
+
+    def _linked_node(self, node: Dict[str, Any], input_name: str, class_type: str) -> str:
+        link = node["inputs"].get(input_name)
+        if not isinstance(link, list) or not link:
+            raise self._error(f"采样器缺少输入 {input_name}")
+        node_id = str(link[0])
+        if self._workflow.get(node_id, {}).get("class_type") != class_type:
+            raise self._error(f"采样器的 {input_name} 应连接 {class_type} 节点")
+        return node_id
+
+    def _compile(self):
+        samplers = [node_id for node_id, node in self._workflow.items()
+                    if node.get("class_type") in _SAMPLER_TYPES]
+        if len(samplers) != 1:
+            raise self._error(f"需要恰好一个采样器节点，实际 {len(samplers)} 个")
+        sampler_id = samplers[0]
+        sampler = self._workflow[sampler_id]
+        seed_input = "seed" if "seed" in sampler["inputs"] else "noise_seed"
+
+        positive_id = self._linked_node(sampler, "positive", "CLIPTextEncode")
+        negative_id = self._linked_node(sampler, "negative", "CLIPTextEncode")
+        latent_id = self._linked_node(sampler, "latent_image", "EmptyLatentImage")
+
+        self.sampler_node = sampler_id
+        self.slots = {
+            "positive": Slot(positive_id, "text"),
+            "negative": Slot(negative_id, "text"),
+            "seed": Slot(sampler_id, seed_input),
+            "steps": Slot(sampler_id, "steps"),
+            "width": Slot(latent_id, "width"),
+            "height": Slot(latent_id, "height"),
+            "batch_size": Slot(latent_id, "batch_size"),
+        }
+        for name, slot in self.slots.items():
+            if slot.input_name not in self._workflow[slot.node_id]["inputs"]:
+                raise self._error(f"节点 {slot.node_id} 缺少输入 {slot.input_name}（槽位 {name}）")
+
+    def default(self, name: str) -> Any:
+        """槽位在模板中的默认值"""
+        slot = self.slots[name]
+        return self._workflow[slot.node_id]["inputs"][slot.input_name]
+
+    def render(self, **values: Any) -> Dict[str, Any]:
+        """生成一次请求的 prompt；值为 None 的槽位保持模板默认值
+
+        只复制被修改的节点，其余节点与模板共享，调用方不应原地修改返回结果。
+        """
+        prompt = dict(self._workflow)
+        copied = set()
+        for name, value in values.items():
+            if name not in self.slots:
+                raise ValueError(f"未知的工作流参数: {name}")
+            if value is None:
+                continue
+            if name in _INT_SLOTS:
+                if isinstance(value, bool) or not isinstance(value, int) or value < _INT_SLOTS[name]:
+                    raise ValueError(f"工作流参数 {name} 无效: {value!r}")
+                if name in ("width", "height") and value % 8:
+                    raise ValueError(f"工作流参数 {name} 必须是 8 的倍数: {value}")
+            slot = self.slots[name]
+            if slot.node_id not in copied:
+                node = dict(prompt[slot.node_id])
+                node["inputs"] = dict(node["inputs"])
+                prompt[slot.node_id] = node
+                copied.add(slot.node_id)
+            prompt[slot.node_id]["inputs"][slot.input_name] = value
+        return prompt
+
+    def _is_link(self, value: Any) -> bool:
+        return (isinstance(value, list) and len(value) == 2
+                and isinstance(value[0], str) and value[0] in self._workflow)
+
+    def _downstream(self, node_ids: Set[str]) -> Set[str]:
+        """给定节点及所有（直接或间接）依赖它们的节点"""
+        dependents: Dict[str, Set[str]] = {}
+        for node_id, node in self._workflow.items():
+            for value in node["inputs"].values():
+                if self._is_link(value):
+                    dependents.setdefault(value[0], set()).add(node_id)
+        result = set(node_ids)
+        stack = list(node_ids)
+        while stack:
+            for dependent in dependents.get(stack.pop(), ()):
+                if dependent not in result:
+                    result.add(dependent)
+                    stack.append(dependent)
+        return result
+
+    def render_batch(self, items: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], List[str]]:
+        """把多组参数打包进一个 prompt，返回 (prompt, 各组的输出节点ID)
+
+        取值随组变化的槽位节点及其下游（含输出节点）按组复制为带前缀的子图，其余节点
+        （模型加载、取值相同的负向提示词等）只保留一份，由各子图共享。
+        """
+        if len(items) == 1:
+            return self.render(**items[0]), [self.output_node]
+        varying = set()
+        for name, slot in self.slots.items():
+            values = [item.get(name) for item in items]
+            if any(value != values[0] for value in values):
+                varying.add(slot.node_id)
+        cloned = self._downstream(varying | {self.output_node})
+
+        # 共享节点上的槽位取值各组相同，取第一组渲染即可
+        prompt = {node_id: node for node_id, node in self.render(**items[0]).items()
+                  if node_id not in cloned}
+        outputs = []
+        for idx, item in enumerate(items):
+            prefix = f"b{idx}_"
+            rendered = self.render(**item)
+            for node_id in cloned:
+                node = dict(rendered[node_id])
+                node["inputs"] = {
+                    name: [prefix + value[0], value[1]]
+                    if self._is_link(value) and value[0] in cloned else value
+                    for name, value in node["inputs"].items()
+                }
+                new_id = prefix + node_id
+                if new_id in self._workflow:
+                    raise self._error(f"节点ID {new_id} 与打包前缀冲突")
+                prompt[new_id] = node
+            outputs.append(prefix + self.output_node)
+        return prompt, outputs
+
+
+# 路径 -> ((修改时间, 文件大小), 模板)
+_cache: Dict[str, Tuple[Tuple[int, int], WorkflowTemplate]] = {}
+_cache_lock = threading.Lock()
+
+
+def get_template(path: Optional[str] = None) -> WorkflowTemplate:
+    """获取工作流模板；文件修改后自动重新加载"""
+    path = path or DEFAULT_WORKFLOW_PATH
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+    template = WorkflowTemplate.load(path)
+    with _cache_lock:
+        _cache[path] = (version, template)
+    return template
@@ -0,0 +1,130 @@
+"""
+运行工作区：每次视频生成使用独立的输出目录，多个流水线可在同一台机器上并行执行
+"""
+import os
+import re
+import time
+import uuid
+from dataclasses import dataclass
+
+# 所有产物的根目录
+OUTPUT_ROOT = "output"
+
+_RUN_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def new_run_id() -> str:
+    """生成新的运行ID（时间戳 + 随机后缀，便于按时间排序）"""
+    return f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+
+@dataclass(frozen=True)
+class Workspace:
+    """一次运行的目录布局。run_id 为空时使用 output/ 根目录（兼容旧的单流水线布局），
+    否则使用 output/runs/{run_id}/。"""
+
+    run_id: str = ""
+
+    def __post_init__(self):
+        # run_id 来自前端状态，只允许安全字符，防止路径穿越
+        if self.run_id and not _RUN_ID_PATTERN.match(self.run_id):
+            raise ValueError(f"非法的运行ID: {self.run_id}")
+
+    @property
+    def root(self) -> str:
+        if not self.run_id:
+            return OUTPUT_ROOT
+        return os.path.join(OUTPUT_ROOT, "runs", self.run_id)
+
+    def path(self, *parts: str) -> str:
+        return os.path.join(self.root, *parts)
+
+    # 文本产物
+    @property
+    def novel_content(self) -> str:
+        return self.path("novel_content.txt")
+
+    @property
+    def character_settings(self) -> str:
+        return self.path("character_settings.json")
+
+    @property
+    def scenes(self) -> str:
+        return self.path("scenes.json")
+
+    @property
+    def final_video(self) -> str:
+        return self.path("final_video.mp4")
+
+    # 分场景产物目录
+    @property
+    def images_dir(self) -> str:
+        return self.path("images")
+
+    @property
+    def audio_dir(self) -> str:
+        return self.path("audio")
+
+    @property
+    def subtitles_dir(self) -> str:
+        return self.path("subtitles")
+
+    @property
+    def scripts_dir(self) -> str:
+        return self.path("scripts")
+
+    @property
+    def segments_dir(self) -> str:
+        return self.path("segments")
+
+    @property
+    def frames_dir(self) -> str:
+        return self.path("frames")
+
+    @property
+    def web_dir(self) -> str:
+        return self.path("web")
+
+    # 分场景产物
+    def image(self, idx: int) -> str:
+        return os.path.join(self.images_dir, f"scene_{idx}.png")
+
+    def image_record(self, idx: int) -> str:
+        # 以 . 开头，输出文件树中不展示
+        return os.path.join(self.images_dir, f".scene_{idx}.json")
+
+    def image_preview(self, idx: int) -> str:
+        # 渲染中的潜空间预览图，场景图片完成后删除
+        return os.path.join(self.images_dir, f".scene_{idx}.preview")
+
+    # 场景图片的派生图
+    def frame(self, idx: int) -> str:
+        return os.path.join(self.frames_dir, f"scene_{idx}.png")
+
+    def web_image(self, idx: int) -> str:
+        return os.path.join(self.web_dir, f"scene_{idx}.webp")
+
+    def thumbnail(self, idx: int) -> str:
+        return os.path.join(self.web_dir, f"scene_{idx}_thumb.jpg")
+
+    def audio(self, idx: int) -> str:
+        return os.path.join(self.audio_dir, f"scene_{idx}.mp3")
+
+    def audio_record(self, idx: int) -> str:
+        # 配音元数据（时长、采样率、字幕条目），合成视频时据此规划时间线
+        return os.path.join(self.audio_dir, f".scene_{idx}.json")
+
+    def subtitle(self, idx: int) -> str:
+        return os.path.join(self.subtitles_dir, f"scene_{idx}.srt")
+
+    def script(self, idx: int) -> str:
+        return os.path.join(self.scripts_dir, f"scene_{idx}.txt")
+
+    def segment(self, idx: int) -> str:
+        return os.path.join(self.segments_dir, f"scene_{idx}.mp4")
+
+    def ensure_dirs(self):
+        """创建工作区目录结构"""
+        for dir_path in (self.root, self.images_dir, self.audio_dir,
+                         self.subtitles_dir, self.scripts_dir):
+            os.makedirs(dir_path, exist_ok=True)
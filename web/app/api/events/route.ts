@@ -0,0 +1,35 @@
+// 转发 Python 后端的 SSE 事件流（任务进度与输出文件变化），保持前端同源访问。
+// 配置后端地址：设置环境变量 BACKEND_BASE_URL，例如 http://localhost:8000
+const BASE_URL = process.env.BACKEND_BASE_URL || "http://localhost:8000";
+
+export const dynamic = "force-dynamic";
+
+export async function GET(request: Request) {
+  const headers: Record<string, string> = { Accept: "text/event-stream" };
+  // 浏览器重连时携带 Last-Event-ID，后端据此补发断线期间的事件
+  const lastEventId = request.headers.get("last-event-id");
+  if (lastEventId) {
+    headers["Last-Event-ID"] = lastEventId;
+  }
+
+  try {
+    const res = await fetch(`${BASE_URL}/api/events`, {
+      cache: "no-store",
+      headers,
+      signal: request.signal,
+    });
+    return new Response(res.body, {
+      status: res.status,
+      headers: {
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache, no-transform",
+        Connection: "keep-alive",
+      },
+    });
+  } catch (err: unknown) {
+    console.error("[events] Proxy to Python backend failed:", err);
+    return new Response("Failed to connect to backend event stream", {
+      status: 502,
+    });
+  }
+}
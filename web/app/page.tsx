@@ -14,6 +14,8 @@ import {
 type AgentState = {
   message: string;
   detail: string;
+  // 当前运行的工作区ID（output/runs/{run_id}），由后端分配
+  run_id?: string;
 };
 
 interface FileNode {
@@ -35,9 +37,9 @@ export default function App() {
   const sidebarDragging = useRef(false);
   const previewDragging = useRef(false);
 
-  // 获取文件树数据
+  // 获取文件树数据：首次加载拉取一次，之后仅在后端推送文件事件时刷新
   useEffect(() => {
-    window.setInterval(() => {
+    const loadFileTree = () => {
       fetch("/api/file-tree")
         .then((res) => res.json())
         .then((data) => setFileTreeData(data))
@@ -48,7 +50,25 @@ export default function App() {
             setFileTreeData(mockdata as FileNode);
           });
         });
-    }, 3000);
+    };
+
+    // 短时间内的多个文件事件合并为一次刷新
+    let refreshTimer: number | undefined;
+    const scheduleRefresh = () => {
+      window.clearTimeout(refreshTimer);
+      refreshTimer = window.setTimeout(loadFileTree, 200);
+    };
+
+    loadFileTree();
+    const source = new EventSource("/api/events");
+    source.addEventListener("file", scheduleRefresh);
+    // 断线期间的事件已被清理，重新拉取完整文件树
+    source.addEventListener("reset", scheduleRefresh);
+
+    return () => {
+      window.clearTimeout(refreshTimer);
+      source.close();
+    };
   }, []);
 
   // 拖拽事件处理